@@ -0,0 +1,253 @@
+"""
+Per bucket aggregates of a payload field, with a result cache
+
+a time range is split into fixed buckets (minute, hour or day, aligned to
+the unix epoch) and count, sum, min and max of the field are computed for
+every bucket from the decoded payloads. dashboards ask for the same ranges
+over and over, so buckets are cached per sensor:
+
+- a bucket is closed once its end is more than `late_seconds` in the past
+  and then cached until it's evicted. readings that arrive later than that
+  (a pi resending a buffered batch, an import) are rare, the ingest routes
+  publish an invalidation for their sensor when they see one
+- open buckets are cached with the sensor's ingest watermark, its newest
+  sensor_data_id, and recomputed when it moved. every insert moves it, in
+  any worker, and reading it is a single index lookup
+
+the cache holds one SensorAggregates per sensor (lru over sensors) with at
+most `max_buckets` closed buckets each (lru over buckets). numpy is only
+imported by aggregate(), the ingest routes only need is_late
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import func
+from sqlmodel import select
+
+import metrics
+from models import SensorData
+
+BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+FIELDS = ("distance", "count")
+_EPOCH = datetime(1970, 1, 1)
+
+
+class Stats(NamedTuple):
+    # readings with a value for the field, the others decoded to nan
+    count: int
+    sum: float
+    min: float
+    max: float
+
+    def merge(self, other: "Stats") -> "Stats":
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            return other
+        return Stats(
+            self.count + other.count,
+            self.sum + other.sum,
+            min(self.min, other.min),
+            max(self.max, other.max),
+        )
+
+    def to_json(self) -> dict:
+        if self.count == 0:
+            return {"count": 0, "sum": 0.0, "min": None, "max": None, "mean": None}
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count,
+        }
+
+
+EMPTY = Stats(0, 0.0, math.nan, math.nan)
+
+
+def epoch_seconds(moment: datetime) -> int:
+    if moment.tzinfo is not None:
+        # time_recorded is stored without a time zone, in local time
+        moment = moment.astimezone().replace(tzinfo=None)
+    return math.floor((moment - _EPOCH).total_seconds())
+
+
+def bucket_time(seconds: int) -> datetime:
+    return _EPOCH + timedelta(seconds=seconds)
+
+
+def bucket_starts(start: datetime, end: datetime, width: int) -> list[int]:
+    """
+    Epoch seconds of the buckets overlapping [start, end)
+    """
+
+    first = epoch_seconds(start) // width * width
+    return list(range(first, epoch_seconds(end), width))
+
+
+def compute(values, seconds, first: int, width: int, n: int):
+    """
+    Stats of `n` buckets starting at `first` from numpy arrays of the
+    readings' values and epoch seconds
+    """
+
+    import numpy as np
+
+    keep = ~np.isnan(values)
+    values = values[keep]
+    index = (seconds[keep] - first) // width
+    counts = np.bincount(index, minlength=n)
+    sums = np.bincount(index, weights=values, minlength=n)
+    lows = np.full(n, np.inf)
+    highs = np.full(n, -np.inf)
+    np.minimum.at(lows, index, values)
+    np.maximum.at(highs, index, values)
+    return [
+        Stats(int(count), float(total), float(low), float(high)) if count else EMPTY
+        for count, total, low, high in zip(counts, sums, lows, highs)
+    ]
+
+
+class SensorAggregates:
+    """
+    Cached buckets of one sensor, keyed by (field, width, start)
+    """
+
+    def __init__(self, max_buckets: int):
+        self.max_buckets = max_buckets
+        self.closed: OrderedDict = OrderedDict()
+        # key -> (watermark, stats)
+        self.open: dict = {}
+        self._lock = threading.Lock()
+
+    def lookup(self, key, closed: bool, watermark) -> Stats | None:
+        with self._lock:
+            if closed:
+                stats = self.closed.get(key)
+                if stats is not None:
+                    self.closed.move_to_end(key)
+                return stats
+            entry = self.open.get(key)
+            if entry is not None and entry[0] == watermark:
+                return entry[1]
+            return None
+
+    def store(self, key, stats: Stats, closed: bool, watermark, closed_before: int):
+        with self._lock:
+            if closed:
+                self.open.pop(key, None)
+                self.closed[key] = stats
+                self.closed.move_to_end(key)
+                while len(self.closed) > self.max_buckets:
+                    self.closed.popitem(last=False)
+                return
+            self.open[key] = (watermark, stats)
+            # buckets that closed since are looked up in self.closed now
+            for stale in [k for k in self.open if k[2] + k[1] <= closed_before]:
+                del self.open[stale]
+
+
+class Aggregator:
+    def __init__(self, cache, late_seconds: float, max_buckets: int):
+        # an invalidation.LocalCache of sensor_id -> SensorAggregates
+        self.cache = cache
+        self.late_seconds = late_seconds
+        self.max_buckets = max_buckets
+
+    def is_late(self, recorded_at: datetime, now: datetime) -> bool:
+        """
+        True if a reading recorded at `recorded_at` lands in a closed bucket
+        """
+
+        return epoch_seconds(recorded_at) < epoch_seconds(now) - self.late_seconds
+
+    def aggregate(
+        self,
+        session,
+        sensor_id: int,
+        field: str,
+        width: int,
+        start: datetime,
+        end: datetime,
+        now: datetime,
+    ) -> list[tuple[int, Stats]]:
+        """
+        (bucket start, stats) of every bucket overlapping [start, end)
+        """
+
+        import decoding
+
+        # read before the readings, rows inserted in between make the open
+        # buckets newer than their watermark, never older
+        watermark = session.exec(
+            select(func.max(SensorData.sensor_data_id)).where(
+                SensorData.sensor_id_sensor_table == sensor_id
+            )
+        ).one()
+
+        generation = self.cache.generation
+        entry = self.cache.get(sensor_id)
+        new = entry is None
+        if new:
+            entry = SensorAggregates(self.max_buckets)
+
+        closed_before = epoch_seconds(now) - int(self.late_seconds)
+        starts = bucket_starts(start, end, width)
+        results = {}
+        missing = []
+        for first in starts:
+            stats = entry.lookup(
+                (field, width, first), first + width <= closed_before, watermark
+            )
+            if stats is None:
+                missing.append(first)
+            else:
+                results[first] = stats
+        metrics.AGGREGATE_BUCKETS.labels("cached").inc(len(results))
+        metrics.AGGREGATE_BUCKETS.labels("computed").inc(len(missing))
+
+        # one query per run of adjacent missing buckets, usually just the
+        # open ones at the end
+        for run in _runs(missing, width):
+            low, high = run[0], run[-1] + width
+            rows = session.execute(
+                select(SensorData.time_recorded, SensorData.data).where(
+                    SensorData.sensor_id_sensor_table == sensor_id,
+                    SensorData.time_recorded >= bucket_time(low),
+                    SensorData.time_recorded < bucket_time(high),
+                )
+            ).all()
+            columns = decoding.decode_rows(
+                [row.time_recorded for row in rows], [row.data for row in rows]
+            )
+            seconds = columns.timestamp.astype("datetime64[s]").astype("int64")
+            computed = compute(getattr(columns, field), seconds, low, width, len(run))
+            for first, stats in zip(run, computed):
+                entry.store(
+                    (field, width, first),
+                    stats,
+                    first + width <= closed_before,
+                    watermark,
+                    closed_before,
+                )
+                results[first] = stats
+
+        if new:
+            # not stored if the sensor was invalidated while we computed
+            self.cache.set(sensor_id, entry, generation)
+        return [(first, results[first]) for first in starts]
+
+
+def _runs(starts: list[int], width: int) -> list[list[int]]:
+    runs = []
+    for first in starts:
+        if runs and runs[-1][-1] + width == first:
+            runs[-1].append(first)
+        else:
+            runs.append([first])
+    return runs
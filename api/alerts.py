@@ -0,0 +1,532 @@
+"""
+Alert rules evaluated incrementally as readings are ingested
+
+every rule keeps a few numbers of rolling state in the worker that
+evaluates it, so a reading is checked in constant time without looking at
+older readings:
+
+- above / below: the reading is over / under `threshold`
+- spike: the reading is more than `threshold` standard deviations from an
+  exponentially weighted moving average (smoothing `alpha`)
+- rate: more than `threshold` readings in `window_seconds`, estimated from
+  the count of the current and the previous window
+- silence: no reading for `window_seconds`, a timer per rule that the
+  background watcher checks every second
+
+an alert is stored in the ingest transaction after winning the rule's
+cooldown with an UPDATE of last_fired_at, which keeps workers from storing
+the same alert twice, then posted to the rule's webhook once committed
+"""
+
+import asyncio
+import heapq
+import ipaddress
+import json
+import logging
+import math
+import socket
+import threading
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+from sqlalchemy import or_, update
+from sqlmodel import Session, select
+
+import metrics
+from models import Alert, AlertRule, SensorData
+
+logger = logging.getLogger("sensata.alerts")
+
+KINDS = ("above", "below", "spike", "rate", "silence")
+FIELDS = ("distance", "count")
+
+# readings a spike rule learns from before it can fire
+SPIKE_WARMUP = 10
+SPIKE_ALPHA = 0.1
+SPIKE_THRESHOLD = 3.0
+
+WEBHOOK_TIMEOUT = 5
+WEBHOOK_SCHEMES = ("http", "https")
+
+
+@dataclass(frozen=True)
+class Rule:
+    rule_id: int
+    sensor_id: int
+    kind: str
+    field: str
+    threshold: float | None
+    window: float | None
+    alpha: float | None
+    cooldown: float
+    webhook_url: str | None
+
+    @classmethod
+    def from_row(cls, row: AlertRule) -> "Rule":
+        return cls(
+            rule_id=row.alert_rule_id,
+            sensor_id=row.sensor_id_sensor_table,
+            kind=row.kind,
+            field=row.field,
+            threshold=row.threshold,
+            window=row.window_seconds,
+            alpha=row.alpha,
+            cooldown=row.cooldown_seconds,
+            webhook_url=row.webhook_url,
+        )
+
+
+def validate(kind: str, field: str, threshold, window, alpha) -> str | None:
+    """
+    Why a rule can't be created, None if it can
+    """
+
+    if kind not in KINDS:
+        return f"kind must be one of {', '.join(KINDS)}"
+    if field not in FIELDS:
+        return f"field must be one of {', '.join(FIELDS)}"
+    if kind in ("above", "below", "rate") and threshold is None:
+        return f"{kind} rules need a threshold"
+    if kind in ("rate", "silence") and (window is None or window <= 0):
+        return f"{kind} rules need a positive window_seconds"
+    if alpha is not None and not 0 < alpha <= 1:
+        return "alpha must be between 0 and 1"
+    return None
+
+
+def check_webhook_url(url: str, allow_private: bool = False) -> str | None:
+    """
+    Why alerts can't be posted to `url`, None if they can
+
+    only http(s) urls, and unless allow_private only hosts that resolve to
+    public addresses, so a rule can't make the api call into its own network
+    """
+
+    parts = urllib.parse.urlsplit(url)
+    if parts.scheme not in WEBHOOK_SCHEMES:
+        return "webhook_url must be an http or https url"
+    if not parts.hostname:
+        return "webhook_url has no host"
+    if allow_private:
+        return None
+    try:
+        addresses = socket.getaddrinfo(
+            parts.hostname, parts.port, type=socket.SOCK_STREAM
+        )
+    except (OSError, ValueError):
+        return f"webhook_url host {parts.hostname} can't be resolved"
+    for *_, sockaddr in addresses:
+        address = ipaddress.ip_address(sockaddr[0].split("%")[0])
+        if address.version == 6 and address.ipv4_mapped is not None:
+            address = address.ipv4_mapped
+        if not address.is_global:
+            return "webhook_url must not point to a private address"
+    return None
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    # a redirect could lead anywhere check_webhook_url wouldn't allow
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_webhook_opener = urllib.request.build_opener(_NoRedirects)
+
+
+class Fired(NamedTuple):
+    rule: Rule
+    at: datetime
+    value: float | None
+    message: str
+
+
+class _State:
+    __slots__ = (
+        "rule",
+        "mean",
+        "variance",
+        "samples",
+        "bucket",
+        "count",
+        "previous",
+        "fired_at",
+    )
+
+    def __init__(self, rule: Rule):
+        self.rule = rule
+        self.mean = 0.0
+        self.variance = 0.0
+        self.samples = 0
+        self.bucket = None
+        self.count = 0
+        self.previous = 0
+        self.fired_at = None
+
+
+class Evaluator:
+    """
+    The rules of every sensor (through `cache`), their rolling state and the
+    silence timers of one worker
+    """
+
+    def __init__(self, cache, allow_private_webhooks: bool = False):
+        # sensor_id -> tuple of Rule, empty for sensors without rules
+        self.cache = cache
+        self.allow_private_webhooks = allow_private_webhooks
+        self._states: dict[int, _State] = {}
+        # (deadline, rule_id) of every silence rule, plus when it last saw data
+        self._deadlines: list[tuple[datetime, int]] = []
+        self._last_seen: dict[int, datetime] = {}
+        self._lock = threading.Lock()
+        self._webhooks: ThreadPoolExecutor | None = None
+
+    def rules(self, session: Session, sensor_ids) -> dict[int, tuple[Rule, ...]]:
+        """
+        Active rules of every sensor, from the cache or one query
+        """
+
+        rules = {}
+        for sensor_id in sensor_ids:
+            cached = self.cache.get(sensor_id)
+            if cached is not None:
+                rules[sensor_id] = cached
+        uncached = set(sensor_ids) - rules.keys()
+        if uncached:
+            generation = self.cache.generation
+            loaded = {sensor_id: [] for sensor_id in uncached}
+            for row in session.exec(
+                select(AlertRule).where(
+                    AlertRule.sensor_id_sensor_table.in_(uncached),
+                    AlertRule.is_active,
+                )
+            ):
+                loaded[row.sensor_id_sensor_table].append(Rule.from_row(row))
+            for sensor_id, sensor_rules in loaded.items():
+                rules[sensor_id] = tuple(sensor_rules)
+                self.cache.set(sensor_id, rules[sensor_id], generation)
+        return rules
+
+    def _state(self, rule: Rule) -> _State:
+        state = self._states.get(rule.rule_id)
+        # a changed rule starts over
+        if state is None or state.rule != rule:
+            state = _State(rule)
+            self._states[rule.rule_id] = state
+        return state
+
+    def observe(self, rule: Rule, at: datetime, value: float) -> Fired | None:
+        """
+        Update the rule's state with a reading, return an alert if it fires
+        """
+
+        with self._lock:
+            state = self._state(rule)
+            message = self._check(rule, state, at, value)
+            if message is None:
+                return None
+            # don't ask the database about every reading while cooling down
+            if state.fired_at is not None and at - state.fired_at < timedelta(
+                seconds=rule.cooldown
+            ):
+                return None
+            state.fired_at = at
+        return Fired(rule, at, value, message)
+
+    def _check(self, rule: Rule, state: _State, at: datetime, value: float):
+        if rule.kind == "silence":
+            self._arm(rule, at)
+            return None
+        if rule.kind == "rate":
+            return self._check_rate(rule, state, at)
+        if math.isnan(value):
+            return None
+        if rule.kind == "above" and value > rule.threshold:
+            return f"{rule.field} {value:g} is above {rule.threshold:g}"
+        if rule.kind == "below" and value < rule.threshold:
+            return f"{rule.field} {value:g} is below {rule.threshold:g}"
+        if rule.kind == "spike":
+            return self._check_spike(rule, state, value)
+        return None
+
+    def _check_spike(self, rule: Rule, state: _State, value: float):
+        alpha = rule.alpha or SPIKE_ALPHA
+        threshold = rule.threshold or SPIKE_THRESHOLD
+        message = None
+        if state.samples == 0:
+            state.mean = value
+        else:
+            deviation = value - state.mean
+            if (
+                state.samples >= SPIKE_WARMUP
+                and state.variance > 0
+                and abs(deviation) > threshold * math.sqrt(state.variance)
+            ):
+                deviations = abs(deviation) / math.sqrt(state.variance)
+                message = (
+                    f"{rule.field} {value:g} is {deviations:.1f} standard"
+                    f" deviations from its average {state.mean:g}"
+                )
+            increment = alpha * deviation
+            state.mean += increment
+            state.variance = (1 - alpha) * (state.variance + deviation * increment)
+        state.samples += 1
+        return message
+
+    def _check_rate(self, rule: Rule, state: _State, at: datetime):
+        seconds = at.timestamp()
+        bucket = int(seconds // rule.window)
+        if bucket != state.bucket:
+            state.previous = state.count if state.bucket == bucket - 1 else 0
+            state.bucket = bucket
+            state.count = 0
+        state.count += 1
+        # the previous window's readings are assumed evenly spread
+        elapsed = seconds / rule.window - bucket
+        estimate = state.previous * (1 - elapsed) + state.count
+        if estimate > rule.threshold:
+            return (
+                f"{estimate:.0f} readings in the last {rule.window:g}s,"
+                f" more than {rule.threshold:g}"
+            )
+        return None
+
+    def _arm(self, rule: Rule, at: datetime):
+        # one heap entry per rule, pushed again when it expires (see expired)
+        if rule.rule_id not in self._last_seen:
+            heapq.heappush(
+                self._deadlines, (at + timedelta(seconds=rule.window), rule.rule_id)
+            )
+        self._states.setdefault(rule.rule_id, _State(rule)).rule = rule
+        self._last_seen[rule.rule_id] = at
+
+    def arm(self, rule: Rule, at: datetime):
+        """
+        Start the silence timer of a rule as if it got a reading at `at`
+        """
+
+        with self._lock:
+            self._arm(rule, at)
+
+    def expired(self, now: datetime) -> list[tuple[Rule, datetime]]:
+        """
+        Silence rules whose timer ran out, with when they last saw a reading,
+        their timers are stopped until they're armed again
+        """
+
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, rule_id = heapq.heappop(self._deadlines)
+                last_seen = self._last_seen.get(rule_id)
+                state = self._states.get(rule_id)
+                if last_seen is None or state is None:
+                    continue
+                deadline = last_seen + timedelta(seconds=state.rule.window)
+                if deadline > now:
+                    heapq.heappush(self._deadlines, (deadline, rule_id))
+                else:
+                    del self._last_seen[rule_id]
+                    expired.append((state.rule, last_seen))
+        return expired
+
+    def notify(self, fired: list[Fired]):
+        """
+        Post stored alerts to their rule's webhook in the background
+        """
+
+        for alert in fired:
+            if alert.rule.webhook_url is None:
+                continue
+            if self._webhooks is None:
+                self._webhooks = ThreadPoolExecutor(
+                    max_workers=2, thread_name_prefix="alert-webhook"
+                )
+            self._webhooks.submit(_post_webhook, alert, self.allow_private_webhooks)
+
+
+def _post_webhook(alert: Fired, allow_private: bool):
+    # checked again, the host may resolve differently than when the rule
+    # was created
+    error = check_webhook_url(alert.rule.webhook_url, allow_private)
+    if error is not None:
+        logger.warning("alert webhook %s skipped: %s", alert.rule.webhook_url, error)
+        return
+
+    body = json.dumps(
+        {
+            "alert_rule_id": alert.rule.rule_id,
+            "sensor_id": alert.rule.sensor_id,
+            "kind": alert.rule.kind,
+            "field": alert.rule.field,
+            "value": alert.value,
+            "message": alert.message,
+            "triggered_at": alert.at.isoformat(),
+        }
+    ).encode()
+    request = urllib.request.Request(
+        alert.rule.webhook_url,
+        data=body,
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    try:
+        with _webhook_opener.open(request, timeout=WEBHOOK_TIMEOUT):
+            pass
+    except Exception:
+        logger.exception("alert webhook %s failed", alert.rule.webhook_url)
+
+
+def record(session: Session, fired: list[Fired]) -> list[Fired]:
+    """
+    Store alerts whose rule isn't cooling down, in the session's transaction,
+    return the ones stored
+    """
+
+    stored = []
+    for alert in fired:
+        rule = alert.rule
+        won = session.execute(
+            update(AlertRule)
+            .where(
+                AlertRule.alert_rule_id == rule.rule_id,
+                AlertRule.is_active,
+                or_(
+                    AlertRule.last_fired_at.is_(None),
+                    AlertRule.last_fired_at
+                    <= alert.at - timedelta(seconds=rule.cooldown),
+                ),
+            )
+            .values(last_fired_at=alert.at)
+            .returning(AlertRule.alert_rule_id)
+        ).first()
+        if won is None:
+            continue
+        session.add(
+            Alert(
+                alert_rule_id_alert_rule=rule.rule_id,
+                sensor_id_sensor_table=rule.sensor_id,
+                triggered_at=alert.at,
+                value=alert.value,
+                message=alert.message,
+            )
+        )
+        metrics.ALERTS_FIRED.labels(rule.kind).inc()
+        stored.append(alert)
+    return stored
+
+
+def evaluate(
+    evaluator: Evaluator,
+    rules: dict[int, tuple[Rule, ...]],
+    readings: list[tuple[int, bytes]],
+    at: datetime,
+) -> list[Fired]:
+    """
+    Run (sensor_id, payload) readings through their sensor's rules
+    """
+
+    watched = [
+        (sensor_id, payload) for sensor_id, payload in readings if rules.get(sensor_id)
+    ]
+    if not watched:
+        return []
+
+    # numpy is only imported once a sensor has rules
+    import decoding
+
+    count, distance = decoding.decode_payloads([payload for _, payload in watched])
+    values = {"count": count.tolist(), "distance": distance.tolist()}
+    fired = []
+    for i, (sensor_id, _) in enumerate(watched):
+        for rule in rules[sensor_id]:
+            alert = evaluator.observe(rule, at, values[rule.field][i])
+            if alert is not None:
+                fired.append(alert)
+    return fired
+
+
+def check_silence(engine, evaluator: Evaluator) -> int:
+    """
+    Fire the silence rules whose timer ran out, return how many were stored
+    """
+
+    now = datetime.now()
+    expired = evaluator.expired(now)
+    if not expired:
+        return 0
+
+    fired = []
+    with Session(engine) as session:
+        current = evaluator.rules(session, {rule.sensor_id for rule, _ in expired})
+        for rule, last_seen in expired:
+            # deleted rules stay disarmed, changed ones use the new settings
+            rule = next(
+                (r for r in current[rule.sensor_id] if r.rule_id == rule.rule_id),
+                None,
+            )
+            if rule is None or rule.kind != "silence":
+                continue
+            # another worker may have received the readings, the newest row
+            # of the sensor is one index lookup
+            latest = session.exec(
+                select(SensorData.time_added)
+                .where(SensorData.sensor_id_sensor_table == rule.sensor_id)
+                .order_by(SensorData.sensor_data_id.desc())
+                .limit(1)
+            ).first()
+            if latest is not None and latest > last_seen:
+                last_seen = latest
+            if last_seen + timedelta(seconds=rule.window) > now:
+                evaluator.arm(rule, last_seen)
+                continue
+            # keeps checking every window until data arrives
+            evaluator.arm(rule, now)
+            fired.append(
+                Fired(rule, now, None, f"no readings since {last_seen.isoformat()}")
+            )
+        stored = record(session, fired)
+        session.commit()
+    evaluator.notify(stored)
+    return len(stored)
+
+
+def arm_silence_rules(engine, evaluator: Evaluator):
+    """
+    Start the timer of every active silence rule, from the sensor's newest
+    reading or now
+    """
+
+    now = datetime.now()
+    with Session(engine) as session:
+        latest = (
+            select(SensorData.time_added)
+            .where(
+                SensorData.sensor_id_sensor_table == AlertRule.sensor_id_sensor_table
+            )
+            .order_by(SensorData.sensor_data_id.desc())
+            .limit(1)
+            .scalar_subquery()
+        )
+        for row, last_seen in session.exec(
+            select(AlertRule, latest).where(
+                AlertRule.kind == "silence", AlertRule.is_active
+            )
+        ):
+            evaluator.arm(Rule.from_row(row), last_seen or now)
+
+
+async def watch_silence(engine, evaluator: Evaluator, interval: float):
+    """
+    Run check_silence every `interval` seconds until cancelled
+    """
+
+    while True:
+        try:
+            await asyncio.to_thread(check_silence, engine, evaluator)
+        except Exception:
+            logger.exception("silence check failed")
+        await asyncio.sleep(interval)
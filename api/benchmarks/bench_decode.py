@@ -0,0 +1,65 @@
+"""
+Measure payload decoding throughput
+
+compares decoding.decode_payloads with parsing every payload with
+ast.literal_eval, for text, legacy text, binary and a mix of all three.
+no database is needed, the payloads are generated
+
+run from the api directory: python -m benchmarks.bench_decode --rows 1000000
+"""
+
+import argparse
+import ast
+import random
+import time
+
+import decoding
+
+
+def make_payloads(kind: str, rows: int) -> list[bytes]:
+    random.seed(0)
+    payloads = []
+    for count in range(rows):
+        distance = round(random.uniform(0, 120), 2)
+        if kind == "text":
+            payloads.append(str({"count": count, "distance": distance}).encode())
+        elif kind == "legacy":
+            payloads.append(str({"count": count, distance: distance}).encode())
+        else:
+            payloads.append(decoding.encode_binary(count, distance))
+    return payloads
+
+
+def literal_eval(payloads: list[bytes]):
+    # the per row loop decode_payloads replaces, binary rows aren't supported
+    return [ast.literal_eval(payload.decode()) for payload in payloads]
+
+
+def rate(function, payloads: list[bytes]) -> float:
+    start = time.perf_counter()
+    function(payloads)
+    return len(payloads) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    workloads = {
+        kind: make_payloads(kind, args.rows) for kind in ("text", "legacy", "binary")
+    }
+    third = args.rows // 3
+    workloads["mixed"] = [
+        payload for payloads in workloads.values() for payload in payloads[:third]
+    ]
+
+    for name, payloads in workloads.items():
+        line = f"{name:<8} vectorized {rate(decoding.decode_payloads, payloads) / 1e6:6.2f}M rows/s"
+        if name in ("text", "legacy"):
+            line += f"   literal_eval {rate(literal_eval, payloads) / 1e6:6.3f}M rows/s"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
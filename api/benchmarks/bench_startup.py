@@ -0,0 +1,110 @@
+"""
+Measure how long a fresh api worker takes to become ready
+
+import: `import main` in a new interpreter
+ready: from starting `uvicorn main:app` to the first successful response,
+       which includes the lifespan (schema check, pool and cache warm up)
+
+every run is a new process so nothing is cached between runs except the
+operating system's page cache and compiled bytecode
+
+run from the api directory:
+    python -m benchmarks.bench_startup --database-url postgresql://.../bench
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import main; "
+    "print(time.perf_counter() - start)"
+)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def time_import(env) -> float:
+    result = subprocess.run(
+        [sys.executable, "-W", "ignore", "-c", IMPORT_SNIPPET],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def time_ready(env, timeout: float, client: httpx.Client) -> float:
+    port = free_port()
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port)],
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = start + timeout
+        while time.perf_counter() < deadline:
+            try:
+                if client.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            if server.poll() is not None:
+                raise RuntimeError(f"server exited with {server.returncode}")
+            time.sleep(0.005)
+        raise RuntimeError(f"server not ready after {timeout}s")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def report(name: str, samples: list[float]):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, round(0.95 * (len(samples) - 1)))]
+    print(
+        f"{name:<8} median {statistics.median(samples) * 1000:8.1f}ms"
+        f"   p95 {p95 * 1000:8.1f}ms   min {samples[0] * 1000:8.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+
+    env = {
+        **os.environ,
+        "DATABASE_URL": args.database_url,
+        "SQL_ECHO": "false",
+    }
+
+    # one untimed run so every run finds compiled bytecode
+    time_import(env)
+
+    report("import", [time_import(env) for _ in range(args.runs)])
+    # one client for every poll, creating a client per request costs more
+    # than the interval we're trying to measure
+    with httpx.Client(timeout=1) as client:
+        report(
+            "ready",
+            [time_ready(env, args.timeout, client) for _ in range(args.runs)],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare the CPU cost of parsing ingest bodies per 10k readings
+
+json: a list of sensor_data_type style objects with base64 payloads,
+      decoded the way add_data does (json parse, uuid, datetime, b64decode)
+frames: the binary format from wire.py
+
+run from the api directory: python -m benchmarks.bench_wire
+"""
+
+import argparse
+import base64
+import json
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import wire
+
+
+def make_readings(n: int):
+    sensor_keys = [uuid.uuid4() for _ in range(16)]
+    start = datetime(2024, 11, 20, 9, 0, 0)
+    return [
+        (
+            sensor_keys[i % len(sensor_keys)],
+            start + timedelta(seconds=i),
+            str({"count": i, "distance": 42.5 + i % 70}).encode(),
+            uuid.uuid4(),
+        )
+        for i in range(n)
+    ]
+
+
+def json_body(readings) -> bytes:
+    return json.dumps(
+        [
+            {
+                "data": base64.b64encode(payload).decode(),
+                "sensor_key": str(sensor_key),
+                "recorded_at": recorded_at.isoformat(),
+                "reading_id": str(reading_id),
+            }
+            for sensor_key, recorded_at, payload, reading_id in readings
+        ]
+    ).encode()
+
+
+def parse_json(body: bytes):
+    return [
+        (
+            uuid.UUID(item["sensor_key"]),
+            datetime.fromisoformat(item["recorded_at"]),
+            base64.b64decode(item["data"], validate=True),
+            uuid.UUID(item["reading_id"]),
+        )
+        for item in json.loads(body)
+    ]
+
+
+def bench(fn, body: bytes, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.process_time()
+        fn(body)
+        best = min(best, time.process_time() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--readings", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    readings = make_readings(args.readings)
+    bodies = {
+        "json": (parse_json, json_body(readings)),
+        "frames": (wire.decode_frames, wire.encode_frames(readings)),
+    }
+
+    per = 10_000 / args.readings
+    for name, (fn, body) in bodies.items():
+        assert len(fn(body)) == args.readings
+        seconds = bench(fn, body, args.repeat)
+        print(
+            f"{name:>7}: {len(body) * per / 1024:8.1f} KiB  "
+            f"{seconds * per * 1000:8.2f} ms CPU per 10k readings"
+        )
+
+
+if __name__ == "__main__":
+    main()
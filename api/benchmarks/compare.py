@@ -0,0 +1,70 @@
+"""
+Compare two load test result files
+
+prints the change in throughput, latency and statements per request for every
+endpoint present in both files, and exits with 1 if any p95 got worse than
+--threshold percent (useful in ci)
+
+run from the api directory: python -m benchmarks.compare old.json new.json
+"""
+
+import argparse
+import json
+import sys
+
+
+def change(old, new) -> str:
+    if old is None or new is None:
+        return "-"
+    if old == 0:
+        return "n/a"
+    return f"{(new - old) / old * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("old")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+
+    print(f"{old.get('commit')} -> {new.get('commit')}")
+
+    regressions = []
+    for phase, new_endpoints in new["phases"].items():
+        old_endpoints = old["phases"].get(phase)
+        if old_endpoints is None:
+            continue
+        print(f"\n== {phase}")
+        print(
+            f"{'endpoint':<42}{'rps':>10}{'p50':>10}{'p95':>10}{'p99':>10}{'stmts':>10}"
+        )
+        for endpoint, n in new_endpoints.items():
+            o = old_endpoints.get(endpoint)
+            if o is None:
+                continue
+            print(
+                f"{endpoint:<42}"
+                f"{change(o['throughput_rps'], n['throughput_rps']):>10}"
+                f"{change(o['p50_ms'], n['p50_ms']):>10}"
+                f"{change(o['p95_ms'], n['p95_ms']):>10}"
+                f"{change(o['p99_ms'], n['p99_ms']):>10}"
+                f"{change(o['statements_per_request'], n['statements_per_request']):>10}"
+            )
+            if o["p95_ms"] and n["p95_ms"] > o["p95_ms"] * (1 + args.threshold / 100):
+                regressions.append(f"{phase} {endpoint}")
+
+    if regressions:
+        print(f"\np95 regressed more than {args.threshold}%:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
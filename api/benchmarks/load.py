@@ -0,0 +1,361 @@
+"""
+Load test the api with concurrent ingest, read, aggregation, group and auth workloads
+
+the real FastAPI app is driven in-process through httpx's ASGI transport
+(or a running server with --base-url) against a seeded database, and
+throughput, p50/p95/p99 latency and SQL statements per request are reported
+per endpoint and saved as json under benchmarks/results/
+
+run from the api directory:
+    python -m benchmarks.load --database-url postgresql://.../bench --rows 1000000
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import subprocess
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+from benchmarks import seed as seeding
+
+RESULTS_DIR = Path(__file__).parent / "results"
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: dict[str, list[float]] = {}
+        self.statements: dict[str, list[int]] = {}
+        self.errors: dict[str, int] = {}
+
+    def record(self, endpoint: str, seconds: float, response: httpx.Response):
+        if response.status_code >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+            return
+        self.samples.setdefault(endpoint, []).append(seconds)
+        # only present when the app runs with DB_DEBUG_HEADER=true
+        report = response.headers.get("x-db-statements")
+        if report is not None:
+            self.statements.setdefault(endpoint, []).append(int(report.split()[0]))
+
+    def summary(self, elapsed: float) -> dict:
+        result = {}
+        for endpoint in sorted(set(self.samples) | set(self.errors)):
+            samples = sorted(self.samples.get(endpoint, []))
+            statements = self.statements.get(endpoint, [])
+            result[endpoint] = {
+                "requests": len(samples),
+                "errors": self.errors.get(endpoint, 0),
+                "throughput_rps": len(samples) / elapsed,
+                "p50_ms": percentile(samples, 50) * 1000,
+                "p95_ms": percentile(samples, 95) * 1000,
+                "p99_ms": percentile(samples, 99) * 1000,
+                "statements_per_request": (
+                    sum(statements) / len(statements) if statements else None
+                ),
+            }
+        return result
+
+
+def percentile(samples: list[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, round(p / 100 * (len(samples) - 1)))
+    return samples[index]
+
+
+async def timed(client, recorder, endpoint, method, url, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    recorder.record(endpoint, time.perf_counter() - start, response)
+    return response
+
+
+# each workload is one virtual user's loop, they run until the deadline
+
+
+async def ingest_workload(client, recorder, info, deadline):
+    count = 0
+    while time.perf_counter() < deadline:
+        count += 1
+        payload = str({"count": count, "distance": round(random.uniform(0, 120), 2)})
+        await timed(
+            client,
+            recorder,
+            "POST /api/v1/data",
+            "POST",
+            "/api/v1/data",
+            json={
+                "data": base64.b64encode(payload.encode()).decode(),
+                "sensor_key": random.choice(info["sensor_keys"]),
+                "recorded_at": datetime.now().isoformat(),
+            },
+        )
+
+
+async def read_workload(client, recorder, info, deadline):
+    while time.perf_counter() < deadline:
+        sensor_id = random.choice(info["sensor_ids"])
+        cursor = None
+        # follow the cursor for a few pages like a scrolling dashboard
+        for _ in range(3):
+            params = {"count": 100}
+            if cursor is not None:
+                params["cursor"] = cursor
+            response = await timed(
+                client,
+                recorder,
+                "GET /api/v1/sensor_data/{sensor_id}",
+                "GET",
+                f"/api/v1/sensor_data/{sensor_id}",
+                params=params,
+            )
+            body = response.json() if response.status_code == 200 else {}
+            cursor = body.get("cursor")
+            if not cursor or time.perf_counter() >= deadline:
+                break
+
+
+async def aggregation_workload(client, recorder, info, deadline):
+    while time.perf_counter() < deadline:
+        await timed(
+            client,
+            recorder,
+            "GET /api/v1/active_sensors",
+            "GET",
+            "/api/v1/active_sensors",
+        )
+        await timed(
+            client,
+            recorder,
+            "GET /api/v1/data",
+            "GET",
+            "/api/v1/data",
+        )
+
+
+async def group_workload(client, recorder, info, deadline):
+    while time.perf_counter() < deadline:
+        group_id = random.choice(info["group_ids"])
+        await timed(
+            client,
+            recorder,
+            "GET /api/v1/group_data/{group_id}",
+            "GET",
+            f"/api/v1/group_data/{group_id}",
+        )
+
+
+async def auth_workload(client, recorder, info, deadline):
+    while time.perf_counter() < deadline:
+        response = await timed(
+            client,
+            recorder,
+            "POST /api/v1/login",
+            "POST",
+            "/api/v1/login",
+            json={"email": info["email"], "password": info["password"]},
+        )
+        # the cookie is scoped to the production domain, so read the header
+        token = ""
+        for header in response.headers.get_list("set-cookie"):
+            name, _, value = header.partition(";")[0].partition("=")
+            if name.strip() == "session_token":
+                token = value
+        cookies = {"session_token": token}
+        for _ in range(5):
+            await timed(
+                client,
+                recorder,
+                "GET /api/v1/all_sensors",
+                "GET",
+                "/api/v1/all_sensors",
+                cookies=cookies,
+            )
+        api_key = random.choice(info["api_keys"])
+        await timed(
+            client,
+            recorder,
+            "GET /api/v1/api_key/sensors/{api_key}",
+            "GET",
+            f"/api/v1/api_key/sensors/{api_key}",
+        )
+
+
+WORKLOADS = {
+    "ingest": ingest_workload,
+    "read": read_workload,
+    "aggregation": aggregation_workload,
+    "group": group_workload,
+    "auth": auth_workload,
+}
+
+
+def make_client(base_url: str | None) -> httpx.AsyncClient:
+    if base_url is not None:
+        return httpx.AsyncClient(base_url=base_url, timeout=60)
+
+    # import late so the environment set up in main() is seen by the app
+    import main as api
+
+    return httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=api.app, raise_app_exceptions=False),
+        base_url="http://bench",
+        timeout=60,
+    )
+
+
+async def run_phase(client, names, info, concurrency, duration) -> dict:
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            WORKLOADS[name](client, recorder, info, deadline)
+            for name in names
+            for _ in range(concurrency)
+        )
+    )
+    return recorder.summary(time.perf_counter() - start)
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_phase(name: str, summary: dict):
+    print(f"\n== {name}")
+    print(
+        f"{'endpoint':<42}{'req':>7}{'err':>6}{'rps':>9}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'stmts':>7}"
+    )
+    for endpoint, s in summary.items():
+        stmts = s["statements_per_request"]
+        print(
+            f"{endpoint:<42}{s['requests']:>7}{s['errors']:>6}"
+            f"{s['throughput_rps']:>9.1f}{s['p50_ms']:>9.1f}{s['p95_ms']:>9.1f}"
+            f"{s['p99_ms']:>9.1f}{'-' if stmts is None else f'{stmts:.1f}':>7}"
+        )
+
+
+async def run(args, info) -> dict:
+    phases = {name: [name] for name in args.workloads}
+    if args.mixed:
+        phases["mixed"] = list(args.workloads)
+
+    results = {}
+    async with make_client(args.base_url) as client:
+        if args.base_url is None:
+            # run the app's startup hooks for the in-process app
+            import main as api
+
+            async with api.app.router.lifespan_context(api.app):
+                for name, names in phases.items():
+                    results[name] = await run_phase(
+                        client, names, info, args.concurrency, args.duration
+                    )
+                    print_phase(name, results[name])
+        else:
+            for name, names in phases.items():
+                results[name] = await run_phase(
+                    client, names, info, args.concurrency, args.duration
+                )
+                print_phase(name, results[name])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    seeding.add_arguments(parser)
+    parser.add_argument(
+        "--base-url",
+        help="drive a running server instead of the in-process app",
+    )
+    parser.add_argument(
+        "--workloads",
+        nargs="+",
+        choices=list(WORKLOADS),
+        default=list(WORKLOADS),
+    )
+    parser.add_argument("--mixed", action="store_true", help="also run all at once")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--seed", type=int, default=0, help="random seed")
+    parser.add_argument("--output", type=Path, help="result file (json)")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+
+    # point the in-process app at the benchmark database, with statement
+    # counts in the response headers and without sql echo
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["DB_DEBUG_HEADER"] = "true"
+    os.environ.setdefault("SQL_ECHO", "false")
+    # the workloads reuse a few hundred sensor keys from one address as fast
+    # as they can, measure the endpoints rather than the ingest rate limits
+    os.environ.setdefault("SENSOR_RATE_LIMIT", "0")
+    os.environ.setdefault("CLIENT_RATE_LIMIT", "0")
+    # async routes check out connections on the event loop, so a pool smaller
+    # than the number of virtual users stalls instead of measuring the api
+    os.environ.setdefault(
+        "DB_POOL_SIZE", str(args.concurrency * max(len(args.workloads), 2))
+    )
+
+    info = seeding.seed(
+        args.database_url,
+        args.sensors,
+        args.groups,
+        args.api_keys,
+        args.rows,
+        args.days,
+        args.reseed,
+    )
+
+    results = asyncio.run(run(args, info))
+
+    commit = git_commit()
+    output = args.output
+    if output is None:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        output = RESULTS_DIR / f"{stamp}-{commit or 'unknown'}.json"
+
+    output.write_text(
+        json.dumps(
+            {
+                "commit": commit,
+                "created_at": datetime.now().isoformat(),
+                "target": args.base_url or "in-process",
+                "parameters": {
+                    "sensors": args.sensors,
+                    "groups": args.groups,
+                    "api_keys": args.api_keys,
+                    "rows": info["rows"],
+                    "concurrency": args.concurrency,
+                    "duration": args.duration,
+                    "seed": args.seed,
+                },
+                "phases": results,
+            },
+            indent=2,
+        )
+    )
+    print(f"\nresults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
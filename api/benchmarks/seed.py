@@ -0,0 +1,223 @@
+"""
+Seed a database with synthetic sensors, groups, api keys, a user and sensor data
+
+the bulk of the rows are generated inside Postgres (generate_series) so
+millions of sensor_data rows take seconds rather than hours
+
+run from the api directory: python -m benchmarks.seed --database-url ... --rows 1000000
+"""
+
+import argparse
+import time
+
+import bcrypt
+from sqlalchemy import create_engine, text
+
+from models import SQLModel
+
+BENCH_EMAIL = "bench@sensata.invalid"
+BENCH_PASSWORD = "benchmark-password"
+
+# insert sensor_data in chunks so one statement never holds too much wal
+CHUNK_ROWS = 500_000
+
+
+def seed(
+    database_url: str,
+    sensors: int,
+    groups: int,
+    api_keys: int,
+    rows: int,
+    days: int,
+    reseed: bool = False,
+) -> dict:
+    """
+    Seed the database and return a description of what is in it
+
+    seeding is skipped when the database already holds the requested
+    number of sensors and rows, unless reseed is set
+    """
+
+    engine = create_engine(database_url)
+    SQLModel.metadata.create_all(engine)
+
+    with engine.begin() as conn:
+        existing_sensors = conn.execute(
+            text("SELECT count(*) FROM sensor_table")
+        ).scalar()
+        existing_rows = conn.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'sensor_data'")
+        ).scalar()
+
+    if (
+        not reseed
+        and existing_sensors == sensors
+        and existing_rows is not None
+        and abs(existing_rows - rows) <= rows * 0.05
+    ):
+        print(
+            f"database already seeded ({existing_sensors} sensors, ~{existing_rows} rows)"
+        )
+        return describe(engine)
+
+    password_hash = bcrypt.hashpw(BENCH_PASSWORD.encode(), bcrypt.gensalt()).decode()
+
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "TRUNCATE sensor_data, api_keys_join_sensors, api_keys_join_groups, "
+                "group_join_sensors, api_key, sensor_group, sensor_table, "
+                'user_session, "user" RESTART IDENTITY CASCADE'
+            )
+        )
+        conn.execute(
+            text(
+                'INSERT INTO "user" (email, password_hash, is_activated, is_admin) '
+                "VALUES (:email, :password_hash, true, true)"
+            ),
+            {"email": BENCH_EMAIL, "password_hash": password_hash},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO sensor_table (manufacturer, serial_number, sensor_model_name, key) "
+                "SELECT 'bench', 'SN-' || g, 'HC-SR04', gen_random_uuid() "
+                "FROM generate_series(1, :n) g"
+            ),
+            {"n": sensors},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO sensor_group (group_name, description) "
+                "SELECT 'group ' || g, 'synthetic group' FROM generate_series(1, :n) g"
+            ),
+            {"n": groups},
+        )
+        # every sensor belongs to one group
+        conn.execute(
+            text(
+                "INSERT INTO group_join_sensors (group_id_sensor_groups, sensor_id_sensor_table) "
+                "SELECT (sensor_id % :groups) + 1, sensor_id FROM sensor_table"
+            ),
+            {"groups": groups},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO api_key (user_id_user, created_at, expires_at, "
+                "permission_level, is_active, api_key_text) "
+                "SELECT 1, now(), now() + interval '30 days', 1, true, gen_random_uuid()::text "
+                "FROM generate_series(1, :n) g"
+            ),
+            {"n": api_keys},
+        )
+        # each api key gets one group and a handful of individual sensors
+        conn.execute(
+            text(
+                "INSERT INTO api_keys_join_groups (api_key_id_api_keys, group_id_sensor_groups) "
+                "SELECT api_key_id, (api_key_id % :groups) + 1 FROM api_key"
+            ),
+            {"groups": groups},
+        )
+        conn.execute(
+            text(
+                "INSERT INTO api_keys_join_sensors (api_key_id_api_keys, sensor_id_sensor_table) "
+                "SELECT DISTINCT api_key_id, ((api_key_id * 7 + g) % :sensors) + 1 "
+                "FROM api_key, generate_series(1, 5) g"
+            ),
+            {"sensors": sensors},
+        )
+
+    start = time.perf_counter()
+    for offset in range(0, rows, CHUNK_ROWS):
+        n = min(CHUNK_ROWS, rows - offset)
+        with engine.begin() as conn:
+            # readings are spread evenly over the last `days` days, oldest first
+            conn.execute(
+                text(
+                    "INSERT INTO sensor_data "
+                    "(data, sensor_id_sensor_table, time_recorded, time_added, unique_id) "
+                    "SELECT convert_to(format('{''count'': %s, ''distance'': %s}', "
+                    "g, round((random() * 120)::numeric, 2)), 'UTF8'), "
+                    "(g % :sensors) + 1, t, t + interval '1 second', "
+                    # a uuid7 of the reading's time, like ids.uuid7 at ingest:
+                    # the first 6 bytes are unix milliseconds, version bits 0111
+                    "encode(set_bit(set_bit(overlay(uuid_send(gen_random_uuid()) "
+                    "placing substring(int8send((extract(epoch FROM t) * 1000)::bigint) "
+                    "FROM 3) FROM 1 FOR 6), 52, 1), 53, 1), 'hex')::uuid "
+                    "FROM generate_series(:first, :last) g, "
+                    "LATERAL (SELECT now() - make_interval(secs => "
+                    "(:rows - g)::float8 * :span / :rows)) AS ts(t)"
+                ),
+                {
+                    "first": offset + 1,
+                    "last": offset + n,
+                    "rows": rows,
+                    "sensors": sensors,
+                    "span": days * 86400,
+                },
+            )
+        print(f"seeded {offset + n}/{rows} rows ({time.perf_counter() - start:.1f}s)")
+
+    with engine.begin() as conn:
+        conn.execute(text("ANALYZE"))
+
+    return describe(engine)
+
+
+def describe(engine) -> dict:
+    with engine.begin() as conn:
+        sensors = conn.execute(
+            text("SELECT sensor_id, key FROM sensor_table ORDER BY sensor_id")
+        ).all()
+        api_keys = (
+            conn.execute(text("SELECT api_key_text FROM api_key ORDER BY api_key_id"))
+            .scalars()
+            .all()
+        )
+        groups = (
+            conn.execute(text("SELECT group_id FROM sensor_group ORDER BY group_id"))
+            .scalars()
+            .all()
+        )
+        rows = conn.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = 'sensor_data'")
+        ).scalar()
+
+    return {
+        "sensor_ids": [row[0] for row in sensors],
+        "sensor_keys": [str(row[1]) for row in sensors],
+        "group_ids": list(groups),
+        "api_keys": list(api_keys),
+        "rows": rows,
+        "email": BENCH_EMAIL,
+        "password": BENCH_PASSWORD,
+    }
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--sensors", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--api-keys", type=int, default=50)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--reseed", action="store_true")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    add_arguments(parser)
+    args = parser.parse_args()
+    info = seed(
+        args.database_url,
+        args.sensors,
+        args.groups,
+        args.api_keys,
+        args.rows,
+        args.days,
+        args.reseed,
+    )
+    print(f"{len(info['sensor_ids'])} sensors, ~{info['rows']} sensor_data rows")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""
+Set based bulk administration: creating sensors, adding sensors to a group
+and granting sensors/groups to an api key
+
+every operation validates all referenced ids in a single query and then
+writes every row with one INSERT ... ON CONFLICT DO NOTHING, so a request
+costs a fixed number of statements no matter how many rows it touches, and
+rows that already exist are counted instead of failing the whole request
+"""
+
+import uuid
+
+from fastapi import HTTPException
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import (
+    ApiKey,
+    ApiKeysJoinGroups,
+    ApiKeysJoinSensors,
+    GroupJoinSensors,
+    SensorGroup,
+    SensorTable,
+)
+
+# largest number of rows a single bulk request may create or link
+MAX_BULK = 5000
+
+
+def _unique(ids: list[int]) -> list[int]:
+    # keeps the order of the request, duplicates would only hit the conflict
+    return list(dict.fromkeys(ids))
+
+
+def _check_size(count: int):
+    if count == 0:
+        raise HTTPException(status_code=400, detail="Nothing to do")
+    if count > MAX_BULK:
+        raise HTTPException(
+            status_code=400, detail=f"At most {MAX_BULK} rows per request"
+        )
+
+
+def _found(column, ids: list[int]):
+    # array of the ids that exist, as a scalar subquery of the validation query
+    return select(func.array_agg(column)).where(column.in_(ids)).scalar_subquery()
+
+
+def _missing(name: str, ids: list[int], found) -> str | None:
+    # array_agg over no rows is null
+    found = set(found or ())
+    missing = [i for i in ids if i not in found]
+    if not missing:
+        return None
+    return f"{name} not found: {', '.join(map(str, missing))}"
+
+
+def _link(session, model, rows: list[dict]) -> int:
+    # returns how many rows were new, the rest already existed
+    if not rows:
+        return 0
+    result = session.execute(pg_insert(model).values(rows).on_conflict_do_nothing())
+    return result.rowcount
+
+
+def create_sensors(session, sensors: list[dict]) -> list[dict]:
+    """
+    Insert sensors (dicts of SensorTable columns) with fresh keys
+    and return them in request order
+    """
+
+    _check_size(len(sensors))
+    empty = [i for i, sensor in enumerate(sensors) if not any(sensor.values())]
+    if empty:
+        raise HTTPException(
+            status_code=400,
+            detail=f"All fields are empty for sensor(s) at index {', '.join(map(str, empty))}",
+        )
+
+    table = SensorTable.__table__
+    created = session.execute(
+        insert(table).returning(*table.columns, sort_by_parameter_order=True),
+        [{**sensor, "key": uuid.uuid4()} for sensor in sensors],
+    ).all()
+    session.commit()
+    return [dict(row._mapping) for row in created]
+
+
+def add_sensors_to_group(session, group_id: int, sensor_ids: list[int]) -> dict:
+    """
+    Add many sensors to a group, sensors already in it are skipped
+    """
+
+    sensor_ids = _unique(sensor_ids)
+    _check_size(len(sensor_ids))
+
+    group, sensors = session.execute(
+        select(
+            select(SensorGroup.group_id)
+            .where(SensorGroup.group_id == group_id)
+            .scalar_subquery(),
+            _found(SensorTable.sensor_id, sensor_ids),
+        )
+    ).one()
+    if group is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+    missing = _missing("Sensor", sensor_ids, sensors)
+    if missing:
+        raise HTTPException(status_code=404, detail=missing)
+
+    added = _link(
+        session,
+        GroupJoinSensors,
+        [
+            {"group_id_sensor_groups": group_id, "sensor_id_sensor_table": sensor_id}
+            for sensor_id in sensor_ids
+        ],
+    )
+    session.commit()
+    return {"added": added, "already_present": len(sensor_ids) - added}
+
+
+def grant_to_api_key(
+    session, api_key: str, sensor_ids: list[int], group_ids: list[int]
+) -> dict:
+    """
+    Grant many sensors and groups to an api key in one transaction,
+    existing grants are skipped
+    """
+
+    sensor_ids = _unique(sensor_ids)
+    group_ids = _unique(group_ids)
+    _check_size(len(sensor_ids) + len(group_ids))
+
+    api_key_id, sensors, groups = session.execute(
+        select(
+            select(ApiKey.api_key_id)
+            .where(ApiKey.api_key_text == api_key)
+            .scalar_subquery(),
+            _found(SensorTable.sensor_id, sensor_ids),
+            _found(SensorGroup.group_id, group_ids),
+        )
+    ).one()
+    if api_key_id is None:
+        raise HTTPException(status_code=404, detail="Api key not found")
+    missing = [
+        message
+        for message in (
+            _missing("Sensor", sensor_ids, sensors),
+            _missing("Group", group_ids, groups),
+        )
+        if message
+    ]
+    if missing:
+        raise HTTPException(status_code=404, detail="; ".join(missing))
+
+    sensors_added = _link(
+        session,
+        ApiKeysJoinSensors,
+        [
+            {"api_key_id_api_keys": api_key_id, "sensor_id_sensor_table": sensor_id}
+            for sensor_id in sensor_ids
+        ],
+    )
+    groups_added = _link(
+        session,
+        ApiKeysJoinGroups,
+        [
+            {"api_key_id_api_keys": api_key_id, "group_id_sensor_groups": group_id}
+            for group_id in group_ids
+        ],
+    )
+    session.commit()
+    return {
+        "sensors_added": sensors_added,
+        "sensors_already_granted": len(sensor_ids) - sensors_added,
+        "groups_added": groups_added,
+        "groups_already_granted": len(group_ids) - groups_added,
+    }
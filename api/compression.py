@@ -0,0 +1,404 @@
+import zlib
+
+# brotli and zstandard are optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+class _GzipEncoder:
+    def __init__(self, level: int):
+        # wbits=31 produces a gzip container instead of a raw zlib stream
+        self._obj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def sync(self) -> bytes:
+        return self._obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+
+class _BrotliEncoder:
+    def __init__(self, quality: int):
+        self._obj = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.process(data)
+
+    def sync(self) -> bytes:
+        return self._obj.flush()
+
+    def flush(self) -> bytes:
+        return self._obj.finish()
+
+
+class _ZstdEncoder:
+    def __init__(self, level: int):
+        self._obj = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+
+    def sync(self) -> bytes:
+        return self._obj.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+
+# input fed per call to brotli builds without output_buffer_limit, a byte of
+# brotli can inflate to hundreds of kilobytes
+_BROTLI_PIECE = 16
+
+
+def _brotli_decompress(body: bytes, max_size: int) -> bytes:
+    # stops once the output passes max_size instead of inflating everything
+    decompressor = brotli.Decompressor()
+    data = bytearray()
+    if hasattr(decompressor, "can_accept_more_data"):
+        # brotli >= 1.2, the output of a call is capped
+        data += decompressor.process(body, output_buffer_limit=max_size + 1)
+        while len(data) <= max_size and not decompressor.is_finished():
+            chunk = decompressor.process(
+                b"", output_buffer_limit=max_size + 1 - len(data)
+            )
+            if not chunk:
+                break
+            data += chunk
+    else:
+        for start in range(0, len(body), _BROTLI_PIECE):
+            data += decompressor.process(body[start : start + _BROTLI_PIECE])
+            if len(data) > max_size:
+                break
+    if len(data) <= max_size and not decompressor.is_finished():
+        raise brotli.error("truncated input")
+    return bytes(data)
+
+
+class UnsupportedEncodingError(ValueError):
+    """
+    A request body in a content encoding this process can't decode
+    """
+
+
+def available_encodings() -> list[str]:
+    """
+    Return the response encodings this process can produce, most preferred first
+    """
+
+    encodings = []
+    if zstandard is not None:
+        encodings.append("zstd")
+    if brotli is not None:
+        encodings.append("br")
+    encodings.append("gzip")
+    return encodings
+
+
+def negotiate_encoding(accept_encoding: str, supported: list[str]) -> str | None:
+    """
+    Pick an encoding from an Accept-Encoding header
+
+    the server preference order (supported) wins over client q-values,
+    any encoding with q=0 is never picked
+    """
+
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name] = q
+
+    for encoding in supported:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > 0:
+            return encoding
+    return None
+
+
+def decompress_body(body: bytes, encoding: str, max_size: int) -> bytes:
+    """
+    Decompress a request body, refusing anything larger than max_size once inflated
+
+    raises UnsupportedEncodingError if the encoding is unknown, ValueError if
+    the body is invalid/too large
+    """
+
+    encoding = encoding.strip().lower()
+
+    if encoding in ("gzip", "x-gzip", "deflate"):
+        # 47 lets zlib auto-detect gzip and zlib headers
+        decompressor = zlib.decompressobj(47)
+        try:
+            data = decompressor.decompress(body, max_size + 1)
+        except zlib.error as e:
+            raise ValueError(f"Invalid {encoding} body") from e
+        # a truncated stream inflates to a prefix of the body without an error
+        if len(data) <= max_size and not decompressor.eof:
+            raise ValueError(f"Invalid {encoding} body")
+    elif encoding == "br" and brotli is not None:
+        try:
+            data = _brotli_decompress(body, max_size)
+        except brotli.error as e:
+            raise ValueError("Invalid br body") from e
+    elif encoding == "zstd" and zstandard is not None:
+        try:
+            data = zstandard.ZstdDecompressor().decompress(
+                body, max_output_size=max_size + 1
+            )
+        except zstandard.ZstdError as e:
+            raise ValueError("Invalid zstd body") from e
+    else:
+        raise UnsupportedEncodingError(f"Unsupported content encoding: {encoding}")
+
+    if len(data) > max_size:
+        raise ValueError("Decompressed body is too large")
+    return data
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware for gzip/br/zstd responses and compressed request bodies
+
+    responses are only compressed for paths starting with one of `paths`
+    and when the body is at least `minimum_size` bytes, request bodies
+    with a Content-Encoding header are decompressed for every path
+    """
+
+    def __init__(
+        self,
+        app,
+        paths: tuple[str, ...] = (),
+        minimum_size: int = 1024,
+        gzip_level: int = 5,
+        brotli_quality: int = 4,
+        zstd_level: int = 3,
+        max_request_size: int = 16 * 1024 * 1024,
+    ):
+        self.app = app
+        self.paths = paths
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.zstd_level = zstd_level
+        self.max_request_size = max_request_size
+        self.supported = available_encodings()
+
+    def _encoder(self, encoding: str):
+        if encoding == "zstd":
+            return _ZstdEncoder(self.zstd_level)
+        if encoding == "br":
+            return _BrotliEncoder(self.brotli_quality)
+        return _GzipEncoder(self.gzip_level)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+
+        content_encoding = headers.get(b"content-encoding")
+        if content_encoding is not None and content_encoding != b"identity":
+            handled = await self._decompress_request(
+                scope, receive, send, content_encoding.decode("latin-1")
+            )
+            if handled is None:
+                return
+            scope, receive = handled
+
+        if not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        accept_encoding = headers.get(b"accept-encoding", b"").decode("latin-1")
+        encoding = negotiate_encoding(accept_encoding, self.supported)
+        if encoding is None:
+            # the body would differ for another Accept-Encoding, caches
+            # need to know
+            await self.app(scope, receive, _with_vary(send))
+            return
+
+        await self._compress_response(scope, receive, send, encoding)
+
+    async def _decompress_request(self, scope, receive, send, content_encoding):
+        """
+        Read and inflate the whole request body, returning a new (scope, receive)
+        or None if an error response was already sent
+        """
+
+        chunks = []
+        size = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self.max_request_size:
+                await _send_error(send, 413, b"Request body is too large")
+                return None
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+
+        try:
+            body = decompress_body(
+                b"".join(chunks), content_encoding, self.max_request_size
+            )
+        except UnsupportedEncodingError as e:
+            await _send_error(send, 415, str(e).encode())
+            return None
+        except ValueError as e:
+            await _send_error(send, 400, str(e).encode())
+            return None
+
+        # drop the encoding header and fix the length so the app sees a plain body
+        new_headers = [
+            (k, v)
+            for k, v in scope["headers"]
+            if k not in (b"content-encoding", b"content-length")
+        ]
+        new_headers.append((b"content-length", str(len(body)).encode()))
+        scope = dict(scope, headers=new_headers)
+
+        sent = False
+
+        async def replay():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return scope, replay
+
+    async def _compress_response(self, scope, receive, send, encoding):
+        start_message = None
+        encoder = None
+        buffered = []
+        buffered_size = 0
+
+        async def send_compressed(message):
+            nonlocal start_message, encoder, buffered_size
+
+            if message["type"] == "http.response.start":
+                response_headers = dict(message.get("headers", []))
+                if b"content-encoding" in response_headers:
+                    # already encoded by the route, pass it through untouched
+                    start_message = False
+                    await send(_vary(message))
+                else:
+                    start_message = message
+                return
+
+            if message["type"] != "http.response.body" or start_message is False:
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if encoder is None:
+                buffered.append(body)
+                buffered_size += len(body)
+
+                # wait until we know the body is big enough to be worth compressing
+                if more_body and buffered_size < self.minimum_size:
+                    return
+
+                if buffered_size < self.minimum_size:
+                    await send(_vary(start_message))
+                    await send(
+                        {"type": "http.response.body", "body": b"".join(buffered)}
+                    )
+                    return
+
+                encoder = self._encoder(encoding)
+                body = b"".join(buffered)
+                buffered.clear()
+
+                headers = [
+                    (k, v)
+                    for k, v in _vary(start_message).get("headers", [])
+                    if k != b"content-length"
+                ]
+                headers.append((b"content-encoding", encoding.encode()))
+
+                if not more_body:
+                    compressed = encoder.compress(body) + encoder.flush()
+                    headers.append((b"content-length", str(len(compressed)).encode()))
+                    await send(dict(start_message, headers=headers))
+                    await send({"type": "http.response.body", "body": compressed})
+                    return
+
+                await send(dict(start_message, headers=headers))
+
+            # flushed per chunk so streamed exports reach the client as they
+            # are produced
+            compressed = encoder.compress(body)
+            compressed += encoder.sync() if more_body else encoder.flush()
+            if compressed or not more_body:
+                await send(
+                    {
+                        "type": "http.response.body",
+                        "body": compressed,
+                        "more_body": more_body,
+                    }
+                )
+
+        await self.app(scope, receive, send_compressed)
+
+
+def _vary(message):
+    # add Accept-Encoding to the response's Vary header, keeping other values
+    headers = list(message.get("headers", []))
+    values = [v for k, v in headers if k == b"vary"]
+    names = [name.strip().lower() for value in values for name in value.split(b",")]
+    if b"accept-encoding" in names or b"*" in names:
+        return message
+    headers = [(k, v) for k, v in headers if k != b"vary"]
+    headers.append((b"vary", b", ".join(values + [b"Accept-Encoding"])))
+    return dict(message, headers=headers)
+
+
+def _with_vary(send):
+    async def send_with_vary(message):
+        if message["type"] == "http.response.start":
+            message = _vary(message)
+        await send(message)
+
+    return send_with_vary
+
+
+async def _send_error(send, status: int, detail: bytes):
+    body = b'{"detail":"' + detail.replace(b'"', b"'") + b'"}'
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+            ],
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,256 @@
+"""
+Vectorized decoding of sensor_data payloads into numpy columns
+
+three payload layouts are stored in SensorData.data:
+
+- text, the repr of a dict: b"{'count': 3, 'distance': 37.74}"
+- legacy text, from before the distance key was fixed on the pi, where
+  the key is the distance itself: b"{'count': 3, 37.74: 37.74}"
+- binary, BINARY_TAG followed by a little endian uint32 count and float64
+  distance (see encode_binary), 13 bytes
+- binary window summaries of pis in edge mode, SUMMARY_TAG followed by the
+  count, the mean distance, the detections in the window, their min and max
+  distance and the window length (see encode_summary), 37 bytes. count and
+  distance decode like a single reading, text summaries are dicts with the
+  count first and distance last so they decode like text readings
+
+every payload is joined into one buffer. binary rows are reinterpreted
+in place. for text rows the comma and the last colon are located with
+array searches, the number spans between them are gathered into fixed
+width byte strings and converted to floats by numpy in one call, so no
+python code runs per row. text that isn't in the exact repr layout (other
+spacing, json quoting) goes through a regex instead, rows that match no
+layout decode to nan
+"""
+
+import re
+import struct
+from typing import NamedTuple
+
+import numpy as np
+
+BINARY_TAG = 1
+_BINARY = struct.Struct("<BId")
+_BINARY_DTYPE = np.dtype([("tag", "u1"), ("count", "<u4"), ("distance", "<f8")])
+SUMMARY_TAG = 2
+_SUMMARY = struct.Struct("<BIdIddI")
+_SUMMARY_DTYPE = np.dtype(
+    [
+        ("tag", "u1"),
+        ("count", "<u4"),
+        ("distance", "<f8"),
+        ("detections", "<u4"),
+        ("min", "<f8"),
+        ("max", "<f8"),
+        ("window", "<u4"),
+    ]
+)
+
+FIELDS = ("count", "distance")
+
+_PREFIXES = np.array(
+    [np.frombuffer(b"{'count': ", np.uint8), np.frombuffer(b'{"count": ', np.uint8)]
+)
+_NUMBER_BYTES = np.zeros(256, dtype=bool)
+_NUMBER_BYTES[np.frombuffer(b"0123456789.eE+-", np.uint8)] = True
+# longer spans aren't numbers repr() writes
+_MAX_NUMBER = 32
+
+_NUMBER = rb"(-?[0-9][0-9.eE+-]*|nan|inf|-inf)"
+# the second alternative matches any other line, so there is exactly one
+# match per line and captures stay aligned with rows
+_TEXT = re.compile(
+    rb"^\{\s*['\"]count['\"]\s*:\s*"
+    + _NUMBER
+    + rb"\s*,\s*(?:['\"]distance['\"]|"
+    + _NUMBER
+    + rb")\s*:\s*"
+    + _NUMBER
+    + rb"\s*\}$|^.*$",
+    re.MULTILINE,
+)
+
+
+class Columns(NamedTuple):
+    timestamp: np.ndarray
+    count: np.ndarray
+    distance: np.ndarray
+
+
+def encode_binary(count: int, distance: float) -> bytes:
+    return _BINARY.pack(BINARY_TAG, count, distance)
+
+
+def encode_summary(
+    count: int, distance: float, detections: int, low: float, high: float, window: int
+) -> bytes:
+    return _SUMMARY.pack(SUMMARY_TAG, count, distance, detections, low, high, window)
+
+
+def _to_float(strings: np.ndarray) -> np.ndarray:
+    strings[strings == b""] = b"nan"
+    try:
+        return strings.astype(np.float64)
+    except ValueError:
+        # only number characters but not a number, e.g. b"1-2"
+        return np.array([_float_or_nan(string) for string in strings])
+
+
+def _float_or_nan(string: bytes) -> float:
+    try:
+        return float(string)
+    except ValueError:
+        return np.nan
+
+
+def _decode_text(payloads: list[bytes]) -> tuple[np.ndarray, np.ndarray]:
+    # the slow path, one regex pass over the joined payloads
+    matches = _TEXT.findall(b"\n".join(payloads))
+    if len(matches) != len(payloads):
+        # a payload with a newline in it, decode row by row instead
+        matches = [
+            (_TEXT.match(payload) or _TEXT.match(b"")).groups(b"")
+            for payload in payloads
+        ]
+    if not matches:
+        return np.empty(0), np.empty(0)
+    captures = np.array(matches, dtype=bytes)
+    return _to_float(captures[:, 0]), _to_float(captures[:, 2])
+
+
+def _parse_numbers(buffer, starts, lengths, ok):
+    """
+    Parse the byte spans buffer[start:start + length] as floats where ok,
+    return the values and ok narrowed to spans that are numbers
+    """
+
+    ok = ok & (lengths > 0) & (lengths <= _MAX_NUMBER)
+    values = np.full(len(starts), np.nan)
+    if not ok.any():
+        return values, ok
+
+    starts = starts[ok]
+    lengths = lengths[ok]
+    width = int(lengths.max())
+    columns = np.arange(width)
+    inside = columns < lengths[:, None]
+    chars = buffer[np.minimum(starts[:, None] + columns, len(buffer) - 1)]
+    chars[~inside] = 0
+    numeric = (_NUMBER_BYTES[chars] | ~inside).all(axis=1)
+    # trailing zero bytes are dropped by numpy, so each row reads as the span
+    strings = np.ascontiguousarray(chars).view(f"S{width}").ravel()
+    strings[~numeric] = b"nan"
+    parsed = _to_float(strings)
+    numeric &= ~np.isnan(parsed)
+
+    values[ok] = parsed
+    ok[ok] = numeric
+    return values, ok
+
+
+def _decode_repr(buffer, starts, lengths):
+    """
+    Decode text rows written by repr(dict), return count, distance and
+    which rows were in that layout
+    """
+
+    prefix = _PREFIXES.shape[1]
+    ends = starts + lengths
+    ok = lengths > prefix + 6
+    head = buffer[np.minimum(starts[:, None] + np.arange(prefix), len(buffer) - 1)]
+    ok &= (head[:, None, :] == _PREFIXES[None, :, :]).all(axis=2).any(axis=1)
+    ok &= buffer[np.maximum(ends - 1, 0)] == ord("}")
+
+    # "{'count': 3, 'distance': 37.74}" -> the count runs up to the first
+    # comma, the distance from the last colon to the closing brace, which
+    # also covers the legacy "{'count': 3, 37.74: 37.74}"
+    commas = np.flatnonzero(buffer == ord(","))
+    colons = np.flatnonzero(buffer == ord(":"))
+    if len(commas) == 0 or len(colons) == 0:
+        return np.full(len(starts), np.nan), np.full(len(starts), np.nan), ok & False
+    comma = commas[
+        np.minimum(np.searchsorted(commas, starts + prefix), len(commas) - 1)
+    ]
+    colon = colons[np.maximum(np.searchsorted(colons, ends) - 1, 0)]
+    ok &= (comma < ends) & (colon > comma)
+
+    count, ok = _parse_numbers(buffer, starts + prefix, comma - starts - prefix, ok)
+    distance_start = (
+        colon + 1 + (buffer[np.minimum(colon + 1, len(buffer) - 1)] == ord(" "))
+    )
+    distance, ok = _parse_numbers(buffer, distance_start, ends - 1 - distance_start, ok)
+    return count, distance, ok
+
+
+def decode_payloads(payloads: list[bytes | None]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode payloads into (count, distance) float64 columns, nan if missing
+    """
+
+    n = len(payloads)
+    count = np.full(n, np.nan)
+    distance = np.full(n, np.nan)
+    if n == 0:
+        return count, distance
+
+    payloads = [payload or b"" for payload in payloads]
+    lengths = np.fromiter(map(len, payloads), dtype=np.int64, count=n)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    buffer = np.frombuffer(b"".join(payloads), dtype=np.uint8)
+    if len(buffer) == 0:
+        # only empty payloads, the searches below need at least one byte
+        return count, distance
+
+    binary = np.zeros(n, dtype=bool)
+    for tag, dtype in ((BINARY_TAG, _BINARY_DTYPE), (SUMMARY_TAG, _SUMMARY_DTYPE)):
+        rows = lengths == dtype.itemsize
+        rows[rows] = buffer[starts[rows]] == tag
+        if rows.any():
+            # gather the fixed size records of the rows and reinterpret them
+            offsets = starts[rows, None] + np.arange(dtype.itemsize)
+            records = buffer[offsets].reshape(-1).view(dtype)
+            count[rows] = records["count"]
+            distance[rows] = records["distance"]
+            binary |= rows
+
+    text = np.flatnonzero(~binary)
+    if len(text):
+        count[text], distance[text], parsed = _decode_repr(
+            buffer, starts[text], lengths[text]
+        )
+        rest = text[~parsed]
+        if len(rest):
+            count[rest], distance[rest] = _decode_text([payloads[i] for i in rest])
+
+    return count, distance
+
+
+def decode_rows(times: list, payloads: list[bytes | None]) -> Columns:
+    """
+    Decode (time_recorded, data) rows into timestamp, count and distance columns
+    """
+
+    count, distance = decode_payloads(payloads)
+    return Columns(np.array(times, dtype="datetime64[us]"), count, distance)
+
+
+def to_csv(columns: Columns) -> str:
+    """
+    Format decoded rows as csv lines, missing values are left empty
+    """
+
+    if len(columns.timestamp) == 0:
+        return ""
+    times = np.datetime_as_string(columns.timestamp, unit="ms")
+    counts = np.where(
+        np.isnan(columns.count),
+        "",
+        np.nan_to_num(columns.count).astype(np.int64).astype(str),
+    )
+    distances = np.where(np.isnan(columns.distance), "", columns.distance.astype(str))
+    return "".join(
+        f"{time},{count},{distance}\n"
+        for time, count, distance in zip(
+            times.tolist(), counts.tolist(), distances.tolist()
+        )
+    )
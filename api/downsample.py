@@ -0,0 +1,119 @@
+"""
+Downsampling of sensor series for charts
+
+lttb (largest triangle three buckets) keeps the points that shape the line,
+minmax keeps the lowest and highest point of every time bucket so spikes are
+never lost. both return the indices of the kept points, in order, and never
+more than `points` of them
+
+numpy is imported with this module, import it where it's used so workers
+that never serve a chart don't pay for it
+"""
+
+import numpy as np
+
+import decoding
+
+METHODS = ("lttb", "minmax")
+
+
+def lttb(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Indices of the `points` points chosen by largest triangle three buckets
+    """
+
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    if points < 3:
+        raise ValueError("lttb needs at least 3 points")
+
+    # the first and last point are always kept, the rest is split into
+    # points - 2 buckets of (almost) equal size
+    edges = np.linspace(1, n - 1, points - 1).astype(np.int64)
+    # average of every bucket, the third corner of the triangles
+    sums_x = np.add.reduceat(x[1 : n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[1 : n - 1], edges[:-1] - 1)
+    sizes = np.diff(edges)
+    avg_x = np.append(sums_x / sizes, x[-1])
+    avg_y = np.append(sums_y / sizes, y[-1])
+
+    selected = np.empty(points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(points - 2):
+        start, end = edges[i], edges[i + 1]
+        bx = x[start:end]
+        by = y[start:end]
+        # twice the triangle area for every candidate in the bucket at once
+        areas = np.abs(
+            (x[a] - avg_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (avg_y[i + 1] - y[a])
+        )
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+    return selected
+
+
+def minmax(x: np.ndarray, y: np.ndarray, points: int) -> np.ndarray:
+    """
+    Indices of the lowest and highest point of `points` // 2 equal time buckets
+    """
+
+    n = len(x)
+    if points >= n:
+        return np.arange(n)
+    buckets = max(points // 2, 1)
+
+    span = x[-1] - x[0]
+    if span <= 0:
+        bucket = np.zeros(n, dtype=np.int64)
+    else:
+        bucket = np.minimum(((x - x[0]) / span * buckets).astype(np.int64), buckets - 1)
+
+    # x is sorted so every bucket is a contiguous run
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    run = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+    lows = np.minimum.reduceat(y, starts)[run]
+    highs = np.maximum.reduceat(y, starts)[run]
+    # first point of every run that reaches the run's minimum / maximum
+    low_points = np.flatnonzero(y == lows)
+    high_points = np.flatnonzero(y == highs)
+    _, first_low = np.unique(run[low_points], return_index=True)
+    _, first_high = np.unique(run[high_points], return_index=True)
+    return np.unique(np.concatenate([low_points[first_low], high_points[first_high]]))
+
+
+def downsample(x: np.ndarray, y: np.ndarray, points: int, method: str) -> np.ndarray:
+    """
+    Indices of the points to keep, x must be sorted ascending, nan values
+    are dropped first
+    """
+
+    keep = np.flatnonzero(~np.isnan(y))
+    x = x[keep]
+    y = y[keep]
+    if method == "lttb":
+        return keep[lttb(x, y, points)]
+    if method == "minmax":
+        return keep[minmax(x, y, points)]
+    raise ValueError(f"unknown method {method}")
+
+
+def series(times: list, payloads: list[bytes], field: str, points: int, method: str):
+    """
+    Downsample readings to [[time_recorded, value], ...] for a json response
+    """
+
+    columns = decoding.decode_rows(times, payloads)
+    stamps = columns.timestamp
+    values = getattr(columns, field)
+    keep = downsample(
+        stamps.astype(np.int64).astype(np.float64), values, points, method
+    )
+    return list(
+        zip(
+            np.datetime_as_string(stamps[keep], unit="ms").tolist(),
+            values[keep].tolist(),
+        )
+    )
@@ -0,0 +1,60 @@
+"""
+Time ordered identifiers
+
+uuid4 values are random, so every insert into an index on them lands on a
+random page. uuid7 (rfc 9562) starts with the unix time in milliseconds,
+new ids sort after older ones and inserts append to the right edge of the
+index like a sequence would, while the random bits keep them unique across
+clients without coordination
+"""
+
+import os
+import threading
+import time
+import uuid
+
+_VERSION = 0x7 << 76
+_VARIANT = 0x2 << 62
+# the 62 random bits after the variant
+_RANDOM = (1 << 62) - 1
+_COUNTER_MAX = (1 << 12) - 1
+
+_lock = threading.Lock()
+_last_millis = 0
+_counter = 0
+
+
+def uuid7() -> uuid.UUID:
+    """
+    A version 7 uuid: 48 bits of unix milliseconds, a 12 bit counter and
+    62 random bits, ids from this process are strictly increasing
+    """
+
+    global _last_millis, _counter
+
+    random = int.from_bytes(os.urandom(8), "big") & _RANDOM
+    millis = time.time_ns() // 1_000_000
+    with _lock:
+        if millis > _last_millis:
+            # start low in a new millisecond, leaving room to count up
+            _counter = random >> 53
+            _last_millis = millis
+        else:
+            _counter += 1
+            if _counter > _COUNTER_MAX:
+                # more than 4096 ids in a millisecond, borrow the next one
+                _last_millis += 1
+                _counter = 0
+            millis = _last_millis
+        counter = _counter
+    return uuid.UUID(
+        int=(millis << 80) | _VERSION | (counter << 64) | _VARIANT | random
+    )
+
+
+def uuid7_time(value: uuid.UUID) -> float:
+    """
+    The unix time in seconds a uuid7 was created at
+    """
+
+    return (value.int >> 80) / 1000
@@ -0,0 +1,449 @@
+"""
+Import historical readings into sensor_data
+
+reads csv, ndjson or parquet files with one reading per row:
+
+    sensor_key or sensor_id   which sensor the reading belongs to
+    recorded_at               iso 8601 timestamp
+    data or payload           base64 encoded payload (like POST /api/v1/data)
+                              or the payload as text
+    reading_id                optional, a uuid
+
+rows are sent in chunks with COPY into a temporary staging table and moved
+into sensor_data with one INSERT ... ON CONFLICT DO NOTHING per chunk.
+readings without a reading_id get a uuid7 made from their recorded_at and
+a hash of the row, so importing a file twice, or a chunk again after an
+interruption, stores every reading once. the rows committed so far are
+written to a checkpoint file after every chunk and skipped on the next run
+
+run from the api directory:
+    python import_readings.py --database-url postgresql://... old_logger/*.csv
+"""
+
+import argparse
+import base64
+import binascii
+import csv
+import io
+import json
+import os
+import sys
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from dotenv import dotenv_values
+from sqlalchemy import create_engine, text
+
+import invalidation
+
+# only needed for parquet files, pip install "api[import]"
+try:
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CHUNK_ROWS = 100_000
+FORMATS = ("csv", "ndjson", "parquet")
+
+_STAGING = """
+CREATE TEMPORARY TABLE IF NOT EXISTS sensor_data_import (
+    sensor_id_sensor_table integer NOT NULL,
+    time_recorded timestamp NOT NULL,
+    data bytea NOT NULL,
+    unique_id uuid
+) ON COMMIT DELETE ROWS
+"""
+
+# the missing reading ids are a uuid7 of recorded_at (see ids.py) whose
+# random bits are an md5 of the row: the first 6 bytes are unix
+# milliseconds, then the version (0111) and variant (10) bits are set
+_MOVE = """
+WITH inserted AS (
+    INSERT INTO sensor_data
+        (data, sensor_id_sensor_table, time_recorded, time_added, unique_id)
+    SELECT
+        data,
+        sensor_id_sensor_table,
+        time_recorded,
+        now(),
+        coalesce(
+            unique_id,
+            encode(
+                set_bit(set_bit(set_bit(set_bit(set_bit(set_bit(
+                    overlay(
+                        decode(md5(
+                            sensor_id_sensor_table::text || ' '
+                            || time_recorded::text || ' ' || encode(data, 'hex')
+                        ), 'hex')
+                        PLACING substring(
+                            int8send((extract(epoch FROM time_recorded) * 1000)::bigint)
+                            FROM 3
+                        )
+                        FROM 1 FOR 6
+                    ),
+                52, 1), 53, 1), 54, 1), 55, 0), 70, 0), 71, 1),
+                'hex'
+            )::uuid
+        )
+    FROM sensor_data_import
+    ON CONFLICT (sensor_id_sensor_table, unique_id) DO NOTHING
+    RETURNING sensor_id_sensor_table, time_added
+),
+-- the reading counters of stats.py
+sensors AS (
+    INSERT INTO sensor_stats (sensor_id_sensor_table, readings, last_added_at)
+    SELECT sensor_id_sensor_table, count(*), max(time_added) FROM inserted GROUP BY 1
+    ON CONFLICT (sensor_id_sensor_table) DO UPDATE SET
+        readings = sensor_stats.readings + excluded.readings,
+        last_added_at = greatest(sensor_stats.last_added_at, excluded.last_added_at)
+),
+days AS (
+    INSERT INTO daily_stats (day, readings)
+    SELECT time_added::date, count(*) FROM inserted GROUP BY 1
+    ON CONFLICT (day) DO UPDATE SET readings = daily_stats.readings + excluded.readings
+)
+SELECT count(*) FROM inserted
+"""
+
+
+class RowError(ValueError):
+    pass
+
+
+def detect_format(path: Path) -> str:
+    suffix = path.suffix.lower().lstrip(".")
+    if suffix in ("jsonl", "ndjson"):
+        return "ndjson"
+    if suffix in ("parquet", "pq"):
+        return "parquet"
+    return "csv"
+
+
+def read_rows(path: Path, file_format: str, skip: int):
+    """
+    Yield the rows of a file as dicts, after the first `skip` rows
+    """
+
+    if file_format == "parquet":
+        parquet = pyarrow.parquet.ParquetFile(path)
+        for batch in parquet.iter_batches(batch_size=CHUNK_ROWS):
+            if skip >= batch.num_rows:
+                skip -= batch.num_rows
+                continue
+            yield from batch.slice(skip).to_pylist()
+            skip = 0
+        return
+
+    with open(path, newline="", encoding="utf-8") as file:
+        if file_format == "csv":
+            rows = csv.DictReader(file)
+        else:
+            rows = (json.loads(line) for line in file if line.strip())
+        for i, row in enumerate(rows):
+            if i >= skip:
+                yield row
+
+
+def to_copy_line(row: dict, sensor_id: int) -> str:
+    """
+    One line of COPY ... (FORMAT csv) input for the staging table
+    """
+
+    recorded_at = row.get("recorded_at")
+    if not recorded_at:
+        raise RowError("recorded_at is missing")
+    if isinstance(recorded_at, str):
+        try:
+            recorded_at = datetime.fromisoformat(recorded_at)
+        except ValueError:
+            raise RowError("recorded_at is not an iso 8601 timestamp")
+    elif not isinstance(recorded_at, datetime):
+        raise RowError("recorded_at is not an iso 8601 timestamp")
+    # parquet timestamps come back as datetimes. the offset is dropped like
+    # postgres does when casting to timestamp
+    recorded_at = recorded_at.replace(tzinfo=None).isoformat()
+
+    if row.get("data") is not None:
+        data = row["data"]
+        if isinstance(data, str):
+            try:
+                data = base64.b64decode(data, validate=True)
+            except binascii.Error:
+                raise RowError("data is not base64 encoded")
+    elif row.get("payload") is not None:
+        data = row["payload"]
+        if isinstance(data, str):
+            data = data.encode()
+    else:
+        raise RowError("data and payload are both missing")
+
+    reading_id = row.get("reading_id") or ""
+    if reading_id:
+        try:
+            reading_id = uuid.UUID(str(reading_id))
+        except ValueError:
+            raise RowError("reading_id is not a uuid")
+
+    # csv copy doesn't unescape, so bytea hex is written as is
+    return f'{sensor_id},"{recorded_at}",\\x{data.hex()},{reading_id}\n'
+
+
+def parse_sensor_id(value) -> int | None:
+    """
+    The sensor_id of a row, None if it can't be one
+    """
+
+    try:
+        sensor_id = int(value)
+    except (TypeError, ValueError):
+        return None
+    # sensor_table.sensor_id is an integer column
+    if not 0 < sensor_id < 2**31:
+        return None
+    return sensor_id
+
+
+class SensorResolver:
+    """
+    Maps the sensor_key / sensor_id of rows to sensor ids, one query per
+    chunk for the keys and ids it hasn't seen yet
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.by_key: dict[str, int | None] = {}
+        self.by_id: dict[int, int | None] = {}
+
+    def resolve(self, rows: list[dict]):
+        keys = set()
+        ids = set()
+        for row in rows:
+            if row.get("sensor_key"):
+                keys.add(str(row["sensor_key"]))
+            elif row.get("sensor_id") not in (None, ""):
+                sensor_id = parse_sensor_id(row["sensor_id"])
+                if sensor_id is not None:
+                    ids.add(sensor_id)
+        keys -= self.by_key.keys()
+        ids -= self.by_id.keys()
+
+        if keys:
+            valid = set()
+            for key in keys:
+                try:
+                    valid.add(uuid.UUID(key))
+                except ValueError:
+                    self.by_key[key] = None
+            found = dict(
+                self.connection.execute(
+                    text(
+                        "SELECT key, sensor_id FROM sensor_table WHERE key = ANY(:keys)"
+                    ),
+                    {"keys": list(valid)},
+                ).all()
+            )
+            for key in valid:
+                self.by_key[str(key)] = found.get(key)
+            # rows may spell a key differently than str(uuid) does
+            for key in keys - self.by_key.keys():
+                self.by_key[key] = found.get(uuid.UUID(key))
+        if ids:
+            found = set(
+                self.connection.execute(
+                    text(
+                        "SELECT sensor_id FROM sensor_table WHERE sensor_id = ANY(:ids)"
+                    ),
+                    {"ids": list(ids)},
+                ).scalars()
+            )
+            for sensor_id in ids:
+                self.by_id[sensor_id] = sensor_id if sensor_id in found else None
+
+    def sensor_id(self, row: dict) -> int:
+        if row.get("sensor_key"):
+            sensor_id = self.by_key.get(str(row["sensor_key"]))
+            if sensor_id is None:
+                raise RowError(f"unknown sensor_key {row['sensor_key']}")
+            return sensor_id
+        if row.get("sensor_id") not in (None, ""):
+            sensor_id = parse_sensor_id(row["sensor_id"])
+            if sensor_id is None:
+                raise RowError(f"sensor_id {row['sensor_id']} is not a sensor id")
+            sensor_id = self.by_id.get(sensor_id)
+            if sensor_id is None:
+                raise RowError(f"unknown sensor_id {row['sensor_id']}")
+            return sensor_id
+        raise RowError("sensor_key and sensor_id are both missing")
+
+
+class Checkpoint:
+    """
+    Rows of every file that are committed, kept in a json file
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.files: dict[str, int] = {}
+        if path.exists():
+            self.files = json.loads(path.read_text())["files"]
+
+    def done(self, file: Path) -> int:
+        return self.files.get(str(file.resolve()), 0)
+
+    def save(self, file: Path, rows: int):
+        self.files[str(file.resolve())] = rows
+        # written next to the checkpoint and renamed, so it's never half written
+        partial = self.path.with_suffix(self.path.suffix + ".partial")
+        partial.write_text(json.dumps({"files": self.files}, indent=2))
+        os.replace(partial, self.path)
+
+
+def copy_chunk(engine, lines: list[str], sensor_ids: set[int]) -> int:
+    """
+    COPY lines into the staging table and move them into sensor_data in one
+    transaction, return the number of rows inserted
+    """
+
+    # running api workers evict the sensors' cached aggregates on commit,
+    # the readings are (mostly) older than their closed buckets
+    payload = json.dumps({"cache": "aggregates", "keys": sorted(map(str, sensor_ids))})
+    if len(payload.encode()) > invalidation.MAX_PAYLOAD:
+        payload = json.dumps({"cache": "aggregates", "keys": None})
+
+    connection = engine.raw_connection()
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(_STAGING)
+            cursor.copy_expert(
+                "COPY sensor_data_import "
+                "(sensor_id_sensor_table, time_recorded, data, unique_id) "
+                "FROM STDIN WITH (FORMAT csv)",
+                io.StringIO("".join(lines)),
+            )
+            cursor.execute(_MOVE)
+            inserted = cursor.fetchone()[0]
+            if inserted:
+                cursor.execute(
+                    "SELECT pg_notify(%s, %s)", (invalidation.CHANNEL, payload)
+                )
+        connection.commit()
+        return inserted
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def import_file(engine, path: Path, file_format: str, checkpoint, args, totals):
+    done = checkpoint.done(path)
+    if done:
+        print(f"{path}: resuming after {done} rows")
+
+    rows = read_rows(path, file_format, done)
+    # the next chunk is parsed while the previous one is copied
+    with ThreadPoolExecutor(max_workers=1) as copier, engine.connect() as connection:
+        resolver = SensorResolver(connection)
+        pending = None
+        position = done
+        while True:
+            chunk = []
+            for row in rows:
+                chunk.append(row)
+                if len(chunk) >= args.chunk_rows:
+                    break
+
+            lines = []
+            sensor_ids = set()
+            error = None
+            if chunk:
+                resolver.resolve(chunk)
+                for i, row in enumerate(chunk):
+                    try:
+                        sensor_id = resolver.sensor_id(row)
+                        lines.append(to_copy_line(row, sensor_id))
+                        sensor_ids.add(sensor_id)
+                    except (RowError, ValueError, TypeError) as e:
+                        if not args.skip_invalid:
+                            error = RowError(f"{path} row {position + i + 1}: {e}")
+                            break
+                        totals["skipped"] += 1
+
+            # the previous chunk is checkpointed even if this one can't be sent
+            if pending is not None:
+                future, chunk_end, chunk_rows = pending
+                inserted = future.result()
+                checkpoint.save(path, chunk_end)
+                totals["rows"] += chunk_rows
+                totals["inserted"] += inserted
+                report(path, chunk_end, totals)
+
+            if error:
+                raise error
+            if not chunk:
+                break
+            position += len(chunk)
+            pending = (
+                copier.submit(copy_chunk, engine, lines, sensor_ids),
+                position,
+                len(lines),
+            )
+
+
+def report(path: Path, position: int, totals: dict):
+    elapsed = time.perf_counter() - totals["start"]
+    duplicates = totals["rows"] - totals["inserted"]
+    print(
+        f"{path}: {position} rows read, {totals['inserted']} inserted,"
+        f" {duplicates} already stored, {totals['skipped']} skipped,"
+        f" {totals['rows'] / elapsed:,.0f} rows/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("files", nargs="+", type=Path)
+    parser.add_argument(
+        "--database-url",
+        default=os.environ.get("DATABASE_URL")
+        or dotenv_values(".env").get("DATABASE_URL"),
+    )
+    parser.add_argument("--format", choices=FORMATS, help="default: by file suffix")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument(
+        "--checkpoint", type=Path, default=Path("import_readings.checkpoint.json")
+    )
+    parser.add_argument(
+        "--skip-invalid",
+        action="store_true",
+        help="skip rows that can't be imported instead of stopping",
+    )
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url or DATABASE_URL is required")
+
+    formats = [args.format or detect_format(path) for path in args.files]
+    if "parquet" in formats and pyarrow is None:
+        parser.error('parquet files need pyarrow, pip install "api[import]"')
+
+    engine = create_engine(args.database_url)
+    checkpoint = Checkpoint(args.checkpoint)
+    totals = {"rows": 0, "inserted": 0, "skipped": 0, "start": time.perf_counter()}
+    try:
+        for path, file_format in zip(args.files, formats):
+            import_file(engine, path, file_format, checkpoint, args, totals)
+    except RowError as e:
+        sys.exit(f"import stopped, {e}")
+    print(
+        f"done: {totals['inserted']} inserted,"
+        f" {totals['rows'] - totals['inserted']} already stored,"
+        f" {totals['skipped']} skipped"
+        f" in {time.perf_counter() - totals['start']:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
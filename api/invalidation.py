@@ -0,0 +1,206 @@
+"""
+In-process caches that stay correct when the api runs as several worker
+processes
+
+every worker keeps its own LocalCache, a route that changes cached rows
+calls publish() inside its transaction, which evicts the keys locally and
+sends a NOTIFY on CHANNEL. postgres only delivers the notification once
+the transaction commits (and drops it on rollback), each worker's listener
+thread receives it on a dedicated connection and evicts the same keys.
+if the listener loses its connection notifications may have been missed,
+so every cache is cleared when it reconnects. entries also expire after a
+ttl as a last line of defence
+"""
+
+import json
+import logging
+import select as _select
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import text
+
+import metrics
+
+logger = logging.getLogger("sensata.invalidation")
+
+CHANNEL = "sensata_invalidate"
+
+# postgres rejects NOTIFY payloads of 8000 bytes or more, events with more
+# keys than fit are sent as "clear the whole cache" instead
+MAX_PAYLOAD = 7900
+
+_MISSING = object()
+
+
+class LocalCache:
+    """
+    A thread safe lru cache with a ttl, owned by one worker process
+    """
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every eviction, see set()
+        self.generation = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[0] > now:
+                self._entries.move_to_end(key)
+                metrics.CACHE_LOOKUPS.labels(self.name, "hit").inc()
+                return entry[1]
+            if entry is not _MISSING:
+                del self._entries[key]
+        metrics.CACHE_LOOKUPS.labels(self.name, "miss").inc()
+        return default
+
+    def set(self, key, value, generation: int | None = None):
+        """
+        Store a value, pass the generation read before loading it from the
+        database so a value that was invalidated in the meantime isn't stored
+        """
+
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def evict(self, keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Invalidator:
+    """
+    Registry of the worker's caches and the LISTEN side of the channel
+    """
+
+    def __init__(self, engine, reconnect_delay: float = 1.0):
+        self.engine = engine
+        self.reconnect_delay = reconnect_delay
+        self.caches: dict[str, LocalCache] = {}
+        # keys are json encoded, this turns them back into the cache's keys
+        self.key_types: dict[str, type] = {}
+        self._stop = threading.Event()
+        self._listening = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def cache(self, name: str, maxsize: int, ttl: float, key_type=str) -> LocalCache:
+        cache = LocalCache(name, maxsize, ttl)
+        self.caches[name] = cache
+        self.key_types[name] = key_type
+        return cache
+
+    def publish(self, session, name: str, keys=None):
+        """
+        Evict `keys` (None for everything) from cache `name` in every worker
+        once the session's transaction commits
+        """
+
+        keys = None if keys is None else [str(key) for key in keys]
+        self._apply(name, keys)
+
+        payload = json.dumps({"cache": name, "keys": keys})
+        if len(payload.encode()) > MAX_PAYLOAD:
+            payload = json.dumps({"cache": name, "keys": None})
+        session.execute(
+            text("SELECT pg_notify(:channel, :payload)"),
+            {"channel": CHANNEL, "payload": payload},
+        )
+        metrics.INVALIDATIONS_PUBLISHED.labels(name).inc()
+
+    def _apply(self, name: str, keys: list[str] | None):
+        cache = self.caches.get(name)
+        if cache is None:
+            return
+        if keys is None:
+            cache.clear()
+        else:
+            key_type = self.key_types[name]
+            cache.evict(key_type(key) for key in keys)
+
+    def handle(self, payload: str):
+        try:
+            event = json.loads(payload)
+            self._apply(event["cache"], event["keys"])
+        except (ValueError, KeyError, TypeError):
+            # a broken event could hide a change, don't risk stale entries
+            logger.warning("invalid invalidation event %r, clearing caches", payload)
+            self.clear_all()
+            return
+        metrics.INVALIDATIONS_RECEIVED.labels(event["cache"]).inc()
+
+    def clear_all(self):
+        for cache in self.caches.values():
+            cache.clear()
+
+    def start(self, timeout: float = 10.0) -> bool:
+        """
+        Start the listener thread and wait until it is listening,
+        return False if it didn't manage to within `timeout` seconds
+        """
+
+        self._stop.clear()
+        self._listening.clear()
+        self._thread = threading.Thread(
+            target=self._listen_forever, name="invalidation-listener", daemon=True
+        )
+        self._thread.start()
+        return self._listening.wait(timeout)
+
+    def stop(self, timeout: float = 5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _listen_forever(self):
+        while not self._stop.is_set():
+            try:
+                self._listen()
+            except Exception:
+                logger.exception("invalidation listener failed, reconnecting")
+                self._stop.wait(self.reconnect_delay)
+
+    def _listen(self):
+        # a connection of its own, outside the pool, that only ever LISTENs
+        connection = self.engine.raw_connection()
+        connection.detach()
+        dbapi_connection = connection.dbapi_connection
+        try:
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            # anything may have changed while we weren't listening
+            self.clear_all()
+            self._listening.set()
+
+            while not self._stop.is_set():
+                readable, _, _ = _select.select([dbapi_connection], [], [], 1.0)
+                if not readable:
+                    continue
+                dbapi_connection.poll()
+                while dbapi_connection.notifies:
+                    self.handle(dbapi_connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
@@ -0,0 +1,218 @@
+"""
+Keyset pagination, filtering, sorting and column projection for list endpoints
+
+a page is fetched with a single indexed range query instead of loading the
+whole table, the cursor of the next page is returned in the X-Next-Cursor
+header so the response body stays a plain list of rows
+"""
+
+import base64
+import json
+import uuid
+from datetime import datetime
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy import DateTime, Uuid, and_, or_, select, text
+
+MAX_LIMIT = 1000
+
+# rows fetched per round trip when streaming
+STREAM_BATCH = 500
+
+
+def _encode_cursor(values: list) -> str:
+    raw = json.dumps(jsonable_encoder(values)).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> list:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != 3:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+def _parse_value(column, value):
+    # cursor values travel as json, turn them back into the column's type
+    if value is None:
+        return None
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, Uuid):
+        return uuid.UUID(value)
+    return value
+
+
+def _parse_fields(fields: str | None, allowed: list[str], default: list[str]):
+    if fields is None:
+        return default
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown or not names:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown field(s) {', '.join(unknown)}, allowed: {', '.join(allowed)}",
+        )
+    return names
+
+
+def _keyset_condition(sort_column, pk, descending: bool, cursor_values: list):
+    # rows are ordered (sort_column IS NULL, sort_column, pk) so nulls come
+    # last in both directions and every row has a unique position
+    is_null, value, last_pk = cursor_values
+    value = _parse_value(sort_column, value)
+    after_pk = pk < last_pk if descending else pk > last_pk
+
+    if sort_column is pk:
+        return after_pk
+    if is_null:
+        return and_(sort_column.is_(None), after_pk)
+
+    after_value = sort_column < value if descending else sort_column > value
+    return or_(
+        sort_column.is_(None),
+        after_value,
+        and_(sort_column == value, after_pk),
+    )
+
+
+def estimate_count(session, statement, table_name: str, filtered: bool) -> int:
+    """
+    Estimate the number of matching rows without COUNT(*)
+
+    unfiltered counts come from the table statistics in pg_class, filtered
+    ones (and never analyzed tables) from the row estimate of the query plan
+    """
+
+    if not filtered:
+        estimate = session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name"),
+            {"name": table_name},
+        ).scalar()
+        # -1 means the table was never analyzed, fall back to the planner
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+
+    # filter values stay bound parameters, rendered into the sql they could
+    # be parsed as binds or break the quoting
+    compiled = statement.compile(
+        dialect=session.get_bind().dialect, compile_kwargs={"render_postcompile": True}
+    )
+    plan = (
+        session.connection()
+        .exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}", compiled.params)
+        .scalar()
+    )
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+def list_rows(
+    session,
+    model,
+    *,
+    allowed_fields: list[str],
+    default_fields: list[str],
+    sortable: list[str],
+    filters: list,
+    fields: str | None = None,
+    sort: str | None = None,
+    cursor: str | None = None,
+    limit: int = 100,
+    count: bool = False,
+    stream: bool = False,
+    session_factory=None,
+):
+    """
+    Return one page of `model` rows as a JSONResponse (or a ndjson stream)
+
+    sort is a column name, prefixed with "-" for descending order, fields is a
+    comma separated projection, count adds an X-Estimated-Total header and
+    stream returns every remaining row as ndjson using session_factory
+    """
+
+    pk = getattr(model, model.__table__.primary_key.columns.values()[0].key)
+
+    names = _parse_fields(fields, allowed_fields, default_fields)
+    columns = [getattr(model, name) for name in names]
+
+    sort = sort or pk.key
+    descending = sort.startswith("-")
+    sort_name = sort.lstrip("-")
+    if sort_name not in sortable:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Can't sort by {sort_name}, allowed: {', '.join(sortable)}",
+        )
+    sort_column = getattr(model, sort_name)
+
+    if limit < 1 or limit > MAX_LIMIT:
+        raise HTTPException(
+            status_code=400, detail=f"limit must be between 1 and {MAX_LIMIT}"
+        )
+
+    # the sort column and pk are always selected so the next cursor can be built
+    extra = [c for c in (sort_column, pk) if not any(c is column for column in columns)]
+    statement = select(*columns, *extra).where(*filters)
+
+    headers = {}
+    if count:
+        headers["X-Estimated-Total"] = str(
+            estimate_count(session, statement, model.__tablename__, bool(filters))
+        )
+
+    if cursor is not None:
+        statement = statement.where(
+            _keyset_condition(sort_column, pk, descending, _decode_cursor(cursor))
+        )
+
+    if sort_column is pk:
+        order = [pk.desc() if descending else pk]
+    else:
+        order = [
+            sort_column.is_(None),
+            sort_column.desc() if descending else sort_column,
+            pk.desc() if descending else pk,
+        ]
+    statement = statement.order_by(*order)
+
+    if stream:
+        return StreamingResponse(
+            _stream(session_factory, statement, names),
+            media_type="application/x-ndjson",
+            headers=headers,
+        )
+
+    rows = session.execute(statement.limit(limit + 1)).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    if has_more:
+        last = rows[-1]._mapping
+        sort_value = last[sort_column.key]
+        headers["X-Next-Cursor"] = _encode_cursor(
+            [sort_value is None, sort_value, last[pk.key]]
+        )
+
+    items = [{name: row._mapping[name] for name in names} for row in rows]
+    return JSONResponse(content=jsonable_encoder(items), headers=headers)
+
+
+def _stream(session_factory, statement, names):
+    # the request's session is closed before a streaming body is sent,
+    # so stream from a session (and server side cursor) of our own
+    with session_factory() as session:
+        result = session.execute(statement.execution_options(yield_per=STREAM_BATCH))
+        for partition in result.partitions():
+            yield "".join(
+                json.dumps(
+                    jsonable_encoder({name: row._mapping[name] for name in names})
+                )
+                + "\n"
+                for row in partition
+            )
@@ -3,22 +3,44 @@ from typing import Annotated, Union, Optional
 from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response
 from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 
+from sqlalchemy import insert, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.util import b64decode
 from sqlmodel import Session, create_engine, select, union
 
+import asyncio
 import base64
+import math
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
 from models import *
 
+import aggregates
+import alerts
+import bulk
+from compression import CompressionMiddleware
+import invalidation
+import ids
+from listing import list_rows
+import metrics
+import profiling
+import querylog
+import ratelimit
+import replicas
+import schema
+import stats
+import user_sessions
+import wire
+
 from datetime import timedelta
 
 from json import JSONEncoder, dumps
 
 from pydantic import BaseModel
 
-import bcrypt
-
 
 class sensor_type(BaseModel):
     model_name: str | None
@@ -30,6 +52,32 @@ class sensor_data_type(BaseModel):
     data: str
     sensor_key: uuid.UUID
     recorded_at: datetime
+    # chosen by the client and sent again on a retry, so it's stored once
+    reading_id: uuid.UUID | None = None
+
+
+class sensor_bulk_type(BaseModel):
+    sensors: list[sensor_type]
+
+
+class sensor_ids_type(BaseModel):
+    sensor_ids: list[int]
+
+
+class api_key_grants_type(BaseModel):
+    sensor_ids: list[int] = []
+    group_ids: list[int] = []
+
+
+class alert_rule_type(BaseModel):
+    sensor_id: int
+    kind: str
+    field: str = "distance"
+    threshold: float | None = None
+    window_seconds: float | None = None
+    alpha: float | None = None
+    cooldown_seconds: float = 300
+    webhook_url: str | None = None
 
 
 class CustomJSONEncoder(JSONEncoder):
@@ -47,7 +95,85 @@ class CustomJSONEncoder(JSONEncoder):
         return super().default(o)
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # runs in every worker, before the first request is accepted
+    await asyncio.gather(
+        asyncio.to_thread(create_db_and_tables),
+        asyncio.to_thread(warm_pool, warm_connections),
+        # evict cache entries changed by other workers, the listener clears
+        # the caches when it connects so it has to be up before warm_caches
+        asyncio.to_thread(invalidator.start),
+    )
+    await asyncio.to_thread(warm_caches)
+    await asyncio.to_thread(read_router.check)
+    await asyncio.to_thread(alerts.arm_silence_rules, engine, alert_evaluator)
+
+    # delete expired sessions in the background
+    session_reaper = asyncio.create_task(
+        user_sessions.reap_forever(
+            engine,
+            session_policy,
+            interval=float(env_vars.get("SESSION_REAP_INTERVAL_SECONDS") or 300),
+            batch_size=int(env_vars.get("SESSION_REAP_BATCH") or 1000),
+        )
+    )
+
+    # fire silence rules of sensors that stopped sending readings
+    silence_watcher = asyncio.create_task(
+        alerts.watch_silence(
+            engine,
+            alert_evaluator,
+            interval=float(env_vars.get("ALERT_CHECK_INTERVAL_SECONDS") or 1),
+        )
+    )
+
+    # roll new readings up into the hour and day sketches, one worker at a
+    # time, 0 leaves it to other workers
+    sketch_rollup = None
+    sketch_interval = float(env_vars.get("SKETCH_ROLLUP_INTERVAL_SECONDS") or 10)
+    if sketch_interval > 0:
+        import sketches
+
+        sketch_rollup = asyncio.create_task(
+            sketches.rollup_forever(
+                engine,
+                interval=sketch_interval,
+                batch_size=int(env_vars.get("SKETCH_ROLLUP_BATCH") or 50000),
+                delay=float(env_vars.get("SKETCH_ROLLUP_DELAY_SECONDS") or 60),
+            )
+        )
+
+    # write the reading counters every few seconds instead of every reading
+    stats_flusher = asyncio.create_task(
+        stats.flush_forever(
+            stats_counters,
+            engine,
+            interval=float(env_vars.get("STATS_FLUSH_INTERVAL_SECONDS") or 5),
+        )
+    )
+
+    # send reads to the primary while the replica is down or behind
+    replica_watcher = asyncio.create_task(
+        replicas.watch(
+            read_router,
+            interval=float(env_vars.get("REPLICA_CHECK_INTERVAL_SECONDS") or 2),
+        )
+    )
+
+    yield
+
+    session_reaper.cancel()
+    silence_watcher.cancel()
+    replica_watcher.cancel()
+    if sketch_rollup is not None:
+        sketch_rollup.cancel()
+    stats_flusher.cancel()
+    await asyncio.to_thread(stats_counters.flush, engine)
+    await asyncio.to_thread(invalidator.stop)
+
+
+app = FastAPI(lifespan=lifespan)
 
 # CORS Config
 app.add_middleware(
@@ -61,35 +187,325 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Estimated-Total", "X-Profile"],
 )
 
-# read db url from .env file
+# read db url from .env file, environment variables take precedence
+import os
+
 from dotenv import dotenv_values
 
-env_vars = dotenv_values(".env")
+env_vars = {**dotenv_values(".env"), **os.environ}
 DATABASE_URL = env_vars["DATABASE_URL"]
 assert DATABASE_URL is not None
 
+# compress the (large) data responses and accept compressed ingest bodies
+app.add_middleware(
+    CompressionMiddleware,
+    paths=(
+        "/api/v1/data",
+        "/api/v1/sensor_data",
+        "/api/v1/group_data",
+        "/api/v1/sensor_export",
+    ),
+    minimum_size=int(env_vars.get("COMPRESSION_MIN_SIZE") or 1024),
+    gzip_level=int(env_vars.get("COMPRESSION_GZIP_LEVEL") or 5),
+    brotli_quality=int(env_vars.get("COMPRESSION_BROTLI_QUALITY") or 4),
+    zstd_level=int(env_vars.get("COMPRESSION_ZSTD_LEVEL") or 3),
+    max_request_size=int(env_vars.get("MAX_REQUEST_BODY_SIZE") or 16 * 1024 * 1024),
+)
+
 connect_args = {}
 engine = create_engine(
     DATABASE_URL,
-    echo=True,
+    echo=(env_vars.get("SQL_ECHO") or "true").lower() == "true",
+    pool_size=int(env_vars.get("DB_POOL_SIZE") or 5),
+    max_overflow=int(env_vars.get("DB_MAX_OVERFLOW") or 10),
     connect_args=connect_args,
 )
+metrics.instrument_engine(engine)
+querylog.instrument_engine(
+    engine,
+    slow_query_ms=float(env_vars.get("SLOW_QUERY_MS") or 200),
+    explain=(env_vars.get("SLOW_QUERY_EXPLAIN") or "true").lower() == "true",
+)
+
+# optional read only engine (a replica) for the heavy GET routes
+READ_DATABASE_URL = env_vars.get("READ_DATABASE_URL")
+read_engine = None
+if READ_DATABASE_URL:
+    read_engine = create_engine(
+        READ_DATABASE_URL,
+        echo=(env_vars.get("SQL_ECHO") or "true").lower() == "true",
+        pool_size=int(
+            env_vars.get("READ_DB_POOL_SIZE") or env_vars.get("DB_POOL_SIZE") or 5
+        ),
+        max_overflow=int(
+            env_vars.get("READ_DB_MAX_OVERFLOW")
+            or env_vars.get("DB_MAX_OVERFLOW")
+            or 10
+        ),
+        connect_args=connect_args,
+    )
+    metrics.instrument_engine(read_engine)
+    querylog.instrument_engine(
+        read_engine,
+        slow_query_ms=float(env_vars.get("SLOW_QUERY_MS") or 200),
+        explain=(env_vars.get("SLOW_QUERY_EXPLAIN") or "true").lower() == "true",
+    )
+    # clients that just wrote read from the primary for a while
+    app.add_middleware(
+        replicas.ReadYourWritesMiddleware,
+        sticky_seconds=float(env_vars.get("READ_YOUR_WRITES_SECONDS") or 10),
+    )
+read_router = replicas.ReadRouter(
+    engine,
+    read_engine,
+    max_lag=float(env_vars.get("REPLICA_MAX_LAG_SECONDS") or 5),
+)
+
+
+def is_admin_session(cookies: dict) -> bool:
+    """
+    Check if the session token cookie belongs to an admin
+    """
+
+    session_token = cookies.get("session_token")
+    if session_token is None:
+        return False
+    with new_session() as session:
+        logged_in = user_sessions.lookup(
+            session, session_policy, session_token, session_cache
+        )
+    return logged_in is not None and logged_in.is_admin
+
+
+# admins can profile a single request with ?profile=1 or an X-Profile header
+app.add_middleware(
+    profiling.ProfileMiddleware,
+    is_admin=is_admin_session,
+    directory=env_vars.get("PROFILE_DIR") or "profiles",
+    interval_ms=float(env_vars.get("PROFILE_INTERVAL_MS") or 1),
+)
+
+app.add_middleware(
+    querylog.QueryReportMiddleware,
+    statement_budget=int(env_vars.get("STATEMENT_BUDGET") or 10),
+    debug_header=(env_vars.get("DB_DEBUG_HEADER") or "false").lower() == "true",
+)
+
+# outermost middleware so the timings include compression
+app.add_middleware(metrics.MetricsMiddleware, fastapi_app=app)
+
+# bcrypt is deliberately slow, run it off the event loop in a bounded pool
+bcrypt_pool = ThreadPoolExecutor(
+    max_workers=int(env_vars.get("BCRYPT_WORKERS") or 4),
+    thread_name_prefix="bcrypt",
+)
+
+
+async def run_bcrypt(fn, *args):
+    """
+    Run a bcrypt function in the bcrypt pool and track pool saturation
+    """
+
+    metrics.BCRYPT_WAITING.inc()
+
+    def call():
+        metrics.BCRYPT_WAITING.dec()
+        metrics.BCRYPT_IN_USE.inc()
+        try:
+            return fn(*args)
+        finally:
+            metrics.BCRYPT_IN_USE.dec()
+
+    return await asyncio.get_running_loop().run_in_executor(bcrypt_pool, call)
+
+
+def _bcrypt():
+    # imported on first use, most requests never touch a password
+    import bcrypt
+
+    return bcrypt
+
+
+async def hash_password(password: str) -> str:
+    bcrypt = _bcrypt()
+    hashed = await run_bcrypt(bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt())
+    return hashed.decode("utf-8")
+
+
+async def check_password(password: str, password_hash: str) -> bool:
+    bcrypt = _bcrypt()
+    return await run_bcrypt(
+        bcrypt.checkpw, password.encode("utf-8"), password_hash.encode("utf-8")
+    )
 
 
 def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+    # a no-op (one query) when alembic migrations are current
+    schema.ensure_schema(engine, SQLModel.metadata)
+
+
+# connections opened on startup so the first requests don't pay for them
+warm_connections = int(
+    env_vars.get("DB_WARM_CONNECTIONS") or int(env_vars.get("DB_POOL_SIZE") or 5)
+)
+
+
+def warm_pool(size: int):
+    """
+    Open `size` pooled connections concurrently
+    """
+
+    if size <= 0:
+        return
+    with ThreadPoolExecutor(max_workers=size) as executor:
+        connections = list(executor.map(lambda _: engine.connect(), range(size)))
+    for connection in connections:
+        connection.close()
+
+
+def new_session() -> Session:
+    return Session(engine)
 
 
 def get_session():
-    with Session(engine) as session:
+    with new_session() as session:
         yield session
 
 
 SessionDep = Annotated[Session, Depends(get_session)]
 
 
+def get_read_session(request: Request):
+    with Session(read_router.engine_for(request.headers, request.cookies)) as session:
+        yield session
+
+
+# for GET routes that only read, may be a replica (see replicas.py)
+ReadSessionDep = Annotated[Session, Depends(get_read_session)]
+
+
+class ListParams(BaseModel):
+    """
+    Query parameters shared by the list endpoints
+    """
+
+    fields: str | None = None
+    sort: str | None = None
+    cursor: str | None = None
+    limit: int = 100
+    count: bool = False
+    stream: bool = False
+
+
+ListQuery = Annotated[ListParams, Depends()]
+
+# numeric payload fields that can be charted
+SERIES_FIELDS = ("distance", "count")
+SERIES_MAX_POINTS = 5000
+# readings a series request may load, they are all decoded in memory
+SERIES_MAX_ROWS = int(env_vars.get("SERIES_MAX_ROWS") or 1_000_000)
+# the unique index a retried reading conflicts on
+READING_ID_COLUMNS = [SensorData.sensor_id_sensor_table, SensorData.unique_id]
+# rows fetched and decoded at a time by the csv export
+EXPORT_BATCH = 10000
+AGGREGATE_MAX_BUCKETS = 5000
+
+
+# per worker caches, kept in sync between workers through LISTEN/NOTIFY
+invalidator = invalidation.Invalidator(engine)
+cache_ttl = float(env_vars.get("CACHE_TTL_SECONDS") or 60)
+# session token -> user_sessions.LoggedIn
+session_cache = invalidator.cache(
+    "sessions",
+    maxsize=int(env_vars.get("SESSION_CACHE_SIZE") or 10000),
+    ttl=cache_ttl,
+    key_type=uuid.UUID,
+)
+# sensor key -> sensor_id, only known keys are cached
+sensor_key_cache = invalidator.cache(
+    "sensor_keys",
+    maxsize=int(env_vars.get("SENSOR_KEY_CACHE_SIZE") or 100000),
+    ttl=cache_ttl,
+    key_type=uuid.UUID,
+)
+# sensor_id -> active alert rules, sensors without rules are cached too
+alert_rule_cache = invalidator.cache(
+    "alert_rules",
+    maxsize=int(env_vars.get("ALERT_RULE_CACHE_SIZE") or 100000),
+    ttl=cache_ttl,
+    key_type=int,
+)
+# webhooks go to public addresses only unless this is set
+allow_private_webhooks = (
+    env_vars.get("ALERT_WEBHOOK_ALLOW_PRIVATE") or "false"
+).lower() == "true"
+alert_evaluator = alerts.Evaluator(alert_rule_cache, allow_private_webhooks)
+# readings stored by this worker, flushed to the stats tables in the background
+stats_counters = stats.Counters()
+# sensor_id -> aggregates.SensorAggregates, closed buckets don't expire
+aggregate_cache = invalidator.cache(
+    "aggregates",
+    maxsize=int(env_vars.get("AGGREGATE_CACHE_SENSORS") or 1000),
+    ttl=math.inf,
+    key_type=int,
+)
+aggregator = aggregates.Aggregator(
+    aggregate_cache,
+    late_seconds=float(env_vars.get("AGGREGATE_LATE_SECONDS") or 600),
+    max_buckets=int(env_vars.get("AGGREGATE_CACHE_BUCKETS") or 10000),
+)
+
+
+# ingest rate limits in requests per second, checked before any database
+# work, a rate of 0 disables the limit
+sensor_rate_limit = ratelimit.Policy(
+    "sensor",
+    rate=float(env_vars.get("SENSOR_RATE_LIMIT") or 5),
+    burst=float(env_vars.get("SENSOR_RATE_BURST") or 20),
+)
+# many pis can share an address behind nat, so this one is off by default
+client_rate_limit = ratelimit.Policy(
+    "client",
+    rate=float(env_vars.get("CLIENT_RATE_LIMIT") or 0),
+    burst=float(env_vars.get("CLIENT_RATE_BURST") or 200),
+)
+rate_limiter = ratelimit.RateLimiter(
+    maxsize=int(env_vars.get("RATE_LIMIT_KEYS") or 100000)
+)
+
+
+def check_rate_limit(request: Request, endpoint: str, sensor_keys):
+    """
+    Answer with a 429 if the client or one of the sensors is over its limit
+    """
+
+    checks = [(client_rate_limit, request.client.host if request.client else None)]
+    checks.extend((sensor_rate_limit, sensor_key) for sensor_key in sensor_keys)
+    wait, limited = rate_limiter.acquire(checks)
+    if limited is not None:
+        metrics.RATE_LIMITED.labels(endpoint, limited).inc()
+        raise HTTPException(
+            status_code=429,
+            detail=f"Rate limit of the {limited} exceeded",
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
+    metrics.RATE_LIMITED.labels(endpoint, "accepted").inc()
+
+
+session_policy = user_sessions.SessionPolicy(
+    idle_timeout=timedelta(
+        minutes=float(env_vars.get("SESSION_IDLE_TIMEOUT_MINUTES") or 7 * 24 * 60)
+    ),
+    max_age=timedelta(hours=float(env_vars.get("SESSION_MAX_AGE_HOURS") or 30 * 24)),
+    touch_interval=timedelta(
+        seconds=float(env_vars.get("SESSION_TOUCH_INTERVAL_SECONDS") or 60)
+    ),
+)
+
+
 async def is_logged_in(session: SessionDep, request: Request) -> Optional[dict]:
     """
     Check if a user is logged in
@@ -101,24 +517,45 @@ async def is_logged_in(session: SessionDep, request: Request) -> Optional[dict]:
         # return {}
         raise HTTPException(status_code=404, detail="Session token not found")
 
-    user = session.exec(
-        select(User).where(UserSession.session_token == session_token)
-    ).first()
+    logged_in = user_sessions.lookup(
+        session, session_policy, session_token, session_cache
+    )
 
-    if user is None:
+    if logged_in is None:
         # return {}
         raise HTTPException(status_code=404, detail="User not found")
 
     # return is_logged_in, user_id, is_admin
-    return {"is_logged_in": True, "user_id": user.user_id, "is_admin": user.is_admin}
+    return {
+        "is_logged_in": True,
+        "user_id": logged_in.user_id,
+        "is_admin": logged_in.is_admin,
+        "session_id": logged_in.session_id,
+    }
 
 
 LoginDep = Annotated[dict, Depends(is_logged_in)]
 
 
-@app.on_event("startup")
-def on_startup():
-    create_db_and_tables()
+def warm_caches():
+    """
+    Fill the caches with the rows the first requests are most likely to need
+    """
+
+    with new_session() as session:
+        generation = sensor_key_cache.generation
+        for key, sensor_id in session.exec(
+            select(SensorTable.key, SensorTable.sensor_id)
+            .where(SensorTable.key.is_not(None))
+            .limit(sensor_key_cache.maxsize)
+        ):
+            sensor_key_cache.set(key, sensor_id, generation)
+
+        generation = session_cache.generation
+        for token, logged_in in user_sessions.recent(
+            session, session_policy, session_cache.maxsize
+        ).items():
+            session_cache.set(token, logged_in, generation)
 
 
 @app.get("/")
@@ -130,17 +567,111 @@ async def read_root():
     return {"Hello": "World"}
 
 
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus metrics
+    """
+
+    body, content_type = metrics.metrics_response_body()
+    return Response(content=body, media_type=content_type)
+
+
 # list api keys
 @app.get("/api/v1/admin/list_api_keys")
-async def list_api_keys(session: SessionDep):
+async def list_api_keys(
+    session: SessionDep,
+    params: ListQuery,
+    user_id: int | None = None,
+    is_active: bool | None = None,
+):
     """
-    Lists all api keys
+    Lists api keys, a page at a time (see list_rows)
 
-    todo: implement authentication and pagination
+    api_key_text is only returned when asked for with fields
+    todo: implement authentication
     """
 
-    keys = session.exec(select(ApiKey)).all()
-    return keys
+    filters = []
+    if user_id is not None:
+        filters.append(ApiKey.user_id_user == user_id)
+    if is_active is not None:
+        filters.append(ApiKey.is_active == is_active)
+
+    return list_rows(
+        session,
+        ApiKey,
+        allowed_fields=[
+            "api_key_id",
+            "user_id_user",
+            "created_at",
+            "expires_at",
+            "permission_level",
+            "is_active",
+            "api_key_text",
+        ],
+        default_fields=[
+            "api_key_id",
+            "user_id_user",
+            "created_at",
+            "expires_at",
+            "permission_level",
+            "is_active",
+        ],
+        sortable=["api_key_id", "created_at", "expires_at"],
+        filters=filters,
+        session_factory=new_session,
+        **params.model_dump(),
+    )
+
+
+# reading counters
+@app.get("/api/v1/admin/stats")
+async def get_stats(session: SessionDep, days: int = 30):
+    """
+    Returns the readings stored in total, today and on each of the last
+    `days` days, and when the newest one was added
+
+    read from the counter tables (see stats.py), not sensor_data
+    todo: implement authentication
+    """
+
+    return stats.overview(session, datetime.now().date(), max(1, min(days, 366)))
+
+
+@app.get("/api/v1/admin/stats/{sensor_id}")
+async def get_sensor_stats(sensor_id: int, session: SessionDep):
+    """
+    Returns the readings stored for a sensor and when the newest was added
+
+    todo: implement authentication
+    """
+
+    sensor_stats = session.get(SensorStats, sensor_id)
+    if sensor_stats is None:
+        if session.get(SensorTable, sensor_id) is None:
+            raise HTTPException(status_code=404, detail="Sensor not found")
+        return {"sensor_id": sensor_id, "readings": 0, "last_added_at": None}
+    return {
+        "sensor_id": sensor_id,
+        "readings": sensor_stats.readings,
+        "last_added_at": sensor_stats.last_added_at,
+    }
+
+
+@app.post("/api/v1/admin/stats/recount")
+async def recount_stats(login: LoginDep):
+    """
+    Rebuilds the reading counters from sensor_data, scans the whole table
+
+    admins only, ingest flushes and imports wait for it
+    """
+
+    if not login["is_admin"]:
+        raise HTTPException(status_code=403, detail="Admins only")
+
+    await asyncio.to_thread(stats.recount, engine)
+    return {"ok": True}
 
 
 # create api key
@@ -173,47 +704,240 @@ async def create_api_key_uid(user_id: int, session: SessionDep):
 
 # list all users
 @app.get("/api/v1/admin/list_users")
-async def list_users(session: SessionDep):
+async def list_users(
+    session: SessionDep,
+    params: ListQuery,
+    email: str | None = None,
+    is_admin: bool | None = None,
+    is_activated: bool | None = None,
+):
     """
-    List all users
+    List users, a page at a time (see list_rows)
 
+    email filters by prefix, password hashes are never returned
     todo: implement authentication
     """
-    users = session.exec(select(User)).all()
-    return users
+
+    filters = []
+    if email is not None:
+        filters.append(User.email.startswith(email, autoescape=True))
+    if is_admin is not None:
+        filters.append(User.is_admin == is_admin)
+    if is_activated is not None:
+        filters.append(User.is_activated == is_activated)
+
+    fields = ["user_id", "email", "is_activated", "is_admin"]
+    return list_rows(
+        session,
+        User,
+        allowed_fields=fields,
+        default_fields=fields,
+        sortable=["user_id", "email"],
+        filters=filters,
+        session_factory=new_session,
+        **params.model_dump(),
+    )
 
 
 # list sessions
 @app.get("/api/v1/admin/list_sessions")
-async def list_sessions(session: SessionDep):
+async def list_sessions(
+    session: SessionDep,
+    params: ListQuery,
+    user_id: int | None = None,
+    used_since: datetime | None = None,
+):
     """
-    List all user sessions
+    List user sessions, a page at a time (see list_rows)
 
+    session tokens are never returned
     todo: implement authentication
     """
-    sessions = session.exec(select(UserSession)).all()
-    return sessions
+
+    filters = []
+    if user_id is not None:
+        filters.append(UserSession.user_id_user == user_id)
+    if used_since is not None:
+        filters.append(UserSession.last_used >= used_since)
+
+    fields = ["session_id", "user_id_user", "created_at", "last_used", "last_ip"]
+    return list_rows(
+        session,
+        UserSession,
+        allowed_fields=fields,
+        default_fields=fields,
+        sortable=["session_id", "created_at", "last_used"],
+        filters=filters,
+        session_factory=new_session,
+        **params.model_dump(),
+    )
 
 
 # list all groups
 @app.get("/api/v1/admin/list_groups")
-async def list_groups(session: SessionDep):
+async def list_groups(
+    session: SessionDep, params: ListQuery, group_name: str | None = None
+):
     """
-    List all sensor groups
+    List sensor groups, a page at a time (see list_rows)
+
+    group_name filters by prefix
     """
-    groups = session.exec(select(SensorGroup)).all()
-    return groups
+
+    filters = []
+    if group_name is not None:
+        filters.append(SensorGroup.group_name.startswith(group_name, autoescape=True))
+
+    fields = ["group_id", "group_name", "description"]
+    return list_rows(
+        session,
+        SensorGroup,
+        allowed_fields=fields,
+        default_fields=fields,
+        sortable=["group_id", "group_name"],
+        filters=filters,
+        session_factory=new_session,
+        **params.model_dump(),
+    )
 
 
 # list all sensors
 @app.get("/api/v1/all_sensors")
-async def get_all_sensors(session: SessionDep, login: LoginDep):
+async def get_all_sensors(
+    session: SessionDep,
+    login: LoginDep,
+    params: ListQuery,
+    manufacturer: str | None = None,
+    model_name: str | None = None,
+    serial_number: str | None = None,
+):
     """
-    Return all sensors
+    Return sensors, a page at a time (see list_rows)
+
+    the string filters match by prefix, sensor keys are never returned
     """
 
-    sensors = session.exec(select(SensorTable)).all()
-    return sensors
+    filters = []
+    if manufacturer is not None:
+        filters.append(
+            SensorTable.manufacturer.startswith(manufacturer, autoescape=True)
+        )
+    if model_name is not None:
+        filters.append(
+            SensorTable.sensor_model_name.startswith(model_name, autoescape=True)
+        )
+    if serial_number is not None:
+        filters.append(
+            SensorTable.serial_number.startswith(serial_number, autoescape=True)
+        )
+
+    fields = ["sensor_id", "manufacturer", "serial_number", "sensor_model_name"]
+    return list_rows(
+        session,
+        SensorTable,
+        allowed_fields=fields,
+        default_fields=fields,
+        sortable=["sensor_id", "sensor_model_name", "manufacturer"],
+        filters=filters,
+        session_factory=new_session,
+        **params.model_dump(),
+    )
+
+
+# create an alert rule for a sensor
+@app.post("/api/v1/alert_rule")
+async def add_alert_rule(rule_data: alert_rule_type, session: SessionDep):
+    """
+    Add an alert rule, it is evaluated against every reading of the sensor
+    from the next request on
+    """
+
+    error = alerts.validate(
+        rule_data.kind,
+        rule_data.field,
+        rule_data.threshold,
+        rule_data.window_seconds,
+        rule_data.alpha,
+    )
+    if error is None and rule_data.webhook_url is not None:
+        # resolves the host, off the event loop
+        error = await asyncio.to_thread(
+            alerts.check_webhook_url,
+            rule_data.webhook_url,
+            alert_evaluator.allow_private_webhooks,
+        )
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+
+    sensor = session.get(SensorTable, rule_data.sensor_id)
+    if sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    rule = AlertRule(
+        sensor_id_sensor_table=rule_data.sensor_id,
+        kind=rule_data.kind,
+        field=rule_data.field,
+        threshold=rule_data.threshold,
+        window_seconds=rule_data.window_seconds,
+        alpha=rule_data.alpha,
+        cooldown_seconds=rule_data.cooldown_seconds,
+        webhook_url=rule_data.webhook_url,
+    )
+    session.add(rule)
+    invalidator.publish(session, "alert_rules", [rule_data.sensor_id])
+    session.commit()
+    session.refresh(rule)
+    if rule.kind == "silence":
+        alert_evaluator.arm(alerts.Rule.from_row(rule), datetime.now())
+    return rule
+
+
+# get the active alert rules of a sensor
+@app.get("/api/v1/alert_rules/{sensor_id}")
+async def return_alert_rules(sensor_id: int, session: SessionDep):
+    """
+    Returns the active alert rules of a sensor
+    """
+
+    return session.exec(
+        select(AlertRule)
+        .where(AlertRule.sensor_id_sensor_table == sensor_id, AlertRule.is_active)
+        .order_by(AlertRule.alert_rule_id)
+    ).all()
+
+
+# deactivate an alert rule
+@app.delete("/api/v1/alert_rule/{alert_rule_id}")
+async def remove_alert_rule(alert_rule_id: int, session: SessionDep):
+    """
+    Deactivate an alert rule, its alerts are kept
+    """
+
+    rule = session.get(AlertRule, alert_rule_id)
+    if rule is None or not rule.is_active:
+        raise HTTPException(status_code=404, detail="Alert rule not found")
+
+    rule.is_active = False
+    session.add(rule)
+    invalidator.publish(session, "alert_rules", [rule.sensor_id_sensor_table])
+    session.commit()
+    session.refresh(rule)
+    return rule
+
+
+# get the newest alerts of a sensor
+@app.get("/api/v1/alerts/{sensor_id}")
+async def return_alerts(sensor_id: int, session: ReadSessionDep, count: int = 50):
+    """
+    Returns the newest `count` alerts of a sensor
+    """
+
+    return session.exec(
+        select(Alert)
+        .where(Alert.sensor_id_sensor_table == sensor_id)
+        .order_by(Alert.alert_id.desc())
+        .limit(count)
+    ).all()
 
 
 # create sensor
@@ -243,6 +967,27 @@ async def add_sensor(sensor_data: sensor_type, session: SessionDep):
     return sensor
 
 
+# create many sensors
+@app.post("/api/v1/sensors/bulk")
+async def add_sensors_bulk(sensor_data: sensor_bulk_type, session: SessionDep):
+    """
+    Add many sensors in one transaction
+    and return the sensor objects in request order
+    """
+
+    return bulk.create_sensors(
+        session,
+        [
+            {
+                "sensor_model_name": sensor.model_name,
+                "manufacturer": sensor.manufacturer,
+                "serial_number": sensor.serial_number,
+            }
+            for sensor in sensor_data.sensors
+        ],
+    )
+
+
 # update sensor
 @app.put("/api/v1/sensor/{sensor_id}")
 async def update_sensor(sensor_id: int, sensor_data: sensor_type, session: SessionDep):
@@ -278,7 +1023,9 @@ class UserCreate(BaseModel):
 
 # create user
 @app.post("/api/v1/admin/user")
-async def add_user(user_data: UserCreate, response: Response, session: SessionDep):
+async def add_user(
+    user_data: UserCreate, response: Response, session: SessionDep, request: Request
+):
     """
     Add a new user to the database
 
@@ -308,9 +1055,7 @@ async def add_user(user_data: UserCreate, response: Response, session: SessionDe
 
     # add user to the database
     # assume password isn't hashed
-    hashed_password = bcrypt.hashpw(
-        user_data.password.encode("utf-8"), bcrypt.gensalt()
-    ).decode("utf-8")
+    hashed_password = await hash_password(user_data.password)
 
     db_user = User(
         email=user_data.email,
@@ -332,6 +1077,7 @@ async def add_user(user_data: UserCreate, response: Response, session: SessionDe
         last_used=datetime.now(),
         last_ip=request.client.host,
     )
+    session.add(user_session)
     session.commit()
     session.refresh(user_session)
 
@@ -361,6 +1107,14 @@ async def set_user_as_admin(user_id: int, session: SessionDep):
     user.is_admin = True
 
     session.add(user)
+    # cached sessions of the user still say is_admin=False
+    invalidator.publish(
+        session,
+        "sessions",
+        session.exec(
+            select(UserSession.session_token).where(UserSession.user_id_user == user_id)
+        ).all(),
+    )
     session.commit()
     session.refresh(user)
     return user
@@ -408,9 +1162,7 @@ async def update_user(user_id: int, user_data: UserUpdate, session: SessionDep):
                 status_code=400,
                 detail="Password length should be at most 60 characters",
             )
-        user.password_hash = bcrypt.hashpw(
-            user_data.password.encode("utf-8"), bcrypt.gensalt()
-        ).decode("utf-8")
+        user.password_hash = await hash_password(user_data.password)
 
     session.add(user)
     session.commit()
@@ -436,6 +1188,10 @@ async def delete_user(user_id: int, session: SessionDep):
     user.is_activated = False
 
     session.add(user)
+    # and log them out everywhere, cached sessions included
+    invalidator.publish(
+        session, "sessions", user_sessions.delete_for_user(session, user_id)
+    )
     session.commit()
     session.refresh(user)
     return user
@@ -456,10 +1212,11 @@ async def login(
     if user is None:
         raise HTTPException(status_code=400, detail="User not found")
 
+    # don't hold a pooled connection while bcrypt runs
+    session.close()
+
     # check if password is correct (bcrypt hash)
-    if not bcrypt.checkpw(
-        login_details.password.encode("utf-8"), user.password_hash.encode("utf-8")
-    ):
+    if not await check_password(login_details.password, user.password_hash):
         raise HTTPException(status_code=400, detail="Incorrect password")
 
     # check if user is activated
@@ -495,25 +1252,43 @@ async def login(
 async def logout(session_token: str, session: SessionDep):
     """
     Logout a user by deleting the session
-    Doesn't log out other sessions (todo: implement another endpoint for that)
+    Doesn't log out other sessions (see logout_all for that)
     """
 
+    token = user_sessions.parse_token(session_token)
+    if token is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+
     # check if session exists
-    session = session.exec(
-        select(UserSession).where(UserSession.session_token == session_token)
+    user_session = session.exec(
+        select(UserSession).where(UserSession.session_token == token)
     ).first()
-    if session is None:
+    if user_session is None:
         raise HTTPException(status_code=404, detail="Session not found")
 
     # delete session
-    session.delete(session)
+    session.delete(user_session)
+    invalidator.publish(session, "sessions", [token])
     session.commit()
-    return session
+    return user_session
+
+
+# logout everywhere
+@app.post("/api/v1/logout_all")
+async def logout_all(login: LoginDep, session: SessionDep):
+    """
+    Logout every session of the logged in user (including this one)
+    """
+
+    tokens = user_sessions.delete_for_user(session, login["user_id"])
+    invalidator.publish(session, "sessions", tokens)
+    session.commit()
+    return {"deleted_sessions": len(tokens)}
 
 
 # implement queries from ../chatgpt_query_design_response.txt
 @app.get("/api/v1/data")
-async def return_all_data(session: SessionDep):
+async def return_all_data(session: ReadSessionDep):
     """
     Returns the last 50 sensor data entries in ascending order
     """
@@ -530,7 +1305,7 @@ async def return_all_data(session: SessionDep):
 # Gets the sensor data for the given sensor
 @app.get("/api/v1/sensor_data/{sensor_id}")
 async def return_data_from_sensor(
-    sensor_id: int, session: SessionDep, cursor: str = None, count: int = 50
+    sensor_id: int, session: ReadSessionDep, cursor: str = None, count: int = 50
 ) -> str:
     """
     Returns the last 50 sensor data entries in ascending order, for that given sensor
@@ -583,13 +1358,371 @@ async def return_data_from_sensor(
     return Response(content=ret_data, media_type="application/json")
 
 
+# Gets a downsampled series of one payload field for charts
+@app.get("/api/v1/sensor_series/{sensor_id}")
+async def return_series_from_sensor(
+    sensor_id: int,
+    session: ReadSessionDep,
+    field: str = "distance",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    points: int = 500,
+    method: str = "lttb",
+):
+    """
+    Returns [time_recorded, value] pairs of a payload field between start and
+    end (the last day by default), downsampled to at most `points` points
+    (lttb or minmax) so the response size doesn't grow with the time range
+    """
+
+    # numpy is only imported by workers that serve charts
+    import downsample
+
+    if field not in SERIES_FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"field must be one of {', '.join(SERIES_FIELDS)}",
+        )
+    if method not in downsample.METHODS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"method must be one of {', '.join(downsample.METHODS)}",
+        )
+    if points < 3 or points > SERIES_MAX_POINTS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"points must be between 3 and {SERIES_MAX_POINTS}",
+        )
+
+    if end is None:
+        end = datetime.now()
+    if start is None:
+        start = end - timedelta(days=1)
+    if not start < end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    # one row more than allowed tells a range that is too long apart
+    rows = session.execute(
+        select(SensorData.time_recorded, SensorData.data)
+        .where(
+            SensorData.sensor_id_sensor_table == sensor_id,
+            SensorData.time_recorded >= start,
+            SensorData.time_recorded < end,
+        )
+        .order_by(SensorData.time_recorded)
+        .limit(SERIES_MAX_ROWS + 1)
+    ).all()
+    # the rest is cpu work, don't keep the connection checked out for it
+    session.close()
+    if len(rows) > SERIES_MAX_ROWS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"More than {SERIES_MAX_ROWS} readings between start and end, "
+            "use a shorter range or /api/v1/sensor_aggregate",
+        )
+
+    # decoding and downsampling up to SERIES_MAX_ROWS readings would block
+    # the event loop
+    series = await asyncio.to_thread(
+        downsample.series,
+        [row.time_recorded for row in rows],
+        [row.data for row in rows],
+        field,
+        points,
+        method,
+    )
+
+    ret_data = {
+        "sensor_id": sensor_id,
+        "field": field,
+        "method": method,
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "raw_points": len(rows),
+        "points": series,
+    }
+
+    return Response(content=dumps(ret_data), media_type="application/json")
+
+
+# Exports the decoded readings of a sensor as csv
+@app.get("/api/v1/sensor_export/{sensor_id}")
+async def export_sensor_data(
+    sensor_id: int,
+    session: ReadSessionDep,
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    """
+    Streams time_recorded,count,distance rows between start and end, the
+    payloads are decoded a batch at a time
+    """
+
+    sensor = session.get(SensorTable, sensor_id)
+    if sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    statement = select(SensorData.time_recorded, SensorData.data).where(
+        SensorData.sensor_id_sensor_table == sensor_id,
+        SensorData.time_recorded.is_not(None),
+    )
+    if start is not None:
+        statement = statement.where(SensorData.time_recorded >= start)
+    if end is not None:
+        statement = statement.where(SensorData.time_recorded < end)
+    statement = statement.order_by(SensorData.time_recorded)
+
+    return StreamingResponse(
+        _export_csv(session.get_bind(), statement),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="sensor_{sensor_id}.csv"'
+        },
+    )
+
+
+def _export_csv(bind, statement):
+    # numpy is only imported by workers that export
+    import decoding
+
+    yield "time_recorded,count,distance\n"
+    # the request's session is closed before the body is sent, stream from
+    # a session (and server side cursor) of our own on the same database
+    with Session(bind) as session:
+        result = session.execute(statement.execution_options(yield_per=EXPORT_BATCH))
+        for partition in result.partitions():
+            columns = decoding.decode_rows(
+                [row.time_recorded for row in partition],
+                [row.data for row in partition],
+            )
+            yield decoding.to_csv(columns)
+
+
+# Gets per bucket aggregates of a payload field
+@app.get("/api/v1/sensor_aggregate/{sensor_id}")
+async def return_aggregate_from_sensor(
+    sensor_id: int,
+    session: SessionDep,
+    field: str = "distance",
+    bucket: str = "hour",
+    start: datetime | None = None,
+    end: datetime | None = None,
+):
+    """
+    Returns count, sum, min, max and mean of a payload field for every
+    minute, hour or day between start and end (default the last 24 buckets)
+    that has readings, and over the whole range
+
+    buckets are cached per sensor, see aggregates.py
+    """
+
+    if field not in aggregates.FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"field must be one of {', '.join(aggregates.FIELDS)}",
+        )
+    if bucket not in aggregates.BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"bucket must be one of {', '.join(aggregates.BUCKETS)}",
+        )
+    width = aggregates.BUCKETS[bucket]
+    now = datetime.now()
+    if end is None:
+        end = now
+    if start is None:
+        start = end - timedelta(seconds=width * 24)
+    if not start < end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    if (end - start).total_seconds() / width > AGGREGATE_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"at most {AGGREGATE_MAX_BUCKETS} buckets, use a wider bucket",
+        )
+
+    sensor = session.get(SensorTable, sensor_id)
+    if sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    buckets = aggregator.aggregate(session, sensor_id, field, width, start, end, now)
+    total = aggregates.EMPTY
+    for _, stats in buckets:
+        total = total.merge(stats)
+
+    ret_data = {
+        "sensor_id": sensor_id,
+        "field": field,
+        "bucket": bucket,
+        "buckets": [
+            {
+                "start": aggregates.bucket_time(first).isoformat(),
+                **stats.to_json(),
+            }
+            for first, stats in buckets
+            if stats.count
+        ],
+        "total": total.to_json(),
+    }
+
+    return Response(content=dumps(ret_data), media_type="application/json")
+
+
+# Gets quantiles and the distinct values of a payload field of a sensor
+@app.get("/api/v1/sensor_summary/{sensor_id}")
+async def return_summary_from_sensor(
+    sensor_id: int,
+    session: ReadSessionDep,
+    field: str = "distance",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    q: Annotated[list[float], Query()] = [0.5, 0.95, 0.99],
+):
+    """
+    Returns count, sum, min, max, mean, the `q` quantiles and the number of
+    distinct values of a payload field between start and end (default the
+    last day), widened to whole hours
+
+    merged from the hour and day sketches (see sketches.py), quantiles are
+    within 1%, the distinct count within a few percent
+    """
+
+    sensor = session.get(SensorTable, sensor_id)
+    if sensor is None:
+        raise HTTPException(status_code=404, detail="Sensor not found")
+
+    return _summary(
+        session, {"sensor_id": sensor_id}, [sensor_id], field, start, end, q
+    )
+
+
+# Gets quantiles and the distinct values of a payload field of a group
+@app.get("/api/v1/group_summary/{group_id}")
+async def return_summary_from_group(
+    group_id: int,
+    session: ReadSessionDep,
+    field: str = "distance",
+    start: datetime | None = None,
+    end: datetime | None = None,
+    q: Annotated[list[float], Query()] = [0.5, 0.95, 0.99],
+):
+    """
+    Same as /api/v1/sensor_summary over the readings of every sensor in the group
+    """
+
+    group = session.get(SensorGroup, group_id)
+    if group is None:
+        raise HTTPException(status_code=404, detail="Group not found")
+
+    members = select(GroupJoinSensors.sensor_id_sensor_table).where(
+        GroupJoinSensors.group_id_sensor_groups == group_id
+    )
+    return _summary(session, {"group_id": group_id}, members, field, start, end, q)
+
+
+def _summary(session, ret_data: dict, sensor_ids, field, start, end, q):
+    import sketches
+
+    if field not in sketches.FIELDS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"field must be one of {', '.join(sketches.FIELDS)}",
+        )
+    if not all(0 <= quantile <= 1 for quantile in q):
+        raise HTTPException(status_code=400, detail="q must be between 0 and 1")
+    if end is None:
+        end = datetime.now()
+    if start is None:
+        start = end - timedelta(days=1)
+    if not start < end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+
+    summary = sketches.summarize(session, sensor_ids, field, start, end)
+    start, end = sketches.bucket_range(start, end)
+    ret_data.update(
+        field=field,
+        start=start.isoformat(),
+        end=end.isoformat(),
+        **summary.to_json(q),
+    )
+
+    return Response(content=dumps(ret_data), media_type="application/json")
+
+
+# Gets the latest sensor data of every sensor in a group
+@app.get("/api/v1/group_data/{group_id}")
+async def return_data_from_group(
+    group_id: int, session: ReadSessionDep, count: int = 50
+):
+    """
+    Returns the last `count` (at most 100) sensor data entries of every sensor
+    in the group, newest first, keyed by sensor id
+
+    all sensors are read with one query, a LATERAL join runs the per sensor
+    "newest rows" lookup on the (sensor, sensor_data_id) index for each member
+    """
+
+    count = max(1, min(count, 100))
+
+    members = (
+        select(GroupJoinSensors.sensor_id_sensor_table.label("sensor_id"))
+        .where(GroupJoinSensors.group_id_sensor_groups == group_id)
+        .subquery()
+    )
+    latest = (
+        select(
+            SensorData.sensor_data_id,
+            SensorData.data,
+            SensorData.time_recorded,
+            SensorData.time_added,
+        )
+        .where(SensorData.sensor_id_sensor_table == members.c.sensor_id)
+        .order_by(SensorData.sensor_data_id.desc())
+        .limit(count)
+        .lateral()
+    )
+    rows = session.execute(
+        select(members.c.sensor_id, latest)
+        .select_from(members.outerjoin(latest, true()))
+        .order_by(members.c.sensor_id, latest.c.sensor_data_id.desc())
+    ).all()
+
+    if len(rows) == 0:
+        # an empty group and a missing one look the same in the join
+        group = session.exec(
+            select(SensorGroup.group_id).where(SensorGroup.group_id == group_id)
+        ).first()
+        if group is None:
+            raise HTTPException(status_code=404, detail="Group not found")
+
+    sensors = {}
+    for row in rows:
+        readings = sensors.setdefault(row.sensor_id, [])
+        # sensors without data come back once, with null columns
+        if row.sensor_data_id is not None:
+            readings.append(
+                {
+                    "data": base64.b64encode(row.data).decode(),
+                    "time_recorded": row.time_recorded,
+                    "time_added": row.time_added,
+                }
+            )
+
+    ret_data = dumps({"group_id": group_id, "sensors": sensors}, default=str)
+
+    return Response(content=ret_data, media_type="application/json")
+
+
 @app.post("/api/v1/data")
-async def add_data(json_sensor_data: sensor_data_type, session: SessionDep):
+async def add_data(
+    json_sensor_data: sensor_data_type, session: SessionDep, request: Request
+):
     """
     Add sensor data to the database
 
     data is base64 encoded and will be rejected if it is not,
-    server will decode the data and store it in the database
+    server will decode the data and store it in the database.
+    a reading_id that was already stored for the sensor isn't stored again,
+    the stored reading is returned instead
     """
 
     # check if data is base64 encoded
@@ -599,30 +1732,181 @@ async def add_data(json_sensor_data: sensor_data_type, session: SessionDep):
     except:
         raise HTTPException(status_code=400, detail="Data is not base64 encoded")
 
+    check_rate_limit(request, "data", [json_sensor_data.sensor_key])
+
     # create a new sensor data object
     # but first check if the sensor key exists
-    sensor = session.exec(
-        select(SensorTable).where(SensorTable.key == json_sensor_data.sensor_key)
+    sensor_id = sensor_key_cache.get(json_sensor_data.sensor_key)
+    if sensor_id is None:
+        generation = sensor_key_cache.generation
+        sensor_id = session.exec(
+            select(SensorTable.sensor_id).where(
+                SensorTable.key == json_sensor_data.sensor_key
+            )
+        ).first()
+
+        if sensor_id is None:
+            raise HTTPException(status_code=404, detail="Sensor key not found")
+        sensor_key_cache.set(json_sensor_data.sensor_key, sensor_id, generation)
+
+    time_added = datetime.now()
+    reading_id = json_sensor_data.reading_id or ids.uuid7()
+    sensor_data = session.scalars(
+        pg_insert(SensorData)
+        .values(
+            data=decoded_data,
+            time_recorded=json_sensor_data.recorded_at,
+            time_added=time_added,
+            sensor_id_sensor_table=sensor_id,
+            unique_id=reading_id,
+        )
+        .on_conflict_do_nothing(index_elements=READING_ID_COLUMNS)
+        .returning(SensorData)
     ).first()
 
-    if sensor is None:
-        raise HTTPException(status_code=404, detail="Sensor key not found")
-
-    sensor_data = SensorData(
-        data=decoded_data,
-        time_recorded=json_sensor_data.recorded_at,
-        time_added=datetime.now(),
-        sensor_id_sensor_table=sensor.sensor_id,
-        unique_id=uuid.uuid4(),
+    if sensor_data is None:
+        # a retry of a reading that is already stored
+        metrics.INGEST_DUPLICATES.labels("data").inc()
+        sensor_data = session.exec(
+            select(SensorData).where(
+                SensorData.sensor_id_sensor_table == sensor_id,
+                SensorData.unique_id == reading_id,
+            )
+        ).one()
+        return CustomJSONEncoder().encode(sensor_data)
+
+    if aggregator.is_late(json_sensor_data.recorded_at, time_added):
+        # a bucket that is cached as closed changed
+        invalidator.publish(session, "aggregates", [sensor_id])
+
+    fired = alerts.record(
+        session,
+        alerts.evaluate(
+            alert_evaluator,
+            alert_evaluator.rules(session, [sensor_id]),
+            [(sensor_id, decoded_data)],
+            time_added,
+        ),
     )
-    session.add(sensor_data)
     session.commit()
     session.refresh(sensor_data)
+    stats_counters.add(sensor_id, 1, time_added)
+    alert_evaluator.notify(fired)
+    metrics.INGEST_ROWS.labels("data").inc()
     return CustomJSONEncoder().encode(sensor_data)
 
 
+@app.post("/api/v1/data/batch")
+async def add_data_batch(request: Request, session: SessionDep):
+    """
+    Add many sensor readings in one request
+
+    the body is the binary frame format from wire.py (raw payload bytes,
+    no base64 or json), the whole batch is rejected if any sensor key is unknown.
+    readings whose reading id is already stored are counted as duplicates
+    """
+
+    if request.headers.get("content-type") != wire.MEDIA_TYPE:
+        raise HTTPException(
+            status_code=415, detail=f"Content-Type must be {wire.MEDIA_TYPE}"
+        )
+
+    try:
+        readings = wire.decode_frames(await request.body())
+    except wire.FrameError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if len(readings) == 0:
+        return {"accepted": 0, "duplicates": 0}
+
+    keys = {sensor_key for sensor_key, _, _, _ in readings}
+    check_rate_limit(request, "batch", keys)
+
+    # resolve the sensor keys that aren't cached in a single query
+    sensor_ids = {}
+    for sensor_key in keys:
+        sensor_id = sensor_key_cache.get(sensor_key)
+        if sensor_id is not None:
+            sensor_ids[sensor_key] = sensor_id
+    uncached = keys - sensor_ids.keys()
+    if uncached:
+        generation = sensor_key_cache.generation
+        for sensor_key, sensor_id in session.exec(
+            select(SensorTable.key, SensorTable.sensor_id).where(
+                SensorTable.key.in_(uncached)
+            )
+        ).all():
+            sensor_ids[sensor_key] = sensor_id
+            sensor_key_cache.set(sensor_key, sensor_id, generation)
+
+    missing = keys - sensor_ids.keys()
+    if missing:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Sensor key not found: {', '.join(sorted(map(str, missing)))}",
+        )
+
+    time_added = datetime.now()
+    rows = [
+        {
+            "data": payload,
+            "time_recorded": recorded_at,
+            "time_added": time_added,
+            "sensor_id_sensor_table": sensor_ids[sensor_key],
+            # older clients (SNS1 frames) don't send reading ids
+            "unique_id": reading_id or ids.uuid7(),
+        }
+        for sensor_key, recorded_at, payload, reading_id in readings
+    ]
+    # readings of a replayed batch are skipped, the ones returned were stored
+    stored = {
+        tuple(row)
+        for row in session.execute(
+            pg_insert(SensorData)
+            .on_conflict_do_nothing(index_elements=READING_ID_COLUMNS)
+            .returning(SensorData.sensor_id_sensor_table, SensorData.unique_id),
+            rows,
+        )
+    }
+    inserted = []
+    for row in rows:
+        key = (row["sensor_id_sensor_table"], row["unique_id"])
+        # a reading sent twice in the same batch is stored once
+        if key in stored:
+            stored.discard(key)
+            inserted.append(row)
+    late = {
+        row["sensor_id_sensor_table"]
+        for row in inserted
+        if aggregator.is_late(row["time_recorded"], time_added)
+    }
+    if late:
+        invalidator.publish(session, "aggregates", late)
+    fired = alerts.record(
+        session,
+        alerts.evaluate(
+            alert_evaluator,
+            alert_evaluator.rules(session, set(sensor_ids.values())),
+            [(row["sensor_id_sensor_table"], row["data"]) for row in inserted],
+            time_added,
+        ),
+    )
+    session.commit()
+    stored_per_sensor = {}
+    for row in inserted:
+        sensor_id = row["sensor_id_sensor_table"]
+        stored_per_sensor[sensor_id] = stored_per_sensor.get(sensor_id, 0) + 1
+    for sensor_id, readings in stored_per_sensor.items():
+        stats_counters.add(sensor_id, readings, time_added)
+    alert_evaluator.notify(fired)
+    duplicates = len(rows) - len(inserted)
+    metrics.INGEST_ROWS.labels("batch").inc(len(inserted))
+    metrics.INGEST_DUPLICATES.labels("batch").inc(duplicates)
+    return {"accepted": len(inserted), "duplicates": duplicates}
+
+
 @app.get("/api/v1/active_sensors")
-async def get_active_sensors(session: SessionDep):
+async def get_active_sensors(session: ReadSessionDep):
     """
     Return all sensors that have sent data in the last 30 minutes
     """
@@ -853,6 +2137,18 @@ async def add_sensor_to_group(group_id: int, sensor_id: int, session: SessionDep
     return group_join_sensor
 
 
+# add many sensors to group
+@app.post("/api/v1/group/{group_id}/sensors")
+async def add_sensors_to_group(
+    group_id: int, sensor_ids: sensor_ids_type, session: SessionDep
+):
+    """
+    Add many sensors to a group, sensors already in the group are skipped
+    """
+
+    return bulk.add_sensors_to_group(session, group_id, sensor_ids.sensor_ids)
+
+
 # remove sensor from group
 @app.delete("/api/v1/group/{group_id}/sensor/{sensor_id}")
 async def remove_sensor_from_group(group_id: int, sensor_id: int, session: SessionDep):
@@ -952,6 +2248,18 @@ async def add_group_to_api_key(api_key: str, group_id: int, session: SessionDep)
     return api_key_join_group
 
 
+# grant many sensors and groups to api key
+@app.post("/api/v1/api_key/{api_key}/grants")
+async def add_grants_to_api_key(
+    api_key: str, grants: api_key_grants_type, session: SessionDep
+):
+    """
+    Grant many sensors and groups to an api key, existing grants are skipped
+    """
+
+    return bulk.grant_to_api_key(session, api_key, grants.sensor_ids, grants.group_ids)
+
+
 # remove sensor from api key
 @app.delete("/api/v1/api_key/{api_key}/sensor/{sensor_id}")
 async def remove_sensor_from_api_key(api_key: str, sensor_id: int, session: SessionDep):
@@ -1056,12 +2364,11 @@ def get_is_admin(session_token: str, session: SessionDep):
     """
 
     # select user from session
+    logged_in = user_sessions.lookup(
+        session, session_policy, session_token, session_cache
+    )
 
-    user = session.exec(
-        select(User).where(UserSession.session_token == session_token)
-    ).first()
-
-    if user is None:
+    if logged_in is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    return {"is_admin": user.is_admin}
+    return {"is_admin": logged_in.is_admin}
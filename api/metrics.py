@@ -0,0 +1,215 @@
+"""
+Prometheus metrics for the api
+
+per route request counts, latency, in-flight requests and database usage
+are recorded by MetricsMiddleware, database statements are counted through
+engine events (see instrument_engine) into the stats of the current request
+"""
+
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+from starlette.routing import Match
+
+REQUESTS = Counter(
+    "sensata_http_requests_total",
+    "HTTP requests handled",
+    ["route", "method", "status"],
+)
+REQUEST_LATENCY = Histogram(
+    "sensata_http_request_duration_seconds",
+    "HTTP request latency",
+    ["route", "method"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+IN_FLIGHT = Gauge(
+    "sensata_http_requests_in_flight",
+    "HTTP requests currently being handled",
+    ["route", "method"],
+    multiprocess_mode="livesum",
+)
+DB_STATEMENTS = Histogram(
+    "sensata_db_statements_per_request",
+    "SQL statements issued per HTTP request",
+    ["route", "method"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+DB_TIME = Histogram(
+    "sensata_db_time_per_request_seconds",
+    "Time spent executing SQL per HTTP request",
+    ["route", "method"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+INGEST_ROWS = Counter(
+    "sensata_ingest_rows_total",
+    "Sensor readings stored",
+    ["endpoint"],
+)
+INGEST_DUPLICATES = Counter(
+    "sensata_ingest_duplicates_total",
+    "Sensor readings skipped because their reading id was already stored",
+    ["endpoint"],
+)
+RATE_LIMITED = Counter(
+    "sensata_rate_limit_requests_total",
+    "Ingest requests checked against the rate limits, by the limit that dropped them",
+    ["endpoint", "result"],
+)
+READS_ROUTED = Counter(
+    "sensata_db_reads_routed_total",
+    "Read only requests by the database they were sent to and why not the replica",
+    ["target", "reason"],
+)
+REPLICA_LAG = Gauge(
+    "sensata_db_replica_lag_seconds",
+    "Seconds the read replica is behind the primary, -1 while unreachable",
+    multiprocess_mode="livemax",
+)
+AGGREGATE_BUCKETS = Counter(
+    "sensata_aggregate_buckets_total",
+    "Aggregate buckets served from the cache or computed from readings",
+    ["result"],
+)
+SESSIONS_REAPED = Counter(
+    "sensata_sessions_reaped_total",
+    "Expired login sessions deleted by the reaper",
+)
+CACHE_LOOKUPS = Counter(
+    "sensata_cache_lookups_total",
+    "In-process cache lookups",
+    ["cache", "result"],
+)
+INVALIDATIONS_PUBLISHED = Counter(
+    "sensata_cache_invalidations_published_total",
+    "Cache invalidation events sent by this worker",
+    ["cache"],
+)
+INVALIDATIONS_RECEIVED = Counter(
+    "sensata_cache_invalidations_received_total",
+    "Cache invalidation events received from any worker",
+    ["cache"],
+)
+ALERTS_FIRED = Counter(
+    "sensata_alerts_fired_total",
+    "Alerts stored by the rule engine",
+    ["kind"],
+)
+BCRYPT_IN_USE = Gauge(
+    "sensata_bcrypt_workers_in_use",
+    "bcrypt calls currently running in the bcrypt pool",
+    multiprocess_mode="livesum",
+)
+BCRYPT_WAITING = Gauge(
+    "sensata_bcrypt_calls_waiting",
+    "bcrypt calls queued because every bcrypt worker is busy",
+    multiprocess_mode="livesum",
+)
+
+
+@dataclass
+class RequestStats:
+    statements: int = 0
+    db_seconds: float = 0.0
+    slow_statements: int = 0
+    # (statement, seconds) of every statement, only collected while profiling
+    queries: list | None = None
+
+
+# stats of the request being handled, None outside of a request
+request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def instrument_engine(engine):
+    """
+    Count statements and time spent in the database for the current request
+    """
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["query_start"].pop()
+        stats = request_stats.get()
+        if stats is not None:
+            stats.statements += 1
+            stats.db_seconds += elapsed
+            if stats.queries is not None:
+                stats.queries.append((statement, elapsed))
+
+
+def _route_name(app, scope) -> str:
+    # use the route template so ids in the path don't explode label cardinality
+    for route in app.router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    def __init__(self, app, fastapi_app):
+        self.app = app
+        self.fastapi_app = fastapi_app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        route = _route_name(self.fastapi_app, scope)
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        in_flight = IN_FLIGHT.labels(route, method)
+        in_flight.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - start
+            in_flight.dec()
+            request_stats.reset(token)
+
+            REQUESTS.labels(route, method, str(status)).inc()
+            REQUEST_LATENCY.labels(route, method).observe(elapsed)
+            DB_STATEMENTS.labels(route, method).observe(stats.statements)
+            DB_TIME.labels(route, method).observe(stats.db_seconds)
+
+
+def metrics_response_body() -> tuple[bytes, str]:
+    """
+    Return the exposition body and its content type
+
+    with several workers every process writes its metrics to
+    PROMETHEUS_MULTIPROC_DIR and they are aggregated here
+    """
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
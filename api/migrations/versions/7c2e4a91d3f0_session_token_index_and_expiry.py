@@ -0,0 +1,47 @@
+"""Index session_token and session expiry columns.
+
+Revision ID: 7c2e4a91d3f0
+Revises: 53ba04d9c52a
+Create Date: 2026-10-19 10:12:41.201734
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "7c2e4a91d3f0"
+down_revision: Union[str, None] = "53ba04d9c52a"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        op.f("ix_user_session_session_token"),
+        "user_session",
+        ["session_token"],
+        unique=True,
+    )
+    op.create_index(
+        op.f("ix_user_session_last_used"), "user_session", ["last_used"], unique=False
+    )
+    op.create_index(
+        op.f("ix_user_session_created_at"), "user_session", ["created_at"], unique=False
+    )
+    op.create_index(
+        op.f("ix_user_session_user_id_user"),
+        "user_session",
+        ["user_id_user"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index(op.f("ix_user_session_user_id_user"), table_name="user_session")
+    op.drop_index(op.f("ix_user_session_created_at"), table_name="user_session")
+    op.drop_index(op.f("ix_user_session_last_used"), table_name="user_session")
+    op.drop_index(op.f("ix_user_session_session_token"), table_name="user_session")
@@ -0,0 +1,41 @@
+"""Index sensor_data by sensor and recording time for range queries.
+
+Revision ID: 9b2c4f61d8e3
+Revises: a5d9e2f7c1b3
+Create Date: 2026-10-19 22:14:36.807512
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "9b2c4f61d8e3"
+down_revision: Union[str, None] = "a5d9e2f7c1b3"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # series, aggregates and exports read one sensor's readings in a time
+    # range, built without blocking ingest
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sensor_data_sensor_id_time_recorded",
+            "sensor_data",
+            ["sensor_id_sensor_table", "time_recorded"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_sensor_data_sensor_id_time_recorded",
+            table_name="sensor_data",
+            postgresql_concurrently=True,
+        )
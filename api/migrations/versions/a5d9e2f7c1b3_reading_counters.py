@@ -0,0 +1,53 @@
+"""Add sensor_stats and daily_stats tables.
+
+Revision ID: a5d9e2f7c1b3
+Revises: f3b8c1d2e4a6
+Create Date: 2026-10-19 21:07:33.218406
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "a5d9e2f7c1b3"
+down_revision: Union[str, None] = "f3b8c1d2e4a6"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sensor_stats",
+        sa.Column("sensor_id_sensor_table", sa.Integer(), nullable=False),
+        sa.Column("readings", sa.BigInteger(), nullable=False),
+        sa.Column("last_added_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["sensor_id_sensor_table"],
+            ["sensor_table.sensor_id"],
+        ),
+        sa.PrimaryKeyConstraint("sensor_id_sensor_table"),
+    )
+    op.create_table(
+        "daily_stats",
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("readings", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("day"),
+    )
+    # the readings stored so far, the api keeps the counts up to date from here
+    op.execute(
+        "INSERT INTO sensor_stats (sensor_id_sensor_table, readings, last_added_at) "
+        "SELECT sensor_id_sensor_table, count(*), max(time_added) "
+        "FROM sensor_data GROUP BY sensor_id_sensor_table"
+    )
+    op.execute(
+        "INSERT INTO daily_stats (day, readings) "
+        "SELECT time_added::date, count(*) FROM sensor_data GROUP BY 1"
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("daily_stats")
+    op.drop_table("sensor_stats")
@@ -0,0 +1,40 @@
+"""Index sensor_data by sensor for per-sensor windows.
+
+Revision ID: b41d7e0c9a25
+Revises: 7c2e4a91d3f0
+Create Date: 2026-10-19 15:20:08.514630
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "b41d7e0c9a25"
+down_revision: Union[str, None] = "7c2e4a91d3f0"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # sensor_data is large, build the index without blocking ingest
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sensor_data_sensor_id_sensor_data_id",
+            "sensor_data",
+            ["sensor_id_sensor_table", "sensor_data_id"],
+            unique=False,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_sensor_data_sensor_id_sensor_data_id",
+            table_name="sensor_data",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,87 @@
+"""Add alert_rule and alert tables.
+
+Revision ID: c8f2d61a4e07
+Revises: b41d7e0c9a25
+Create Date: 2026-10-19 16:05:41.207318
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "c8f2d61a4e07"
+down_revision: Union[str, None] = "b41d7e0c9a25"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "alert_rule",
+        sa.Column("alert_rule_id", sa.Integer(), nullable=False),
+        sa.Column("sensor_id_sensor_table", sa.Integer(), nullable=False),
+        sa.Column("kind", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("field", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("threshold", sa.Float(), nullable=True),
+        sa.Column("window_seconds", sa.Float(), nullable=True),
+        sa.Column("alpha", sa.Float(), nullable=True),
+        sa.Column("cooldown_seconds", sa.Float(), nullable=False),
+        sa.Column("webhook_url", sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+        sa.Column("is_active", sa.Boolean(), nullable=False),
+        sa.Column("last_fired_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(
+            ["sensor_id_sensor_table"],
+            ["sensor_table.sensor_id"],
+        ),
+        sa.PrimaryKeyConstraint("alert_rule_id"),
+    )
+    op.create_index(
+        op.f("ix_alert_rule_sensor_id_sensor_table"),
+        "alert_rule",
+        ["sensor_id_sensor_table"],
+        unique=False,
+    )
+    op.create_table(
+        "alert",
+        sa.Column("alert_id", sa.Integer(), nullable=False),
+        sa.Column("alert_rule_id_alert_rule", sa.Integer(), nullable=False),
+        sa.Column("sensor_id_sensor_table", sa.Integer(), nullable=False),
+        sa.Column("triggered_at", sa.DateTime(), nullable=False),
+        sa.Column("value", sa.Float(), nullable=True),
+        sa.Column("message", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["alert_rule_id_alert_rule"],
+            ["alert_rule.alert_rule_id"],
+        ),
+        sa.ForeignKeyConstraint(
+            ["sensor_id_sensor_table"],
+            ["sensor_table.sensor_id"],
+        ),
+        sa.PrimaryKeyConstraint("alert_id"),
+    )
+    op.create_index(
+        op.f("ix_alert_alert_rule_id_alert_rule"),
+        "alert",
+        ["alert_rule_id_alert_rule"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_alert_sensor_id_alert_id",
+        "alert",
+        ["sensor_id_sensor_table", "alert_id"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_alert_sensor_id_alert_id", table_name="alert")
+    op.drop_index(op.f("ix_alert_alert_rule_id_alert_rule"), table_name="alert")
+    op.drop_table("alert")
+    op.drop_index(
+        op.f("ix_alert_rule_sensor_id_sensor_table"), table_name="alert_rule"
+    )
+    op.drop_table("alert_rule")
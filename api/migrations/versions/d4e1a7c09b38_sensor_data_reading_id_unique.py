@@ -0,0 +1,42 @@
+"""Make reading ids unique per sensor.
+
+Revision ID: d4e1a7c09b38
+Revises: c8f2d61a4e07
+Create Date: 2026-10-19 16:42:17.930144
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "d4e1a7c09b38"
+down_revision: Union[str, None] = "c8f2d61a4e07"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # unique_id has always been a random uuid4 generated by the server, so
+    # existing rows don't collide. built without blocking ingest, if it fails
+    # it leaves an invalid index behind that has to be dropped before a retry
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_sensor_data_sensor_id_unique_id",
+            "sensor_data",
+            ["sensor_id_sensor_table", "unique_id"],
+            unique=True,
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_sensor_data_sensor_id_unique_id",
+            table_name="sensor_data",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,67 @@
+"""Widen sensor_data_id to bigint.
+
+Revision ID: e7a90c3d5f12
+Revises: d4e1a7c09b38
+Create Date: 2026-10-19 17:21:55.604873
+
+"""
+
+import re
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "e7a90c3d5f12"
+down_revision: Union[str, None] = "d4e1a7c09b38"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _id_sequence() -> str | None:
+    # sensor_data_sensor_data_id_seq when the table came from create_all,
+    # auto_incrementing_sensor_data_id_sequence when it came from
+    # database_schema.sql, read it from the column default
+    default = (
+        op.get_bind()
+        .execute(
+            sa.text(
+                "SELECT column_default FROM information_schema.columns "
+                "WHERE table_name = 'sensor_data' AND column_name = 'sensor_data_id'"
+            )
+        )
+        .scalar()
+    )
+    match = re.search(r"nextval\('([^']+)'", default or "")
+    return match.group(1) if match else None
+
+
+def upgrade() -> None:
+    # rewrites sensor_data and its indexes under an exclusive lock, ingest
+    # waits until it's done, so run it in a maintenance window on large tables
+    op.alter_column(
+        "sensor_data",
+        "sensor_data_id",
+        existing_type=sa.Integer(),
+        type_=sa.BigInteger(),
+        existing_nullable=False,
+    )
+    sequence = _id_sequence()
+    if sequence is not None:
+        op.execute(f"ALTER SEQUENCE {sequence} AS bigint NO MAXVALUE")
+
+
+def downgrade() -> None:
+    # fails once an id doesn't fit in an integer anymore
+    sequence = _id_sequence()
+    if sequence is not None:
+        op.execute(f"ALTER SEQUENCE {sequence} AS integer NO MAXVALUE")
+    op.alter_column(
+        "sensor_data",
+        "sensor_data_id",
+        existing_type=sa.BigInteger(),
+        type_=sa.Integer(),
+        existing_nullable=False,
+    )
@@ -0,0 +1,53 @@
+"""Add sensor_sketch and sketch_progress tables.
+
+Revision ID: f3b8c1d2e4a6
+Revises: e7a90c3d5f12
+Create Date: 2026-10-19 18:42:10.514203
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+# revision identifiers, used by Alembic.
+revision: str = "f3b8c1d2e4a6"
+down_revision: Union[str, None] = "e7a90c3d5f12"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sensor_sketch",
+        sa.Column("sensor_id_sensor_table", sa.Integer(), nullable=False),
+        sa.Column("field", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("width", sa.Integer(), nullable=False),
+        sa.Column("bucket_start", sa.DateTime(), nullable=False),
+        sa.Column("count", sa.BigInteger(), nullable=False),
+        sa.Column("sum", sa.Float(), nullable=False),
+        sa.Column("min", sa.Float(), nullable=True),
+        sa.Column("max", sa.Float(), nullable=True),
+        sa.Column("quantiles", sa.LargeBinary(), nullable=False),
+        sa.Column("distinct", sa.LargeBinary(), nullable=False),
+        sa.ForeignKeyConstraint(
+            ["sensor_id_sensor_table"],
+            ["sensor_table.sensor_id"],
+        ),
+        sa.PrimaryKeyConstraint(
+            "sensor_id_sensor_table", "field", "width", "bucket_start"
+        ),
+    )
+    op.create_table(
+        "sketch_progress",
+        sa.Column("name", sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+        sa.Column("sensor_data_id", sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("sketch_progress")
+    op.drop_table("sensor_sketch")
@@ -1,7 +1,8 @@
 from sqlmodel import SQLModel as _SQLModel, Field, Relationship
 from fastapi_utils.camelcase import camel2snake
+from sqlalchemy import BigInteger, Index
 from sqlalchemy.orm import backref, declared_attr
-from datetime import datetime
+from datetime import date, datetime
 from pydantic import EmailStr
 import uuid
 
@@ -70,13 +71,14 @@ class User(SQLModel, table=True):
 # last_used: timestamp
 # last_ip: text
 # user_id_user: smallint foreign key
+# session_token: uuid (unique index, used for every auth lookup)
 class UserSession(SQLModel, table=True):
     session_id: int = Field(default=None, primary_key=True)
-    created_at: datetime | None
-    last_used: datetime | None
+    created_at: datetime | None = Field(default=None, index=True)
+    last_used: datetime | None = Field(default=None, index=True)
     last_ip: str | None
-    user_id_user: int = Field(foreign_key="user.user_id")
-    session_token: uuid.UUID | None
+    user_id_user: int = Field(foreign_key="user.user_id", index=True)
+    session_token: uuid.UUID | None = Field(default=None, unique=True, index=True)
 
 
 # Define api_keys table
@@ -139,16 +141,141 @@ class SensorTable(SQLModel, table=True):
 
 
 # Define sensor_data table
-# sensor_data_id: integer primary key autoincrement
+# sensor_data_id: bigint primary key autoincrement
 # data: bytea
 # sensor_id_sensor_table: smallint foreign key
 # time_recorded: timestamp
 # time_added: timestamp
-# unique_id: text (uuidv4)
+# unique_id: uuid (the reading id chosen by the client, or a uuid7 by the server)
+# (sensor_id_sensor_table, sensor_data_id) index: newest readings of a sensor
+# (sensor_id_sensor_table, time_recorded) index: a sensor's readings in a time range
+# (sensor_id_sensor_table, unique_id) unique index: a retried reading is stored once
 class SensorData(SQLModel, table=True):
-    sensor_data_id: int = Field(default=None, primary_key=True)
+    __table_args__ = (
+        Index(
+            "ix_sensor_data_sensor_id_sensor_data_id",
+            "sensor_id_sensor_table",
+            "sensor_data_id",
+        ),
+        Index(
+            "ix_sensor_data_sensor_id_time_recorded",
+            "sensor_id_sensor_table",
+            "time_recorded",
+        ),
+        Index(
+            "ix_sensor_data_sensor_id_unique_id",
+            "sensor_id_sensor_table",
+            "unique_id",
+            unique=True,
+        ),
+    )
+
+    sensor_data_id: int = Field(default=None, primary_key=True, sa_type=BigInteger)
     data: bytes | None
     sensor_id_sensor_table: int = Field(foreign_key="sensor_table.sensor_id")
     time_recorded: datetime | None
     time_added: datetime
     unique_id: uuid.UUID | None
+
+
+# Define alert_rule table
+# alert_rule_id: integer primary key autoincrement
+# sensor_id_sensor_table: smallint foreign key
+# kind: text (above, below, spike, rate, silence)
+# field: text (payload field the rule watches, count or distance)
+# threshold: float (the limit, readings per window for rate, deviations for spike)
+# window_seconds: float (rate and silence rules)
+# alpha: float (ewma smoothing of spike rules)
+# cooldown_seconds: float (least time between two alerts of the rule)
+# webhook_url: text
+# is_active: boolean
+# last_fired_at: timestamp (shared cooldown of every worker)
+class AlertRule(SQLModel, table=True):
+    alert_rule_id: int = Field(default=None, primary_key=True)
+    sensor_id_sensor_table: int = Field(
+        foreign_key="sensor_table.sensor_id", index=True
+    )
+    kind: str
+    field: str = "distance"
+    threshold: float | None = None
+    window_seconds: float | None = None
+    alpha: float | None = None
+    cooldown_seconds: float = 300
+    webhook_url: str | None = None
+    is_active: bool = True
+    last_fired_at: datetime | None = None
+
+
+# Define alert table
+# alert_id: integer primary key autoincrement
+# alert_rule_id_alert_rule: integer foreign key
+# sensor_id_sensor_table: smallint foreign key
+# triggered_at: timestamp
+# value: float (the reading that triggered it, null for silence)
+# message: text
+# (sensor_id_sensor_table, alert_id) index: newest alerts of a sensor
+class Alert(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_alert_sensor_id_alert_id", "sensor_id_sensor_table", "alert_id"),
+    )
+
+    alert_id: int = Field(default=None, primary_key=True)
+    alert_rule_id_alert_rule: int = Field(
+        foreign_key="alert_rule.alert_rule_id", index=True
+    )
+    sensor_id_sensor_table: int = Field(foreign_key="sensor_table.sensor_id")
+    triggered_at: datetime
+    value: float | None = None
+    message: str
+
+
+# Define sensor_sketch table
+# sensor_id_sensor_table: smallint foreign key, primary key
+# field: text (payload field, count or distance), primary key
+# width: integer (bucket length in seconds, an hour or a day), primary key
+# bucket_start: timestamp, primary key
+# count: bigint (readings with a value for the field)
+# sum, min, max: float
+# quantiles: bytea (sketches.QuantileSketch)
+# distinct: bytea (sketches.DistinctSketch)
+class SensorSketch(SQLModel, table=True):
+    sensor_id_sensor_table: int = Field(
+        foreign_key="sensor_table.sensor_id", primary_key=True
+    )
+    field: str = Field(primary_key=True)
+    width: int = Field(primary_key=True)
+    bucket_start: datetime = Field(primary_key=True)
+    count: int = Field(sa_type=BigInteger)
+    sum: float
+    min: float | None
+    max: float | None
+    quantiles: bytes
+    distinct: bytes
+
+
+# Define sketch_progress table
+# name: text primary key (the rollup)
+# sensor_data_id: bigint (the newest reading rolled up)
+class SketchProgress(SQLModel, table=True):
+    name: str = Field(primary_key=True)
+    sensor_data_id: int = Field(sa_type=BigInteger)
+
+
+# Define sensor_stats table
+# sensor_id_sensor_table: smallint primary key, foreign key
+# readings: bigint (readings stored for the sensor)
+# last_added_at: timestamp (time_added of its newest reading)
+class SensorStats(SQLModel, table=True):
+    sensor_id_sensor_table: int = Field(
+        foreign_key="sensor_table.sensor_id", primary_key=True
+    )
+    readings: int = Field(sa_type=BigInteger)
+    last_added_at: datetime
+
+
+# Define daily_stats table
+# day: date primary key (of time_added)
+# readings: bigint (readings stored that day)
+class DailyStats(SQLModel, table=True):
+    day: date = Field(primary_key=True)
+    readings: int = Field(sa_type=BigInteger)
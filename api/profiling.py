@@ -0,0 +1,192 @@
+"""
+On demand profiling of single requests
+
+an admin adds `?profile=1` or an `X-Profile: 1` header to a request and it
+runs under pyinstrument, a sampling profiler. the call tree (html) is stored
+in the profile directory next to a json file with the request's statements
+and their timings, the response names them in an X-Profile header. with
+`profile=html` the html is returned instead of the response
+
+requests without the flag only pay for looking for it, pyinstrument is
+optional and only imported by the first profiled request
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+from urllib.parse import parse_qs
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+HEADER = b"x-profile"
+QUERY = "profile"
+
+
+def _flag(scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == HEADER:
+            return value.decode("latin-1")
+    query_string = scope["query_string"]
+    if QUERY.encode() in query_string:
+        values = parse_qs(query_string.decode("latin-1")).get(QUERY)
+        if values:
+            return values[0]
+    return None
+
+
+def _cookies(scope) -> dict:
+    cookies = {}
+    for name, value in scope["headers"]:
+        if name == b"cookie":
+            for cookie in value.decode("latin-1").split(";"):
+                key, _, val = cookie.strip().partition("=")
+                cookies[key] = val
+    return cookies
+
+
+class ProfileMiddleware:
+    """
+    Profile flagged requests of admins
+
+    `is_admin(cookies)` is called in a thread and decides who may profile.
+    needs to run inside MetricsMiddleware, which sets up the request stats
+    """
+
+    def __init__(self, app, is_admin, directory: str, interval_ms: float = 1):
+        self.app = app
+        self.is_admin = is_admin
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        # one profiled request at a time per worker, profiles of concurrent
+        # requests would show each other's samples
+        self._busy = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        flag = _flag(scope)
+        if not flag or flag == "0":
+            await self.app(scope, receive, send)
+            return
+
+        if not await asyncio.to_thread(self.is_admin, _cookies(scope)):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            await self._skip(scope, receive, send, "pyinstrument not installed")
+            return
+        stats = metrics.request_stats.get()
+        if self._busy or stats is None:
+            await self._skip(scope, receive, send, "busy")
+            return
+
+        self._busy = True
+        try:
+            await self._profile(Profiler, stats, flag, scope, receive, send)
+        finally:
+            self._busy = False
+
+    async def _skip(self, scope, receive, send, reason: str):
+        await self.app(scope, receive, _with_header(send, f"skipped, {reason}"))
+
+    async def _profile(self, Profiler, stats, flag, scope, receive, send):
+        name = "{}-{}-{}".format(
+            datetime.now().strftime("%Y%m%d-%H%M%S-%f"),
+            scope["method"].lower(),
+            re.sub(r"[^A-Za-z0-9]+", "_", scope["path"]).strip("_")[:80],
+        )
+        to_html = flag == "html"
+        status = None
+
+        async def send_with_name(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if to_html:
+                    # replaced by the profile below
+                    return
+                headers = list(message.get("headers", []))
+                headers.append((HEADER, name.encode()))
+                message = dict(message, headers=headers)
+            elif to_html:
+                return
+            await send(message)
+
+        # statements counted before this point (the admin check) aren't profiled
+        statements, db_seconds = stats.statements, stats.db_seconds
+        stats.queries = []
+        profiler = Profiler(interval=self.interval, async_mode="enabled")
+        start = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_name)
+        finally:
+            profiler.stop()
+            elapsed = time.perf_counter() - start
+            queries, stats.queries = stats.queries, None
+
+            report = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "query_string": scope["query_string"].decode("latin-1"),
+                "status": status,
+                "seconds": elapsed,
+                "statements": stats.statements - statements,
+                "db_seconds": stats.db_seconds - db_seconds,
+                "queries": [
+                    {"statement": statement, "ms": seconds * 1000}
+                    for statement, seconds in queries
+                ],
+            }
+            html = profiler.output_html()
+            await asyncio.to_thread(self._store, name, html, report)
+            logger.info(
+                "profiled %s %s in %.1f ms, %s",
+                scope["method"],
+                scope["path"],
+                elapsed * 1000,
+                os.path.join(self.directory, name + ".html"),
+            )
+
+        if to_html:
+            body = html.encode()
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/html; charset=utf-8"),
+                        (b"content-length", str(len(body)).encode()),
+                        (HEADER, name.encode()),
+                    ],
+                }
+            )
+            await send({"type": "http.response.body", "body": body})
+
+    def _store(self, name: str, html: str, report: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, name + ".html"), "w") as f:
+            f.write(html)
+        with open(os.path.join(self.directory, name + ".json"), "w") as f:
+            json.dump(report, f, indent=2)
+
+
+def _with_header(send, value: str):
+    async def send_with_header(message):
+        if message["type"] == "http.response.start":
+            headers = list(message.get("headers", []))
+            headers.append((HEADER, value.encode()))
+            message = dict(message, headers=headers)
+        await send(message)
+
+    return send_with_header
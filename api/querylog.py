@@ -0,0 +1,121 @@
+"""
+Slow query and statement count reporting
+
+slow statements are logged together with their EXPLAIN plan, requests that
+issue more than the statement budget are flagged, and the per-request counts
+can be returned in an X-DB-Statements header for debugging
+"""
+
+import logging
+import time
+
+from sqlalchemy import event
+
+import metrics
+
+logger = logging.getLogger("sensata.queries")
+
+_EXPLAINABLE = ("select", "insert", "update", "delete", "with")
+
+
+def _explain(cursor, statement, parameters) -> str:
+    # run EXPLAIN on a fresh DBAPI cursor (no engine events fire for it) inside
+    # a savepoint so a failing EXPLAIN can't abort the caller's transaction
+    connection = cursor.connection
+    explain_cursor = connection.cursor()
+    try:
+        explain_cursor.execute("SAVEPOINT query_explain")
+        try:
+            explain_cursor.execute("EXPLAIN " + statement, parameters)
+            plan = "\n".join(row[0] for row in explain_cursor.fetchall())
+        except Exception as e:
+            explain_cursor.execute("ROLLBACK TO SAVEPOINT query_explain")
+            plan = f"EXPLAIN failed: {e}"
+        explain_cursor.execute("RELEASE SAVEPOINT query_explain")
+        return plan
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+    finally:
+        explain_cursor.close()
+
+
+def instrument_engine(engine, slow_query_ms: float, explain: bool = True):
+    """
+    Log statements slower than slow_query_ms, with their plan if explain is set
+    """
+
+    threshold = slow_query_ms / 1000
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, many):
+        conn.info.setdefault("slow_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, many):
+        elapsed = time.perf_counter() - conn.info["slow_query_start"].pop()
+        if elapsed < threshold:
+            return
+
+        stats = metrics.request_stats.get()
+        if stats is not None:
+            stats.slow_statements += 1
+
+        plan = ""
+        if (
+            explain
+            and not many
+            and statement.lstrip()[:6].lower().startswith(_EXPLAINABLE)
+        ):
+            plan = "\n" + _explain(cursor, statement, parameters)
+
+        logger.warning("slow query (%.1f ms): %s%s", elapsed * 1000, statement, plan)
+
+
+class QueryReportMiddleware:
+    """
+    Flag requests over the statement budget and optionally add a debug header
+
+    needs to run inside MetricsMiddleware, which sets up the request stats
+    """
+
+    def __init__(self, app, statement_budget: int, debug_header: bool = False):
+        self.app = app
+        self.statement_budget = statement_budget
+        self.debug_header = debug_header
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_report(message):
+            stats = metrics.request_stats.get()
+            if (
+                self.debug_header
+                and stats is not None
+                and message["type"] == "http.response.start"
+            ):
+                headers = list(message.get("headers", []))
+                headers.append((b"x-db-statements", _report(stats).encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_report)
+        finally:
+            stats = metrics.request_stats.get()
+            if stats is not None and stats.statements > self.statement_budget:
+                logger.warning(
+                    "%s %s issued %s (budget %d)",
+                    scope["method"],
+                    scope["path"],
+                    _report(stats),
+                    self.statement_budget,
+                )
+
+
+def _report(stats) -> str:
+    return (
+        f"{stats.statements} statements; time={stats.db_seconds * 1000:.1f}ms; "
+        f"slow={stats.slow_statements}"
+    )
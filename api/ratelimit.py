@@ -0,0 +1,61 @@
+"""
+In-memory token bucket rate limiting
+
+every (policy, key) pair has a bucket holding up to `burst` tokens that
+refills at `rate` tokens per second, a request takes one token from every
+bucket it is checked against or, if any of them is empty, none at all.
+buckets live in the worker that serves the request, so with several
+workers a key gets up to `rate` per worker
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class Policy(NamedTuple):
+    name: str
+    # tokens per second, 0 or less disables the policy
+    rate: float
+    burst: float
+
+
+class RateLimiter:
+    def __init__(self, maxsize: int = 100000):
+        # least recently used buckets are dropped first, a dropped bucket
+        # comes back full, which only ever lets a quiet key through
+        self.maxsize = maxsize
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, checks, now: float | None = None) -> tuple[float, str | None]:
+        """
+        Take a token for every (policy, key) in `checks`, return (0, None)
+        if that worked, else the seconds until it would and the name of the
+        policy that ran out
+        """
+
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            buckets = []
+            wait, limited = 0.0, None
+            for policy, key in checks:
+                if policy.rate <= 0:
+                    continue
+                bucket_key = (policy.name, key)
+                tokens, updated = self._buckets.get(bucket_key, (policy.burst, now))
+                tokens = min(policy.burst, tokens + (now - updated) * policy.rate)
+                if tokens < 1 and (1 - tokens) / policy.rate > wait:
+                    wait, limited = (1 - tokens) / policy.rate, policy.name
+                buckets.append((bucket_key, tokens))
+
+            for bucket_key, tokens in buckets:
+                self._buckets[bucket_key] = (tokens if limited else tokens - 1, now)
+                self._buckets.move_to_end(bucket_key)
+            while len(self._buckets) > self.maxsize:
+                self._buckets.popitem(last=False)
+        return wait, limited
+
+    def __len__(self):
+        return len(self._buckets)
@@ -0,0 +1,130 @@
+"""
+Routing of reads to a read replica
+
+GET routes that only read (readings, series, exports, ...) can run on a
+second, read only engine. a request goes to the primary instead when
+
+- no replica is configured
+- the replica is unreachable or more than `max_lag` seconds behind, checked
+  every few seconds by `watch`
+- the client wrote something in the last `sticky_seconds`, so it reads its
+  own writes. ReadYourWritesMiddleware marks those clients with a short
+  lived cookie, clients without cookies can send the header instead
+
+cached lookups (sessions, api keys, ...) stay on the primary, an entry
+refilled from a lagging replica right after an invalidation would be stale
+until it expires
+"""
+
+import asyncio
+import logging
+
+from sqlalchemy import text
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+COOKIE = "sensata_read_primary"
+HEADER = "x-read-primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+# a primary (or a second database used for testing) is never behind, an idle
+# replica that replayed everything it received isn't either, even though its
+# last replayed transaction gets older
+_LAG = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE coalesce(extract(epoch FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReadRouter:
+    def __init__(self, primary, replica=None, max_lag: float = 5):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        # seconds behind the primary, None while unreachable
+        self.lag: float | None = 0
+
+    def check(self) -> float | None:
+        """
+        Measure the replica's lag
+        """
+
+        if self.replica is None:
+            return None
+        try:
+            with self.replica.connect() as connection:
+                lag = float(connection.execute(text(_LAG)).scalar_one())
+        except Exception:
+            if self.lag is not None:
+                logger.exception("read replica unreachable, reading from the primary")
+            lag = None
+        else:
+            if lag > self.max_lag and (self.lag is None or self.lag <= self.max_lag):
+                logger.warning(
+                    "read replica is %.1fs behind, reading from the primary", lag
+                )
+        self.lag = lag
+        metrics.REPLICA_LAG.set(-1 if lag is None else lag)
+        return lag
+
+    def engine_for(self, headers, cookies):
+        """
+        The engine a read only request should use
+        """
+
+        if self.replica is None:
+            return self.primary
+        if cookies.get(COOKIE) or headers.get(HEADER):
+            reason = "own_writes"
+        elif self.lag is None:
+            reason = "replica_down"
+        elif self.lag > self.max_lag:
+            reason = "replica_lag"
+        else:
+            metrics.READS_ROUTED.labels("replica", "").inc()
+            return self.replica
+        metrics.READS_ROUTED.labels("primary", reason).inc()
+        return self.primary
+
+
+async def watch(router: ReadRouter, interval: float):
+    """
+    Run router.check every `interval` seconds until cancelled
+    """
+
+    if router.replica is None:
+        return
+    while True:
+        await asyncio.to_thread(router.check)
+        await asyncio.sleep(interval)
+
+
+class ReadYourWritesMiddleware:
+    """
+    Set the read-from-primary cookie on successful writes
+    """
+
+    def __init__(self, app, sticky_seconds: float):
+        self.app = app
+        self.cookie = (
+            f"{COOKIE}=1; Max-Age={int(sticky_seconds)}; Path=/; HttpOnly; SameSite=Lax"
+        ).encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", self.cookie))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        await self.app(scope, receive, send_with_cookie)
@@ -0,0 +1,74 @@
+"""
+Startup schema check
+
+create_all issues a catalog query per table on every boot, when the database
+is already at the newest alembic revision there is nothing for it to do, so
+it's skipped after a single query. the heads are read straight from the
+migration files, importing alembic would cost more than create_all itself
+"""
+
+import logging
+import re
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+logger = logging.getLogger("sensata.schema")
+
+VERSIONS_DIR = Path(__file__).parent / "migrations" / "versions"
+
+_REVISION = re.compile(r"^revision(?:\s*:[^=]*)?\s*=\s*(.+)$", re.MULTILINE)
+_DOWN_REVISION = re.compile(r"^down_revision(?:\s*:[^=]*)?\s*=\s*(.+)$", re.MULTILINE)
+_QUOTED = re.compile(r"""["']([^"']+)["']""")
+
+
+def migration_heads(versions_dir: Path = VERSIONS_DIR) -> set[str]:
+    """
+    Revisions that no other migration revises
+    """
+
+    revisions = set()
+    revised = set()
+    for path in versions_dir.glob("*.py"):
+        source = path.read_text()
+        revision = _REVISION.search(source)
+        if revision is None:
+            continue
+        revisions.update(_QUOTED.findall(revision.group(1)))
+        down_revision = _DOWN_REVISION.search(source)
+        if down_revision is not None:
+            # a tuple for merge revisions
+            revised.update(_QUOTED.findall(down_revision.group(1)))
+    return revisions - revised
+
+
+def database_revisions(engine) -> set[str]:
+    """
+    Revisions stamped in alembic_version, empty if alembic never ran
+    """
+
+    with engine.connect() as connection:
+        try:
+            return set(
+                connection.execute(
+                    text("SELECT version_num FROM alembic_version")
+                ).scalars()
+            )
+        except ProgrammingError:
+            return set()
+
+
+def ensure_schema(engine, metadata) -> bool:
+    """
+    Create missing tables unless migrations are current, return whether
+    create_all ran
+    """
+
+    heads = migration_heads()
+    if heads and database_revisions(engine) == heads:
+        return False
+
+    logger.info("database isn't at migration head %s, running create_all", heads)
+    metadata.create_all(engine)
+    return True
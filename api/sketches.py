@@ -0,0 +1,573 @@
+"""
+Mergeable quantile and distinct count sketches of payload fields
+
+QuantileSketch is a DDSketch: values are counted in logarithmic bins, so
+every quantile it returns is within RELATIVE_ACCURACY (1%) of a value at
+that rank. DistinctSketch is a HyperLogLog with 2**DISTINCT_PRECISION
+registers, its estimate of the number of distinct values is within about
+2.3%. both merge bin by bin (adding counts, taking the larger register),
+the sketch of a union is the merge of the sketches of its parts, and both
+have a fixed upper bound on their size
+
+rollup() keeps a sensor_sketch row per sensor, field and hour / day with
+the count, sum, min, max and both sketches of the readings recorded in it.
+it reads new readings in sensor_data_id order from where it stopped
+(sketch_progress) and merges them into their rows, so late readings and
+imports are rolled up like any other. summarize() merges the rows of a time
+range and any set of sensors, a year is 365 day rows per sensor plus the
+hours at both ends
+"""
+
+import asyncio
+import logging
+import math
+import struct
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from sqlalchemy import func, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, or_, and_, select
+
+import decoding
+from models import SensorData, SensorSketch, SketchProgress
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ("distance", "count")
+# an hour and a day
+WIDTHS = (3600, 86400)
+
+RELATIVE_ACCURACY = 0.01
+_GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+_LOG_GAMMA = math.log(_GAMMA)
+# smaller magnitudes are counted as zero
+_MIN_VALUE = 1e-9
+# bins per sign, 1% bins from 1e-9 up cover far more than any reading, the
+# lowest bins are folded together beyond that
+MAX_BINS = 2048
+_QUANTILE_HEADER = struct.Struct("<qqIqI")
+
+DISTINCT_PRECISION = 11
+_REGISTERS = 1 << DISTINCT_PRECISION
+
+ROLLUP = "sensor_sketch"
+# pg_try_advisory_xact_lock key, one rollup runs at a time
+ROLLUP_LOCK = 0x53454E53
+
+
+class _Bins:
+    """
+    Counts of consecutive logarithmic bins, starting at bin `offset`
+    """
+
+    def __init__(self, offset: int = 0, counts: np.ndarray | None = None):
+        self.offset = offset
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else counts
+
+    def _extend(self, low: int, high: int):
+        # make room for bins low..high (inclusive)
+        if len(self.counts) == 0:
+            self.offset = low
+            self.counts = np.zeros(high - low + 1, dtype=np.int64)
+            return
+        new_low = min(low, self.offset)
+        new_high = max(high, self.offset + len(self.counts) - 1)
+        if new_low == self.offset and new_high == self.offset + len(self.counts) - 1:
+            return
+        counts = np.zeros(new_high - new_low + 1, dtype=np.int64)
+        start = self.offset - new_low
+        counts[start : start + len(self.counts)] = self.counts
+        self.offset, self.counts = new_low, counts
+
+    def add(self, keys: np.ndarray):
+        if len(keys) == 0:
+            return
+        low, high = int(keys.min()), int(keys.max())
+        self._extend(low, high)
+        start = low - self.offset
+        self.counts[start : start + high - low + 1] += np.bincount(keys - low)
+        self._collapse()
+
+    def merge(self, other: "_Bins"):
+        if len(other.counts) == 0:
+            return
+        self._extend(other.offset, other.offset + len(other.counts) - 1)
+        start = other.offset - self.offset
+        self.counts[start : start + len(other.counts)] += other.counts
+        self._collapse()
+
+    def _collapse(self):
+        extra = len(self.counts) - MAX_BINS
+        if extra > 0:
+            # the smallest magnitudes lose their accuracy first
+            self.counts[extra] += self.counts[:extra].sum()
+            self.counts = self.counts[extra:]
+            self.offset += extra
+
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+
+class QuantileSketch:
+    def __init__(self):
+        self.zeros = 0
+        self.positive = _Bins()
+        self.negative = _Bins()
+
+    def add(self, values: np.ndarray):
+        """
+        Count an array of values, nan values are skipped
+        """
+
+        values = values[~np.isnan(values)]
+        positive = values[values > _MIN_VALUE]
+        negative = -values[values < -_MIN_VALUE]
+        self.zeros += len(values) - len(positive) - len(negative)
+        self.positive.add(_keys(positive))
+        self.negative.add(_keys(negative))
+
+    def merge(self, other: "QuantileSketch"):
+        self.zeros += other.zeros
+        self.positive.merge(other.positive)
+        self.negative.merge(other.negative)
+
+    def count(self) -> int:
+        return self.zeros + self.positive.total() + self.negative.total()
+
+    def quantiles(self, qs: list[float]) -> list[float | None]:
+        if self.count() == 0:
+            return [None for _ in qs]
+        # every bin's value from the lowest (most negative) to the highest
+        negative_keys = self.negative.offset + np.arange(len(self.negative.counts))
+        positive_keys = self.positive.offset + np.arange(len(self.positive.counts))
+        values = np.concatenate(
+            [-_value(negative_keys[::-1]), [0.0], _value(positive_keys)]
+        )
+        counts = np.concatenate(
+            [self.negative.counts[::-1], [self.zeros], self.positive.counts]
+        )
+        cumulative = np.cumsum(counts)
+        ranks = np.asarray(qs, dtype=np.float64) * (cumulative[-1] - 1)
+        return values[np.searchsorted(cumulative, ranks, side="right")].tolist()
+
+    def to_bytes(self) -> bytes:
+        header = _QUANTILE_HEADER.pack(
+            self.zeros,
+            self.positive.offset,
+            len(self.positive.counts),
+            self.negative.offset,
+            len(self.negative.counts),
+        )
+        return zlib.compress(
+            header + self.positive.counts.tobytes() + self.negative.counts.tobytes(), 1
+        )
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "QuantileSketch":
+        data = zlib.decompress(data)
+        zeros, positive_offset, positive_len, negative_offset, negative_len = (
+            _QUANTILE_HEADER.unpack_from(data)
+        )
+        counts = np.frombuffer(data, dtype=np.int64, offset=_QUANTILE_HEADER.size)
+        sketch = cls()
+        sketch.zeros = zeros
+        sketch.positive = _Bins(positive_offset, counts[:positive_len].copy())
+        sketch.negative = _Bins(negative_offset, counts[positive_len:].copy())
+        return sketch
+
+
+def _keys(magnitudes: np.ndarray) -> np.ndarray:
+    # bin k holds (gamma^(k-1), gamma^k]
+    return np.ceil(np.log(magnitudes) / _LOG_GAMMA).astype(np.int64)
+
+
+def _value(keys: np.ndarray) -> np.ndarray:
+    # the point of the bin with the same relative error to both of its ends
+    return 2 * np.power(_GAMMA, keys.astype(np.float64)) / (_GAMMA + 1)
+
+
+class DistinctSketch:
+    def __init__(self, registers: np.ndarray | None = None):
+        self.registers = (
+            np.zeros(_REGISTERS, dtype=np.uint8) if registers is None else registers
+        )
+
+    def add(self, values: np.ndarray):
+        """
+        Count the distinct values of an array, nan values are skipped
+        """
+
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        hashes = _hash(values)
+        index = (hashes >> np.uint64(64 - DISTINCT_PRECISION)).astype(np.int64)
+        rest = hashes << np.uint64(DISTINCT_PRECISION)
+        # position of the first set bit of the remaining 64 - p bits
+        rank = np.minimum(65 - _bit_length(rest), 64 - DISTINCT_PRECISION + 1)
+        np.maximum.at(self.registers, index, rank.astype(np.uint8))
+
+    def merge(self, other: "DistinctSketch"):
+        np.maximum(self.registers, other.registers, out=self.registers)
+
+    def estimate(self) -> int:
+        alpha = 0.7213 / (1 + 1.079 / _REGISTERS)
+        estimate = (
+            alpha
+            * _REGISTERS**2
+            / np.sum(np.power(2.0, -self.registers.astype(np.float64)))
+        )
+        empty = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * _REGISTERS and empty:
+            # linear counting is better while many registers are unset
+            estimate = _REGISTERS * math.log(_REGISTERS / empty)
+        return round(estimate)
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(self.registers.tobytes(), 1)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "DistinctSketch":
+        return cls(np.frombuffer(zlib.decompress(data), dtype=np.uint8).copy())
+
+
+def _hash(values: np.ndarray) -> np.ndarray:
+    # splitmix64 of the float64 bits, + 0.0 makes -0.0 and 0.0 the same value
+    z = (values.astype(np.float64) + 0.0).view(np.uint64)
+    z = z + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _bit_length(x: np.ndarray) -> np.ndarray:
+    x = x.copy()
+    length = np.zeros(len(x), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        high = x >= np.uint64(1 << shift)
+        length[high] += shift
+        x[high] >>= np.uint64(shift)
+    return length + (x > 0)
+
+
+class Summary:
+    """
+    Count, sum, min, max and both sketches of a set of readings
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.quantiles = QuantileSketch()
+        self.distinct = DistinctSketch()
+
+    def add(self, values: np.ndarray):
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.quantiles.add(values)
+        self.distinct.add(values)
+
+    def merge(self, other: "Summary"):
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.quantiles.merge(other.quantiles)
+        self.distinct.merge(other.distinct)
+
+    @classmethod
+    def from_row(cls, row: SensorSketch) -> "Summary":
+        summary = cls()
+        summary.count = row.count
+        summary.sum = row.sum
+        summary.min = math.inf if row.min is None else row.min
+        summary.max = -math.inf if row.max is None else row.max
+        summary.quantiles = QuantileSketch.from_bytes(row.quantiles)
+        summary.distinct = DistinctSketch.from_bytes(row.distinct)
+        return summary
+
+    def to_row(self, sensor_id: int, field: str, width: int, bucket_start) -> dict:
+        return {
+            "sensor_id_sensor_table": sensor_id,
+            "field": field,
+            "width": width,
+            "bucket_start": bucket_start,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "quantiles": self.quantiles.to_bytes(),
+            "distinct": self.distinct.to_bytes(),
+        }
+
+    def to_json(self, qs: list[float]) -> dict:
+        if self.count == 0:
+            return {
+                "count": 0,
+                "sum": 0.0,
+                "min": None,
+                "max": None,
+                "mean": None,
+                "quantiles": {str(q): None for q in qs},
+                "distinct": 0,
+            }
+        # the sketch's bins are only 1% exact, keep quantiles inside the range
+        quantiles = [
+            min(max(value, self.min), self.max)
+            for value in self.quantiles.quantiles(qs)
+        ]
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count,
+            "quantiles": dict(zip(map(str, qs), quantiles)),
+            "distinct": self.distinct.estimate(),
+        }
+
+
+def rollup(engine, batch_size: int, delay: float) -> int:
+    """
+    Merge up to `batch_size` new readings into their sketch rows, return how
+    many were read
+
+    readings added less than `delay` seconds ago are left for later, their
+    transaction may not have committed while one with a higher id did
+    """
+
+    with Session(engine) as session:
+        if not session.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": ROLLUP_LOCK}
+        ).scalar():
+            # another worker is rolling up
+            return 0
+        progress = session.get(SketchProgress, ROLLUP)
+        last_id = 0 if progress is None else progress.sensor_data_id
+
+        cutoff = datetime.now() - timedelta(seconds=delay)
+        # time_added is taken before the insert assigns the id, so a reading
+        # can still be too new while one with a higher id isn't. the batch
+        # stops before the first one that is, or it would be skipped for good
+        too_new = (
+            select(func.min(SensorData.sensor_data_id))
+            .where(
+                SensorData.sensor_data_id > last_id,
+                SensorData.time_added >= cutoff,
+            )
+            .scalar_subquery()
+        )
+        rows = session.execute(
+            select(
+                SensorData.sensor_data_id,
+                SensorData.sensor_id_sensor_table,
+                SensorData.time_recorded,
+                SensorData.data,
+            )
+            .where(
+                SensorData.sensor_data_id > last_id,
+                SensorData.time_added < cutoff,
+                or_(too_new.is_(None), SensorData.sensor_data_id < too_new),
+            )
+            .order_by(SensorData.sensor_data_id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return 0
+
+        # readings without a time belong to no bucket
+        timed = [row for row in rows if row.time_recorded is not None]
+        summaries = _summarize_rows(timed)
+        if summaries:
+            keys = list(summaries)
+            for row in session.exec(
+                select(SensorSketch).where(
+                    tuple_(
+                        SensorSketch.sensor_id_sensor_table,
+                        SensorSketch.field,
+                        SensorSketch.width,
+                        SensorSketch.bucket_start,
+                    ).in_(keys)
+                )
+            ):
+                key = (
+                    row.sensor_id_sensor_table,
+                    row.field,
+                    row.width,
+                    row.bucket_start,
+                )
+                stored = Summary.from_row(row)
+                stored.merge(summaries[key])
+                summaries[key] = stored
+
+            statement = pg_insert(SensorSketch)
+            session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[
+                        SensorSketch.sensor_id_sensor_table,
+                        SensorSketch.field,
+                        SensorSketch.width,
+                        SensorSketch.bucket_start,
+                    ],
+                    set_={
+                        column: statement.excluded[column]
+                        for column in (
+                            "count",
+                            "sum",
+                            "min",
+                            "max",
+                            "quantiles",
+                            "distinct",
+                        )
+                    },
+                ),
+                [summary.to_row(*key) for key, summary in summaries.items()],
+            )
+
+        statement = pg_insert(SketchProgress).values(
+            name=ROLLUP, sensor_data_id=rows[-1].sensor_data_id
+        )
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[SketchProgress.name],
+                set_={"sensor_data_id": statement.excluded.sensor_data_id},
+            )
+        )
+        session.commit()
+        return len(rows)
+
+
+def _summarize_rows(rows) -> dict:
+    # (sensor_id, field, width, bucket_start) -> Summary of the rows in it
+    if not rows:
+        return {}
+    columns = decoding.decode_rows(
+        [row.time_recorded for row in rows], [row.data for row in rows]
+    )
+    seconds = columns.timestamp.astype("datetime64[s]").astype(np.int64)
+    sensors = np.array([row.sensor_id_sensor_table for row in rows], dtype=np.int64)
+
+    summaries = {}
+    for width in WIDTHS:
+        buckets = seconds // width * width
+        order = np.lexsort((buckets, sensors))
+        # runs of the same (sensor, bucket) in the sorted order
+        sorted_sensors, sorted_buckets = sensors[order], buckets[order]
+        starts = np.flatnonzero(
+            np.r_[
+                True,
+                (sorted_sensors[1:] != sorted_sensors[:-1])
+                | (sorted_buckets[1:] != sorted_buckets[:-1]),
+            ]
+        )
+        ends = np.r_[starts[1:], len(order)]
+        for start, end in zip(starts, ends):
+            members = order[start:end]
+            bucket_start = datetime(1970, 1, 1) + timedelta(
+                seconds=int(sorted_buckets[start])
+            )
+            for field in FIELDS:
+                summary = Summary()
+                summary.add(getattr(columns, field)[members])
+                summaries[(int(sorted_sensors[start]), field, width, bucket_start)] = (
+                    summary
+                )
+    return summaries
+
+
+async def rollup_forever(engine, interval: float, batch_size: int, delay: float):
+    """
+    Run rollup until cancelled, every `interval` seconds once it caught up
+    """
+
+    while True:
+        try:
+            read = await asyncio.to_thread(rollup, engine, batch_size, delay)
+        except Exception:
+            logger.exception("sketch rollup failed")
+            read = 0
+        if read < batch_size:
+            await asyncio.sleep(interval)
+
+
+def _floor(moment: datetime, width: int) -> datetime:
+    epoch = datetime(1970, 1, 1)
+    return epoch + timedelta(
+        seconds=math.floor((moment - epoch).total_seconds() / width) * width
+    )
+
+
+def _ceil(moment: datetime, width: int) -> datetime:
+    epoch = datetime(1970, 1, 1)
+    return epoch + timedelta(
+        seconds=math.ceil((moment - epoch).total_seconds() / width) * width
+    )
+
+
+def bucket_range(start: datetime, end: datetime) -> tuple[datetime, datetime]:
+    """
+    The whole hours summarize() covers for [start, end)
+    """
+
+    # time_recorded is stored without a time zone, in local time
+    if start.tzinfo is not None:
+        start = start.astimezone().replace(tzinfo=None)
+    if end.tzinfo is not None:
+        end = end.astimezone().replace(tzinfo=None)
+    return _floor(start, WIDTHS[0]), _ceil(end, WIDTHS[0])
+
+
+def summarize(session, sensor_ids, field: str, start: datetime, end: datetime):
+    """
+    Merge the sketch rows of the sensors (a list of ids or a select of them)
+    between start and end, widened to whole hours
+    """
+
+    hour, day = WIDTHS
+    first_hour, end_hour = bucket_range(start, end)
+    first_day, end_day = _ceil(first_hour, day), _floor(end_hour, day)
+    if first_day < end_day:
+        # whole days from day rows, the hours before and after from hour rows
+        buckets = or_(
+            and_(
+                SensorSketch.width == day,
+                SensorSketch.bucket_start >= first_day,
+                SensorSketch.bucket_start < end_day,
+            ),
+            and_(
+                SensorSketch.width == hour,
+                SensorSketch.bucket_start >= first_hour,
+                SensorSketch.bucket_start < first_day,
+            ),
+            and_(
+                SensorSketch.width == hour,
+                SensorSketch.bucket_start >= end_day,
+                SensorSketch.bucket_start < end_hour,
+            ),
+        )
+    else:
+        buckets = and_(
+            SensorSketch.width == hour,
+            SensorSketch.bucket_start >= first_hour,
+            SensorSketch.bucket_start < end_hour,
+        )
+
+    summary = Summary()
+    for row in session.exec(
+        select(SensorSketch).where(
+            SensorSketch.sensor_id_sensor_table.in_(sensor_ids),
+            SensorSketch.field == field,
+            buckets,
+        )
+    ):
+        summary.merge(Summary.from_row(row))
+    return summary
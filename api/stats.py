@@ -0,0 +1,176 @@
+"""
+Reading counters that don't need COUNT(*) over sensor_data
+
+sensor_stats holds the readings and the newest time_added of every sensor,
+daily_stats the readings stored per day. the ingest routes add to a per
+worker Counters after they commit, flush() writes what was added since the
+last flush with one upsert per table, so a busy sensor costs one row update
+every few seconds instead of one per reading. import_readings.py updates
+the tables in the transaction of every chunk
+
+a worker that dies loses what it added since its last flush, recount()
+(POST /api/v1/admin/stats/recount) rebuilds both tables from sensor_data
+"""
+
+import asyncio
+import logging
+import threading
+from datetime import date, datetime
+
+from sqlalchemy import func, text
+from sqlmodel import Session, select
+
+from models import DailyStats, SensorStats
+
+logger = logging.getLogger(__name__)
+
+# add a flush to the counters
+UPSERT_SENSOR_STATS = """
+INSERT INTO sensor_stats (sensor_id_sensor_table, readings, last_added_at)
+VALUES (:sensor_id, :readings, :last_added_at)
+ON CONFLICT (sensor_id_sensor_table) DO UPDATE SET
+    readings = sensor_stats.readings + excluded.readings,
+    last_added_at = greatest(sensor_stats.last_added_at, excluded.last_added_at)
+"""
+UPSERT_DAILY_STATS = """
+INSERT INTO daily_stats (day, readings) VALUES (:day, :readings)
+ON CONFLICT (day) DO UPDATE SET readings = daily_stats.readings + excluded.readings
+"""
+
+
+class Counters:
+    """
+    Readings added in this worker since the last flush
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # sensor_id -> [readings, last time_added]
+        self._sensors: dict[int, list] = {}
+        # day -> readings
+        self._days: dict[date, int] = {}
+
+    def add(self, sensor_id: int, readings: int, time_added: datetime):
+        if readings <= 0:
+            return
+        with self._lock:
+            counts = self._sensors.setdefault(sensor_id, [0, time_added])
+            counts[0] += readings
+            counts[1] = max(counts[1], time_added)
+            day = time_added.date()
+            self._days[day] = self._days.get(day, 0) + readings
+
+    def flush(self, engine) -> int:
+        """
+        Add the pending counts to the tables, return the readings flushed
+        """
+
+        with self._lock:
+            sensors, self._sensors = self._sensors, {}
+            days, self._days = self._days, {}
+        if not sensors:
+            return 0
+
+        try:
+            with Session(engine) as session:
+                # sorted, so two workers flushing lock the rows in the same order
+                session.execute(
+                    text(UPSERT_SENSOR_STATS),
+                    [
+                        {
+                            "sensor_id": sensor_id,
+                            "readings": readings,
+                            "last_added_at": last_added_at,
+                        }
+                        for sensor_id, (readings, last_added_at) in sorted(
+                            sensors.items()
+                        )
+                    ],
+                )
+                session.execute(
+                    text(UPSERT_DAILY_STATS),
+                    [
+                        {"day": day, "readings": readings}
+                        for day, readings in sorted(days.items())
+                    ],
+                )
+                session.commit()
+        except Exception:
+            # counted again by the next flush
+            with self._lock:
+                for sensor_id, (readings, last_added_at) in sensors.items():
+                    counts = self._sensors.setdefault(sensor_id, [0, last_added_at])
+                    counts[0] += readings
+                    counts[1] = max(counts[1], last_added_at)
+                for day, readings in days.items():
+                    self._days[day] = self._days.get(day, 0) + readings
+            raise
+        return sum(readings for readings, _ in sensors.values())
+
+
+async def flush_forever(counters: Counters, engine, interval: float):
+    """
+    Run counters.flush every `interval` seconds until cancelled
+    """
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(counters.flush, engine)
+        except Exception:
+            logger.exception("stats flush failed")
+
+
+def overview(session, today: date, days: int) -> dict:
+    """
+    Totals over every sensor and the readings of the last `days` days
+    """
+
+    readings, sensors, last_added_at = session.execute(
+        select(
+            func.coalesce(func.sum(SensorStats.readings), 0),
+            func.count(),
+            func.max(SensorStats.last_added_at),
+        )
+    ).one()
+    daily = session.exec(
+        select(DailyStats.day, DailyStats.readings)
+        .where(DailyStats.day > date.fromordinal(today.toordinal() - days))
+        .order_by(DailyStats.day)
+    ).all()
+    by_day = dict(daily)
+    return {
+        "readings": int(readings),
+        "readings_today": by_day.get(today, 0),
+        "sensors_with_readings": sensors,
+        "last_added_at": last_added_at,
+        "days": [{"day": day, "readings": readings} for day, readings in daily],
+    }
+
+
+def recount(engine):
+    """
+    Rebuild sensor_stats and daily_stats from sensor_data, a full scan
+
+    counts the workers haven't flushed yet are added on top, run it while
+    nothing is ingesting
+    """
+
+    with Session(engine) as session:
+        session.execute(text("LOCK TABLE sensor_stats, daily_stats"))
+        session.execute(text("DELETE FROM sensor_stats"))
+        session.execute(text("DELETE FROM daily_stats"))
+        session.execute(
+            text(
+                "INSERT INTO sensor_stats (sensor_id_sensor_table, readings, last_added_at) "
+                "SELECT sensor_id_sensor_table, count(*), max(time_added) "
+                "FROM sensor_data GROUP BY sensor_id_sensor_table"
+            )
+        )
+        session.execute(
+            text(
+                "INSERT INTO daily_stats (day, readings) "
+                "SELECT time_added::date, count(*) FROM sensor_data GROUP BY 1"
+            )
+        )
+        session.commit()
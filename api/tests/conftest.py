@@ -0,0 +1,57 @@
+import os
+
+import pytest
+from sqlmodel import Session, SQLModel, create_engine
+
+import models  # noqa: F401, registers the tables
+
+
+@pytest.fixture(scope="session")
+def engine():
+    # tests that need postgres run against TEST_DATABASE_URL, the tables are
+    # created if missing and every test rolls back what it wrote
+    url = os.environ.get("TEST_DATABASE_URL")
+    if not url:
+        pytest.skip("TEST_DATABASE_URL not set")
+    engine = create_engine(url)
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session(engine):
+    with engine.connect() as connection:
+        transaction = connection.begin()
+        with Session(bind=connection) as session:
+            yield session
+        transaction.rollback()
+
+
+@pytest.fixture
+def api(engine, session, monkeypatch):
+    # main connects to DATABASE_URL when imported, the routes' sessions are
+    # bound to the test's connection so everything they write is rolled back
+    monkeypatch.setenv("DATABASE_URL", os.environ["TEST_DATABASE_URL"])
+    monkeypatch.setenv("SQL_ECHO", "false")
+    import main
+    import stats
+
+    def get_session():
+        with Session(bind=session.connection()) as route_session:
+            yield route_session
+
+    main.app.dependency_overrides[main.get_session] = get_session
+    main.app.dependency_overrides[main.get_read_session] = get_session
+    # counts of the test's readings, never flushed
+    monkeypatch.setattr(main, "stats_counters", stats.Counters())
+    yield main
+    main.app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def client(api):
+    from fastapi.testclient import TestClient
+
+    # without a with block the lifespan (listeners, background tasks) doesn't run
+    return TestClient(api.app)
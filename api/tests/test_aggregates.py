@@ -0,0 +1,83 @@
+import math
+from datetime import datetime
+
+import numpy as np
+
+from aggregates import (
+    EMPTY,
+    SensorAggregates,
+    Stats,
+    _runs,
+    bucket_starts,
+    compute,
+    epoch_seconds,
+)
+
+
+def test_merge():
+    a = Stats(2, 3.0, 1.0, 2.0)
+    b = Stats(1, 5.0, 5.0, 5.0)
+    assert a.merge(b) == Stats(3, 8.0, 1.0, 5.0)
+    assert a.merge(EMPTY) is a
+    assert EMPTY.merge(b) is b
+
+
+def test_to_json():
+    assert Stats(2, 3.0, 1.0, 2.0).to_json()["mean"] == 1.5
+    assert EMPTY.to_json() == {
+        "count": 0,
+        "sum": 0.0,
+        "min": None,
+        "max": None,
+        "mean": None,
+    }
+
+
+def test_bucket_starts_align_to_width():
+    start = datetime(2024, 1, 1, 10, 30)
+    end = datetime(2024, 1, 1, 13, 0)
+    starts = bucket_starts(start, end, 3600)
+    assert starts == [
+        epoch_seconds(datetime(2024, 1, 1, hour)) for hour in (10, 11, 12)
+    ]
+
+
+def test_compute():
+    values = np.array([1.0, 3.0, np.nan, 10.0])
+    seconds = np.array([0, 30, 40, 130])
+    stats = compute(values, seconds, first=0, width=60, n=3)
+    assert stats[0] == Stats(2, 4.0, 1.0, 3.0)
+    # the only reading of the second bucket has no value
+    assert stats[1] == EMPTY
+    assert stats[2] == Stats(1, 10.0, 10.0, 10.0)
+    assert math.isnan(stats[1].min)
+
+
+def test_runs():
+    assert _runs([], 60) == []
+    assert _runs([0, 60, 120, 240, 300, 600], 60) == [
+        [0, 60, 120],
+        [240, 300],
+        [600],
+    ]
+
+
+def test_closed_buckets_are_capped():
+    aggregates = SensorAggregates(max_buckets=2)
+    for first in (0, 60, 120):
+        aggregates.store(("distance", 60, first), EMPTY, True, None, 0)
+    assert aggregates.lookup(("distance", 60, 0), True, None) is None
+    assert aggregates.lookup(("distance", 60, 120), True, None) is EMPTY
+
+
+def test_open_buckets_follow_the_watermark():
+    aggregates = SensorAggregates(max_buckets=10)
+    key = ("distance", 60, 0)
+    stats = Stats(1, 1.0, 1.0, 1.0)
+    aggregates.store(key, stats, False, 5, 0)
+    assert aggregates.lookup(key, False, 5) == stats
+    assert aggregates.lookup(key, False, 6) is None
+
+    # dropped once the bucket closed
+    aggregates.store(("distance", 60, 60), stats, False, 6, closed_before=60)
+    assert key not in aggregates.open
@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+
+import alerts
+
+
+@pytest.mark.parametrize(
+    "kind, field, threshold, window, alpha, error",
+    [
+        ("above", "distance", 50, None, None, None),
+        ("silence", "count", None, 60, None, None),
+        ("spike", "distance", None, None, 0.2, None),
+        ("sideways", "distance", 50, None, None, "kind must be"),
+        ("above", "colour", 50, None, None, "field must be"),
+        ("below", "distance", None, None, None, "need a threshold"),
+        ("rate", "count", 10, 0, None, "positive window_seconds"),
+        ("spike", "distance", None, None, 1.5, "alpha must be"),
+    ],
+)
+def test_validate(kind, field, threshold, window, alpha, error):
+    result = alerts.validate(kind, field, threshold, window, alpha)
+    if error is None:
+        assert result is None
+    else:
+        assert error in result
+
+
+@pytest.mark.parametrize(
+    "url",
+    ["https://93.184.216.34/hook", "http://93.184.216.34:8080/hook?x=1"],
+)
+def test_check_webhook_url_public(url):
+    assert alerts.check_webhook_url(url) is None
+
+
+@pytest.mark.parametrize(
+    "url, error",
+    [
+        ("file:///etc/passwd", "http or https"),
+        ("ftp://93.184.216.34/x", "http or https"),
+        ("gopher://93.184.216.34/", "http or https"),
+        ("http:///hook", "no host"),
+        ("http://127.0.0.1/hook", "private address"),
+        ("http://localhost:8000/hook", "private address"),
+        ("http://10.1.2.3/hook", "private address"),
+        ("http://192.168.1.20/hook", "private address"),
+        ("http://169.254.169.254/latest/meta-data", "private address"),
+        ("http://[::1]/hook", "private address"),
+        ("http://[::ffff:127.0.0.1]/hook", "private address"),
+        ("http://0.0.0.0/hook", "private address"),
+        ("http://93.184.216.34:99999/hook", "can't be resolved"),
+    ],
+)
+def test_check_webhook_url_rejected(url, error):
+    assert error in alerts.check_webhook_url(url)
+
+
+def test_check_webhook_url_allow_private():
+    assert alerts.check_webhook_url("http://192.168.1.20/hook", True) is None
+    assert "http or https" in alerts.check_webhook_url("file:///etc/passwd", True)
+
+
+def _alert(webhook_url: str) -> alerts.Fired:
+    rule = alerts.Rule(
+        rule_id=1,
+        sensor_id=1,
+        kind="above",
+        field="distance",
+        threshold=50,
+        window=None,
+        alpha=None,
+        cooldown=300,
+        webhook_url=webhook_url,
+    )
+    return alerts.Fired(rule, datetime(2024, 5, 1, 12), 60.0, "distance above 50")
+
+
+@pytest.mark.parametrize(
+    "webhook_url, allow_private, posted",
+    [
+        ("http://127.0.0.1/hook", False, False),
+        ("http://127.0.0.1/hook", True, True),
+        ("file:///etc/passwd", True, False),
+    ],
+)
+def test_post_webhook_checks_the_url(monkeypatch, webhook_url, allow_private, posted):
+    requests = []
+
+    class Response:
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+    def open(request, timeout):
+        requests.append(request)
+        return Response()
+
+    monkeypatch.setattr(alerts._webhook_opener, "open", open)
+    alerts._post_webhook(_alert(webhook_url), allow_private)
+    assert len(requests) == int(posted)
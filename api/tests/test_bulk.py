@@ -0,0 +1,166 @@
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import event
+
+import bulk
+from models import (
+    ApiKey,
+    GroupJoinSensors,
+    SensorGroup,
+    SensorTable,
+    User,
+)
+
+
+@pytest.fixture
+def statements(session):
+    # statements sent on the test's connection
+    sent = []
+
+    def count(conn, cursor, statement, parameters, context, many):
+        sent.append(statement)
+
+    connection = session.connection()
+    event.listen(connection, "before_cursor_execute", count)
+    yield sent
+    event.remove(connection, "before_cursor_execute", count)
+
+
+def _columns(**columns) -> dict:
+    # the route always passes every column
+    return {
+        "sensor_model_name": None,
+        "manufacturer": None,
+        "serial_number": None,
+        **columns,
+    }
+
+
+def _sensors(session, n: int) -> list[int]:
+    sensors = [SensorTable(key=uuid.uuid4()) for _ in range(n)]
+    session.add_all(sensors)
+    session.flush()
+    return [sensor.sensor_id for sensor in sensors]
+
+
+def _group(session) -> int:
+    group = SensorGroup(group_name="test")
+    session.add(group)
+    session.flush()
+    return group.group_id
+
+
+def test_size_limits():
+    with pytest.raises(HTTPException) as e:
+        bulk.create_sensors(None, [])
+    assert e.value.detail == "Nothing to do"
+    # rejected before the database is asked anything
+    with pytest.raises(HTTPException) as e:
+        bulk.add_sensors_to_group(None, 1, list(range(bulk.MAX_BULK + 1)))
+    assert e.value.status_code == 400
+    assert e.value.detail == f"At most {bulk.MAX_BULK} rows per request"
+    with pytest.raises(HTTPException) as e:
+        bulk.add_sensors_to_group(None, 1, [])
+    assert e.value.detail == "Nothing to do"
+
+
+def test_create_sensors(session, statements):
+    created = bulk.create_sensors(
+        session,
+        [
+            _columns(manufacturer="a"),
+            _columns(serial_number="b"),
+            _columns(sensor_model_name="c"),
+        ],
+    )
+    assert len(statements) == 1
+    assert [sensor["manufacturer"] for sensor in created] == ["a", None, None]
+    assert [sensor["sensor_model_name"] for sensor in created] == [None, None, "c"]
+    assert len({sensor["key"] for sensor in created}) == 3
+
+
+def test_create_sensors_refuses_empty_ones(session):
+    with pytest.raises(HTTPException) as e:
+        bulk.create_sensors(session, [_columns(manufacturer="a"), _columns()])
+    assert e.value.detail == "All fields are empty for sensor(s) at index 1"
+
+
+def test_add_sensors_to_group(session, statements):
+    group_id = _group(session)
+    sensor_ids = _sensors(session, 3)
+    session.add(
+        GroupJoinSensors(
+            group_id_sensor_groups=group_id, sensor_id_sensor_table=sensor_ids[0]
+        )
+    )
+    session.flush()
+    statements.clear()
+
+    result = bulk.add_sensors_to_group(session, group_id, sensor_ids + sensor_ids[1:])
+    assert result == {"added": 2, "already_present": 1}
+    # one validation query and one insert, however many sensors
+    assert len(statements) == 2
+
+
+def test_add_sensors_to_group_validates_every_id(session, statements):
+    group_id = _group(session)
+    sensor_ids = _sensors(session, 1)
+    missing = [2**31 - 1, 2**31 - 2]
+    statements.clear()
+
+    with pytest.raises(HTTPException) as e:
+        bulk.add_sensors_to_group(session, group_id, sensor_ids + missing)
+    assert e.value.status_code == 404
+    assert e.value.detail == f"Sensor not found: {missing[0]}, {missing[1]}"
+    assert len(statements) == 1
+
+    with pytest.raises(HTTPException) as e:
+        bulk.add_sensors_to_group(session, 2**31 - 1, sensor_ids)
+    assert e.value.detail == "Group not found"
+
+
+def test_grant_to_api_key(session, statements):
+    user = User(
+        email=f"{uuid.uuid4()}@example.com",
+        password_hash="x",
+        is_activated=True,
+        is_admin=False,
+    )
+    session.add(user)
+    session.flush()
+    key = ApiKey(
+        user_id_user=user.user_id,
+        created_at=datetime.now(),
+        is_active=True,
+        api_key_text=str(uuid.uuid4()),
+    )
+    session.add(key)
+    session.flush()
+    sensor_ids = _sensors(session, 2)
+    group_id = _group(session)
+    statements.clear()
+
+    result = bulk.grant_to_api_key(session, key.api_key_text, sensor_ids, [group_id])
+    assert result == {
+        "sensors_added": 2,
+        "sensors_already_granted": 0,
+        "groups_added": 1,
+        "groups_already_granted": 0,
+    }
+    assert len(statements) == 3
+
+    result = bulk.grant_to_api_key(session, key.api_key_text, sensor_ids, [])
+    assert result["sensors_added"] == 0
+    assert result["sensors_already_granted"] == 2
+
+    with pytest.raises(HTTPException) as e:
+        bulk.grant_to_api_key(session, key.api_key_text, [2**31 - 1], [2**31 - 1])
+    assert e.value.detail == (
+        f"Sensor not found: {2**31 - 1}; Group not found: {2**31 - 1}"
+    )
+    with pytest.raises(HTTPException) as e:
+        bulk.grant_to_api_key(session, "no such key", sensor_ids, [])
+    assert e.value.detail == "Api key not found"
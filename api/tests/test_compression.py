@@ -0,0 +1,235 @@
+import asyncio
+import gzip
+import zlib
+
+import pytest
+
+import compression
+
+brotli = pytest.importorskip("brotli")
+zstandard = pytest.importorskip("zstandard")
+
+MAX_SIZE = 1 << 20
+
+
+@pytest.mark.parametrize(
+    "accept, expected",
+    [
+        ("gzip, br, zstd", "zstd"),
+        ("gzip;q=1.0, br;q=0.5", "br"),
+        ("br;q=0, gzip", "gzip"),
+        ("*", "zstd"),
+        # an explicit q=0 wins over the wildcard
+        ("*, zstd;q=0", "br"),
+        ("identity", None),
+        ("", None),
+        ("gzip;q=abc", None),
+    ],
+)
+def test_negotiate_encoding(accept, expected):
+    supported = ["zstd", "br", "gzip"]
+    assert compression.negotiate_encoding(accept, supported) == expected
+
+
+@pytest.mark.parametrize(
+    "encoding, compress",
+    [
+        ("gzip", gzip.compress),
+        ("deflate", zlib.compress),
+        ("br", brotli.compress),
+        ("zstd", zstandard.ZstdCompressor().compress),
+    ],
+)
+def test_decompress_body(encoding, compress):
+    body = b'{"readings": []}' * 100
+    assert compression.decompress_body(compress(body), encoding, MAX_SIZE) == body
+
+
+@pytest.mark.parametrize(
+    "encoding, compress",
+    [
+        ("gzip", gzip.compress),
+        ("br", brotli.compress),
+        ("zstd", zstandard.ZstdCompressor().compress),
+    ],
+)
+def test_decompress_body_refuses_bombs(encoding, compress):
+    bomb = compress(b"\0" * (64 * MAX_SIZE))
+    with pytest.raises(ValueError, match="too large"):
+        compression.decompress_body(bomb, encoding, MAX_SIZE)
+
+
+_Decompressor = brotli.Decompressor
+
+
+class _OldDecompressor:
+    # brotli < 1.2, process() has no output_buffer_limit
+    def __init__(self):
+        self._obj = _Decompressor()
+
+    def process(self, data):
+        return self._obj.process(data)
+
+    def is_finished(self):
+        return self._obj.is_finished()
+
+
+def test_decompress_body_refuses_bombs_on_old_brotli(monkeypatch):
+    monkeypatch.setattr(compression.brotli, "Decompressor", _OldDecompressor)
+    body = b"abc" * 1000
+    assert compression.decompress_body(brotli.compress(body), "br", MAX_SIZE) == body
+    with pytest.raises(ValueError, match="too large"):
+        compression.decompress_body(
+            brotli.compress(b"\0" * (64 * MAX_SIZE)), "br", MAX_SIZE
+        )
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_decompress_body_invalid(encoding):
+    with pytest.raises(ValueError, match="Invalid"):
+        compression.decompress_body(b"definitely not compressed", encoding, MAX_SIZE)
+
+
+def test_decompress_body_truncated_br():
+    with pytest.raises(ValueError, match="Invalid"):
+        compression.decompress_body(brotli.compress(b"abc" * 1000)[:-3], "br", MAX_SIZE)
+
+
+@pytest.mark.parametrize(
+    "encoding, compress",
+    [
+        ("gzip", gzip.compress),
+        ("deflate", zlib.compress),
+        ("zstd", zstandard.ZstdCompressor().compress),
+    ],
+)
+def test_decompress_body_truncated(encoding, compress):
+    body = compress(b"abc" * 1000)
+    # cut inside the data and inside the checksum at the end
+    for end in (len(body) // 2, len(body) - 2):
+        with pytest.raises(ValueError, match="Invalid"):
+            compression.decompress_body(body[:end], encoding, MAX_SIZE)
+
+
+def test_decompress_body_unsupported():
+    with pytest.raises(compression.UnsupportedEncodingError):
+        compression.decompress_body(b"", "compress", MAX_SIZE)
+
+
+async def _echo(scope, receive, send):
+    message = await receive()
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": message["body"]})
+
+
+def _request(content_encoding, body):
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "path": "/api/v1/data",
+        "headers": [(b"content-encoding", content_encoding)],
+    }
+    middleware = compression.CompressionMiddleware(_echo)
+    asyncio.run(middleware(scope, receive, send))
+    return sent[0]["status"], sent[1]["body"]
+
+
+def test_request_bodies():
+    assert _request(b"gzip", gzip.compress(b"hello")) == (200, b"hello")
+    assert _request(b"gzip", gzip.compress(b"hello")[:-4])[0] == 400
+    assert _request(b"compress", b"hello")[0] == 415
+
+
+def _decompressor(encoding):
+    if encoding == "gzip":
+        return zlib.decompressobj(31).decompress
+    if encoding == "br":
+        return brotli.Decompressor().process
+    return zstandard.ZstdDecompressor().decompressobj().decompress
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br", "zstd"])
+def test_streamed_chunks_are_flushed(encoding):
+    chunks = [b"sensor_id,recorded_at,payload\n" * 100 for _ in range(3)]
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        for chunk in chunks[:-1]:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": chunks[-1]})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "path": "/api/v1/sensor_export",
+        "headers": [(b"accept-encoding", encoding.encode())],
+    }
+    middleware = compression.CompressionMiddleware(
+        app, paths=("/api/v1/sensor_export",)
+    )
+    asyncio.run(middleware(scope, None, send))
+
+    assert dict(sent[0]["headers"])[b"content-encoding"] == encoding.encode()
+    decompress = _decompressor(encoding)
+    # every chunk can be decoded as soon as it arrives
+    for message, chunk in zip(sent[1:], chunks):
+        assert decompress(message["body"]) == chunk
+
+
+def _response(accept_encoding, body, headers=()):
+    async def app(scope, receive, send):
+        await send(
+            {"type": "http.response.start", "status": 200, "headers": list(headers)}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "path": "/api/v1/readings",
+        "headers": [(b"accept-encoding", accept_encoding)],
+    }
+    middleware = compression.CompressionMiddleware(
+        app, paths=("/api/v1/readings",), minimum_size=100
+    )
+    asyncio.run(middleware(scope, None, send))
+    return dict(sent[0]["headers"])
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, body, headers",
+    [
+        # compressed
+        (b"gzip", b"a" * 1000, []),
+        # too small to be worth it
+        (b"gzip", b"a", []),
+        # already encoded by the route
+        (b"gzip", b"a" * 1000, [(b"content-encoding", b"br")]),
+        # no encoding the client accepts
+        (b"identity", b"a" * 1000, []),
+    ],
+)
+def test_responses_vary_on_accept_encoding(accept_encoding, body, headers):
+    assert _response(accept_encoding, body, headers)[b"vary"] == b"Accept-Encoding"
+
+
+def test_vary_keeps_other_values():
+    headers = _response(b"gzip", b"a", [(b"vary", b"Cookie")])
+    assert headers[b"vary"] == b"Cookie, Accept-Encoding"
+    headers = _response(b"gzip", b"a" * 1000, [(b"vary", b"accept-encoding")])
+    assert headers[b"vary"] == b"accept-encoding"
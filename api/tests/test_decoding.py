@@ -0,0 +1,72 @@
+import math
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import decoding
+
+
+@pytest.mark.parametrize(
+    "payload, count, distance",
+    [
+        (b"{'count': 3, 'distance': 37.74}", 3, 37.74),
+        (b"{'count': 3, 37.74: 37.74}", 3, 37.74),
+        (b'{"count": 3, "distance": 37.74}', 3, 37.74),
+        (b"{ 'count' : 3 ,'distance':37.74 }", 3, 37.74),
+        (b"{'count': 12, 'distance': 1e-05}", 12, 1e-05),
+        (b"{'count': 1, 'distance': -4.5}", 1, -4.5),
+        (b"{'count': 1, 'distance': nan}", 1, math.nan),
+        (decoding.encode_binary(7, 52.25), 7, 52.25),
+        (decoding.encode_summary(9, 40.5, 3, 30.0, 51.0, 60), 9, 40.5),
+        (b"{'count': 1-2, 'distance': 3}", math.nan, 3.0),
+        (b"garbage", math.nan, math.nan),
+        (b"", math.nan, math.nan),
+        (None, math.nan, math.nan),
+    ],
+)
+def test_decode_payloads(payload, count, distance):
+    # alone and between other rows, the fast paths work on the joined buffer
+    for payloads, row in (
+        ([payload], 0),
+        ([b"{'count': 1, 'distance': 2.0}", payload, decoding.encode_binary(5, 6)], 1),
+    ):
+        counts, distances = decoding.decode_payloads(payloads)
+        np.testing.assert_equal(counts[row], count)
+        np.testing.assert_equal(distances[row], distance)
+
+
+def test_decode_payloads_matches_row_by_row():
+    payloads = [
+        b"{'count': 3, 'distance': 37.74}",
+        b"{'count':\n3}",
+        decoding.encode_binary(2, 1.5),
+        b"{'count': 4, 44.0: 44.0}",
+        b'{"count": 5, "distance": 5.5}',
+        b"junk",
+    ] * 50
+    counts, distances = decoding.decode_payloads(payloads)
+    for i, payload in enumerate(payloads):
+        one_count, one_distance = decoding.decode_payloads([payload])
+        np.testing.assert_equal(counts[i], one_count[0])
+        np.testing.assert_equal(distances[i], one_distance[0])
+
+
+def test_decode_payloads_empty():
+    counts, distances = decoding.decode_payloads([])
+    assert len(counts) == len(distances) == 0
+
+
+def test_decode_rows_and_csv():
+    start = datetime(2024, 5, 1, 12)
+    columns = decoding.decode_rows(
+        [start, start + timedelta(milliseconds=1500)],
+        [b"{'count': 3, 'distance': 37.74}", b"nope"],
+    )
+    assert decoding.to_csv(columns) == (
+        "2024-05-01T12:00:00.000,3,37.74\n" "2024-05-01T12:00:01.500,,\n"
+    )
+
+
+def test_to_csv_empty():
+    assert decoding.to_csv(decoding.decode_rows([], [])) == ""
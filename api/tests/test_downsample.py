@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import downsample
+
+
+def _sine(n: int):
+    x = np.arange(n, dtype=np.float64)
+    return x, np.sin(x / 50)
+
+
+@pytest.mark.parametrize("method", downsample.METHODS)
+def test_short_series_are_kept(method):
+    x, y = _sine(10)
+    assert downsample.downsample(x, y, 500, method).tolist() == list(range(10))
+
+
+@pytest.mark.parametrize("points", [3, 10, 500])
+def test_lttb(points):
+    x, y = _sine(10_000)
+    kept = downsample.lttb(x, y, points)
+    assert len(kept) == points
+    assert kept[0] == 0 and kept[-1] == len(x) - 1
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_lttb_needs_three_points():
+    x, y = _sine(100)
+    with pytest.raises(ValueError):
+        downsample.lttb(x, y, 2)
+
+
+def test_minmax_keeps_spikes():
+    x, y = _sine(10_000)
+    y[1234] = 100
+    y[8765] = -100
+    kept = downsample.minmax(x, y, 100)
+    assert len(kept) <= 100
+    assert 1234 in kept and 8765 in kept
+    assert np.all(np.diff(kept) > 0)
+
+
+def test_minmax_single_timestamp():
+    x = np.zeros(50)
+    y = np.arange(50, dtype=np.float64)
+    assert downsample.minmax(x, y, 10).tolist() == [0, 49]
+
+
+def test_nan_values_are_dropped():
+    x, y = _sine(1000)
+    y[::2] = np.nan
+    kept = downsample.downsample(x, y, 100, "lttb")
+    assert not np.isnan(y[kept]).any()
+
+
+def test_unknown_method():
+    x, y = _sine(10)
+    with pytest.raises(ValueError):
+        downsample.downsample(x, y, 5, "average")
+
+
+def test_series():
+    start = datetime(2024, 5, 1, 12)
+    times = [start + timedelta(seconds=i) for i in range(5)]
+    payloads = [str({"count": i, "distance": i * 1.5}).encode() for i in range(5)]
+    assert downsample.series(times, payloads, "distance", 500, "lttb") == [
+        (f"2024-05-01T12:00:0{i}.000", i * 1.5) for i in range(5)
+    ]
@@ -0,0 +1,61 @@
+import base64
+import uuid
+from datetime import datetime, timedelta
+
+from models import GroupJoinSensors, SensorData, SensorGroup, SensorTable
+
+
+def _group(session, readings_per_sensor: list[int]) -> tuple[int, list[int]]:
+    group = SensorGroup(group_name="test")
+    sensors = [SensorTable(key=uuid.uuid4()) for _ in readings_per_sensor]
+    session.add(group)
+    session.add_all(sensors)
+    session.flush()
+    now = datetime.now()
+    for sensor, readings in zip(sensors, readings_per_sensor):
+        session.add(
+            GroupJoinSensors(
+                group_id_sensor_groups=group.group_id,
+                sensor_id_sensor_table=sensor.sensor_id,
+            )
+        )
+        for i in range(readings):
+            session.add(
+                SensorData(
+                    data=bytes([sensor.sensor_id % 256, i]),
+                    sensor_id_sensor_table=sensor.sensor_id,
+                    time_recorded=now + timedelta(seconds=i),
+                    time_added=now,
+                )
+            )
+    session.flush()
+    return group.group_id, [sensor.sensor_id for sensor in sensors]
+
+
+def _payloads(readings) -> list[int]:
+    return [base64.b64decode(reading["data"])[1] for reading in readings]
+
+
+def test_newest_readings_of_every_sensor(client, session):
+    group_id, (full, partial, empty) = _group(session, [5, 2, 0])
+
+    response = client.get(f"/api/v1/group_data/{group_id}", params={"count": 3})
+    assert response.status_code == 200
+    sensors = response.json()["sensors"]
+    assert _payloads(sensors[str(full)]) == [4, 3, 2]
+    assert _payloads(sensors[str(partial)]) == [1, 0]
+    # members without readings are listed too
+    assert sensors[str(empty)] == []
+
+
+def test_count_is_clamped(client, session):
+    group_id, (sensor_id,) = _group(session, [3])
+    response = client.get(f"/api/v1/group_data/{group_id}", params={"count": 0})
+    assert _payloads(response.json()["sensors"][str(sensor_id)]) == [2]
+
+
+def test_empty_and_missing_groups(client, session):
+    group_id, _ = _group(session, [])
+    response = client.get(f"/api/v1/group_data/{group_id}")
+    assert response.json() == {"group_id": group_id, "sensors": {}}
+    assert client.get(f"/api/v1/group_data/{2**31 - 1}").status_code == 404
@@ -0,0 +1,19 @@
+import time
+
+import ids
+
+
+def test_uuid7_layout():
+    before = time.time()
+    value = ids.uuid7()
+    assert value.version == 7
+    assert value.variant == "specified in RFC 4122"
+    assert before - 0.001 <= ids.uuid7_time(value) <= time.time() + 0.001
+
+
+def test_uuid7_is_strictly_increasing():
+    # more than 4096 per millisecond borrows from the next millisecond
+    values = [ids.uuid7() for _ in range(20000)]
+    assert values == sorted(values)
+    assert len(set(values)) == len(values)
+    assert all(value.version == 7 for value in values)
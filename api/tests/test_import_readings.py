@@ -0,0 +1,109 @@
+import base64
+import csv
+import io
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import import_readings
+from import_readings import RowError
+from models import SensorTable
+
+
+def _fields(line: str) -> list[str]:
+    # the line as COPY (FORMAT csv) reads it
+    return next(csv.reader(io.StringIO(line)))
+
+
+def test_to_copy_line():
+    reading_id = uuid.uuid4()
+    row = {
+        "recorded_at": "2024-05-01T12:00:00.250",
+        "data": base64.b64encode(b"\x01\x02").decode(),
+        "reading_id": str(reading_id),
+    }
+    assert _fields(import_readings.to_copy_line(row, 7)) == [
+        "7",
+        "2024-05-01T12:00:00.250000",
+        "\\x0102",
+        str(reading_id),
+    ]
+
+
+def test_to_copy_line_payload_text():
+    row = {"recorded_at": "2024-05-01 12:00", "payload": "{'count': 1}"}
+    assert _fields(import_readings.to_copy_line(row, 7)) == [
+        "7",
+        "2024-05-01T12:00:00",
+        "\\x" + b"{'count': 1}".hex(),
+        "",
+    ]
+
+
+@pytest.mark.parametrize(
+    "recorded_at",
+    [
+        datetime(2024, 5, 1, 14, 0, tzinfo=timezone(timedelta(hours=2))),
+        "2024-05-01T14:00:00+02:00",
+    ],
+)
+def test_to_copy_line_drops_the_offset(recorded_at):
+    row = {"recorded_at": recorded_at, "payload": b"x"}
+    assert _fields(import_readings.to_copy_line(row, 1))[1] == "2024-05-01T14:00:00"
+
+
+@pytest.mark.parametrize(
+    "row, message",
+    [
+        ({"payload": "x"}, "recorded_at is missing"),
+        ({"recorded_at": 'garbage, "x', "payload": "x"}, "recorded_at is not"),
+        ({"recorded_at": "yesterday", "payload": "x"}, "recorded_at is not"),
+        ({"recorded_at": 1714564800, "payload": "x"}, "recorded_at is not"),
+        ({"recorded_at": "2024-05-01T12:00:00"}, "both missing"),
+        ({"recorded_at": "2024-05-01T12:00:00", "data": "not base64!"}, "base64"),
+        (
+            {"recorded_at": "2024-05-01T12:00:00", "payload": "x", "reading_id": "1"},
+            "not a uuid",
+        ),
+    ],
+)
+def test_to_copy_line_invalid(row, message):
+    with pytest.raises(RowError, match=message):
+        import_readings.to_copy_line(row, 1)
+
+
+@pytest.mark.parametrize(
+    "value, expected",
+    [("12", 12), (12, 12), ("abc", None), ("", None), ("0", None), (2**31, None)],
+)
+def test_parse_sensor_id(value, expected):
+    assert import_readings.parse_sensor_id(value) == expected
+
+
+def test_resolver(session):
+    sensor = SensorTable(key=uuid.uuid4())
+    session.add(sensor)
+    session.flush()
+    rows = [
+        {"sensor_key": str(sensor.key)},
+        {"sensor_key": str(sensor.key).upper()},
+        {"sensor_key": "not a uuid"},
+        {"sensor_id": str(sensor.sensor_id)},
+        {"sensor_id": "abc"},
+        {"sensor_id": str(2**40)},
+        {},
+    ]
+    resolver = import_readings.SensorResolver(session.connection())
+    resolver.resolve(rows)
+
+    assert resolver.sensor_id(rows[0]) == sensor.sensor_id
+    assert resolver.sensor_id(rows[1]) == sensor.sensor_id
+    assert resolver.sensor_id(rows[3]) == sensor.sensor_id
+    with pytest.raises(RowError, match="unknown sensor_key"):
+        resolver.sensor_id(rows[2])
+    for row in rows[4:6]:
+        with pytest.raises(RowError, match="is not a sensor id"):
+            resolver.sensor_id(row)
+    with pytest.raises(RowError, match="both missing"):
+        resolver.sensor_id(rows[6])
@@ -0,0 +1,107 @@
+import base64
+import json
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+from sqlmodel import select
+
+import decoding
+import wire
+from models import Alert, AlertRule, SensorData, SensorTable
+
+
+def _sensor(session) -> SensorTable:
+    sensor = SensorTable(key=uuid.uuid4())
+    session.add(sensor)
+    session.flush()
+    # a rule that fires on every reading, no cooldown
+    session.add(
+        AlertRule(
+            sensor_id_sensor_table=sensor.sensor_id,
+            kind="above",
+            threshold=0,
+            cooldown_seconds=0,
+        )
+    )
+    session.flush()
+    return sensor
+
+
+def _count(session, model, sensor_id) -> int:
+    return session.exec(
+        select(func.count()).where(model.sensor_id_sensor_table == sensor_id)
+    ).one()
+
+
+def test_replayed_reading_is_stored_once(client, api, session):
+    sensor = _sensor(session)
+    body = {
+        "data": base64.b64encode(decoding.encode_binary(1, 12.5)).decode(),
+        "sensor_key": str(sensor.key),
+        "recorded_at": datetime.now().isoformat(),
+        "reading_id": str(uuid.uuid4()),
+    }
+
+    first = client.post("/api/v1/data", json=body)
+    assert first.status_code == 200
+    replayed = client.post("/api/v1/data", json=body)
+    assert replayed.status_code == 200
+    # the stored reading is returned for the retry
+    assert json.loads(replayed.json()) == json.loads(first.json())
+
+    assert _count(session, SensorData, sensor.sensor_id) == 1
+    assert _count(session, Alert, sensor.sensor_id) == 1
+    assert api.stats_counters._sensors[sensor.sensor_id][0] == 1
+
+
+def test_readings_without_an_id_are_all_stored(client, session):
+    sensor = _sensor(session)
+    body = {
+        "data": base64.b64encode(decoding.encode_binary(1, 12.5)).decode(),
+        "sensor_key": str(sensor.key),
+        "recorded_at": datetime.now().isoformat(),
+    }
+    for _ in range(2):
+        assert client.post("/api/v1/data", json=body).status_code == 200
+    assert _count(session, SensorData, sensor.sensor_id) == 2
+
+
+def _post_batch(client, readings):
+    return client.post(
+        "/api/v1/data/batch",
+        content=wire.encode_frames(readings),
+        headers={"content-type": wire.MEDIA_TYPE},
+    )
+
+
+def test_replayed_batch_is_stored_once(client, api, session):
+    sensor = _sensor(session)
+    recorded_at = datetime.now() - timedelta(seconds=5)
+    readings = [
+        (sensor.key, recorded_at, decoding.encode_binary(1, distance), uuid.uuid4())
+        for distance in (1.0, 2.0, 3.0)
+    ]
+
+    response = _post_batch(client, readings[:2])
+    assert response.json() == {"accepted": 2, "duplicates": 0}
+    # a resend after a lost response, plus one new reading and one sent twice
+    response = _post_batch(client, readings + [readings[2]])
+    assert response.json() == {"accepted": 1, "duplicates": 3}
+
+    assert _count(session, SensorData, sensor.sensor_id) == 3
+    assert _count(session, Alert, sensor.sensor_id) == 3
+    assert api.stats_counters._sensors[sensor.sensor_id][0] == 3
+
+
+def test_batch_with_unknown_sensor_key_is_rejected(client, session):
+    sensor = _sensor(session)
+    unknown = uuid.uuid4()
+    readings = [
+        (key, datetime.now(), decoding.encode_binary(1, 1.0), uuid.uuid4())
+        for key in (sensor.key, unknown)
+    ]
+    response = _post_batch(client, readings)
+    assert response.status_code == 404
+    assert str(unknown) in response.json()["detail"]
+    assert _count(session, SensorData, sensor.sensor_id) == 0
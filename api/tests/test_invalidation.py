@@ -0,0 +1,70 @@
+import json
+import uuid
+
+from invalidation import MAX_PAYLOAD, Invalidator, LocalCache
+
+
+def test_lru_and_ttl(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("invalidation.time.monotonic", lambda: now[0])
+    cache = LocalCache("test", maxsize=2, ttl=10)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    # "b" is the least recently used now
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert len(cache) == 2
+
+    now[0] += 10
+    assert cache.get("a", "expired") == "expired"
+
+
+def test_set_skips_values_invalidated_while_loading():
+    cache = LocalCache("test", maxsize=10, ttl=60)
+    generation = cache.generation
+    cache.evict(["a"])
+    cache.set("a", 1, generation)
+    assert cache.get("a") is None
+    cache.set("a", 1, cache.generation)
+    assert cache.get("a") == 1
+
+
+def test_handle_evicts_typed_keys():
+    invalidator = Invalidator(engine=None)
+    ids = invalidator.cache("ids", 10, 60, key_type=int)
+    tokens = invalidator.cache("tokens", 10, 60, key_type=uuid.UUID)
+    token = uuid.uuid4()
+    ids.set(1, "one")
+    ids.set(2, "two")
+    tokens.set(token, "session")
+
+    invalidator.handle(json.dumps({"cache": "ids", "keys": ["1"]}))
+    invalidator.handle(json.dumps({"cache": "tokens", "keys": [str(token)]}))
+    assert ids.get(1) is None and ids.get(2) == "two"
+    assert tokens.get(token) is None
+
+    invalidator.handle(json.dumps({"cache": "ids", "keys": None}))
+    assert len(ids) == 0
+
+
+def test_broken_event_clears_everything():
+    invalidator = Invalidator(engine=None)
+    cache = invalidator.cache("ids", 10, 60)
+    cache.set("a", 1)
+    invalidator.handle("not json")
+    assert len(cache) == 0
+
+
+def test_publish_evicts_locally_and_notifies(session):
+    invalidator = Invalidator(engine=None)
+    cache = invalidator.cache("ids", 10, 60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    invalidator.publish(session, "ids", ["a"])
+    assert cache.get("a") is None and cache.get("b") == 2
+
+    # more keys than fit in a notification are sent as "clear everything",
+    # postgres would reject the payload otherwise
+    invalidator.publish(session, "ids", ["x" * 100] * (MAX_PAYLOAD // 100))
+    assert cache.get("b") == 2
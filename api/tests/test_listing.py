@@ -0,0 +1,24 @@
+import pytest
+from fastapi import HTTPException
+from sqlmodel import select
+
+import listing
+from models import User
+
+
+def test_cursor_round_trip():
+    values = [False, "2024-05-01T12:00:00", 42]
+    assert listing._decode_cursor(listing._encode_cursor(values)) == values
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bnVsbA", "WzEsIDJd"])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as e:
+        listing._decode_cursor(cursor)
+    assert e.value.status_code == 400
+
+
+@pytest.mark.parametrize("email", ["a :b", "50%", "o'brien", "a\\b"])
+def test_estimate_count_keeps_filter_values_bound(session, email):
+    statement = select(User).where(User.email.startswith(email, autoescape=True))
+    assert listing.estimate_count(session, statement, "user", filtered=True) >= 0
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import metrics
+from profiling import ProfileMiddleware, _cookies, _flag
+
+
+def scope(headers=(), query_string=b""):
+    return {
+        "type": "http",
+        "method": "GET",
+        "path": "/readings/1",
+        "headers": list(headers),
+        "query_string": query_string,
+    }
+
+
+def test_flag():
+    assert _flag(scope()) is None
+    assert _flag(scope([(b"x-profile", b"1")])) == "1"
+    assert _flag(scope(query_string=b"a=2&profile=html")) == "html"
+    assert _flag(scope(query_string=b"profiles=1")) is None
+
+
+def test_cookies():
+    headers = [(b"cookie", b"session=abc; theme=dark"), (b"cookie", b"x=1=2")]
+    assert _cookies(scope(headers)) == {"session": "abc", "theme": "dark", "x": "1=2"}
+
+
+async def app(scope, receive, send):
+    stats = metrics.request_stats.get()
+    if stats is not None and stats.queries is not None:
+        stats.statements += 1
+        stats.queries.append(("SELECT 1", 0.002))
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"ok"})
+
+
+def run(middleware, request_scope):
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    async def main():
+        token = metrics.request_stats.set(metrics.RequestStats())
+        try:
+            await middleware(request_scope, None, send)
+        finally:
+            metrics.request_stats.reset(token)
+
+    asyncio.run(main())
+    return dict(messages[0]["headers"]).get(b"x-profile"), messages
+
+
+def test_only_admins_are_profiled(tmp_path):
+    middleware = ProfileMiddleware(app, lambda cookies: False, str(tmp_path))
+    name, messages = run(middleware, scope([(b"x-profile", b"1")]))
+    assert name is None
+    assert messages[1]["body"] == b"ok"
+    assert os.listdir(tmp_path) == []
+
+
+def test_profile_is_stored(tmp_path):
+    pytest.importorskip("pyinstrument")
+    seen = []
+
+    def is_admin(cookies):
+        seen.append(cookies)
+        return True
+
+    middleware = ProfileMiddleware(app, is_admin, str(tmp_path))
+    request_scope = scope([(b"x-profile", b"1"), (b"cookie", b"session=abc")])
+    name, messages = run(middleware, request_scope)
+    assert seen == [{"session": "abc"}]
+    assert messages[1]["body"] == b"ok"
+
+    name = name.decode()
+    assert sorted(os.listdir(tmp_path)) == [name + ".html", name + ".json"]
+    with open(tmp_path / (name + ".json")) as f:
+        report = json.load(f)
+    assert report["status"] == 200
+    assert report["statements"] == 1
+    assert report["queries"] == [{"statement": "SELECT 1", "ms": 2.0}]
+
+
+def test_profile_as_html(tmp_path):
+    pytest.importorskip("pyinstrument")
+    middleware = ProfileMiddleware(app, lambda cookies: True, str(tmp_path))
+    name, messages = run(middleware, scope(query_string=b"profile=html"))
+    assert len(messages) == 2
+    assert dict(messages[0]["headers"])[b"content-type"].startswith(b"text/html")
+    assert messages[1]["body"] != b"ok"
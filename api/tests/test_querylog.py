@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import os
+
+import pytest
+from sqlalchemy import create_engine, text
+
+import metrics
+import querylog
+
+
+def _run(middleware, statements: int):
+    async def app(scope, receive, send):
+        metrics.request_stats.get().statements += statements
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def main():
+        stats = metrics.RequestStats()
+        stats.db_seconds = 0.0125
+        token = metrics.request_stats.set(stats)
+        try:
+            await middleware(app)(
+                {"type": "http", "method": "GET", "path": "/api/v1/data"}, None, send
+            )
+        finally:
+            metrics.request_stats.reset(token)
+
+    asyncio.run(main())
+    return dict(sent[0]["headers"])
+
+
+def test_debug_header():
+    headers = _run(
+        lambda app: querylog.QueryReportMiddleware(app, 10, debug_header=True), 3
+    )
+    assert headers[b"x-db-statements"] == b"3 statements; time=12.5ms; slow=0"
+    headers = _run(lambda app: querylog.QueryReportMiddleware(app, 10), 3)
+    assert b"x-db-statements" not in headers
+
+
+def test_statement_budget(caplog):
+    caplog.set_level(logging.WARNING, logger="sensata.queries")
+    _run(lambda app: querylog.QueryReportMiddleware(app, 10), 10)
+    assert caplog.records == []
+    _run(lambda app: querylog.QueryReportMiddleware(app, 10), 11)
+    assert caplog.messages == [
+        "GET /api/v1/data issued 11 statements; time=12.5ms; slow=0 (budget 10)"
+    ]
+
+
+@pytest.fixture
+def slow_engine(engine):
+    # an engine of its own, the listeners can't be removed again
+    slow = create_engine(os.environ["TEST_DATABASE_URL"])
+    querylog.instrument_engine(slow, slow_query_ms=0)
+    yield slow
+    slow.dispose()
+
+
+def test_slow_queries_are_logged_with_their_plan(slow_engine, caplog):
+    caplog.set_level(logging.WARNING, logger="sensata.queries")
+    stats = metrics.RequestStats()
+    token = metrics.request_stats.set(stats)
+    try:
+        with slow_engine.connect() as connection:
+            connection.execute(text("SELECT 1 WHERE 1 = :one"), {"one": 1})
+            # not explainable, logged without a plan
+            connection.execute(text("SET LOCAL statement_timeout = 0"))
+    finally:
+        metrics.request_stats.reset(token)
+
+    messages = [m for m in caplog.messages if "SELECT 1" in m]
+    assert len(messages) == 1
+    assert messages[0].startswith("slow query (")
+    assert "Result" in messages[0]
+    assert any(m.endswith("SET LOCAL statement_timeout = 0") for m in caplog.messages)
+    assert stats.slow_statements >= 2
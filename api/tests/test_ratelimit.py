@@ -0,0 +1,65 @@
+import pytest
+
+from ratelimit import Policy, RateLimiter
+
+KEY = Policy("key", rate=2, burst=3)
+CLIENT = Policy("client", rate=10, burst=10)
+
+
+def test_burst_then_refill():
+    limiter = RateLimiter()
+    for _ in range(3):
+        assert limiter.acquire([(KEY, "a")], now=0) == (0, None)
+    wait, limited = limiter.acquire([(KEY, "a")], now=0)
+    assert limited == "key"
+    assert wait == pytest.approx(0.5)
+    # half a second refills one token at 2 per second
+    assert limiter.acquire([(KEY, "a")], now=0.5) == (0, None)
+    assert limiter.acquire([(KEY, "a")], now=0.5)[1] == "key"
+
+
+def test_keys_have_their_own_buckets():
+    limiter = RateLimiter()
+    for _ in range(3):
+        limiter.acquire([(KEY, "a")], now=0)
+    assert limiter.acquire([(KEY, "a")], now=0)[1] == "key"
+    assert limiter.acquire([(KEY, "b")], now=0) == (0, None)
+
+
+def test_limited_request_takes_no_tokens():
+    limiter = RateLimiter()
+    for _ in range(3):
+        limiter.acquire([(KEY, "a"), (CLIENT, "10.0.0.1")], now=0)
+    # refused by the key policy, the client bucket keeps its 7 tokens
+    for _ in range(5):
+        assert limiter.acquire([(KEY, "a"), (CLIENT, "10.0.0.1")], now=0)[1] == "key"
+    for _ in range(7):
+        assert limiter.acquire([(CLIENT, "10.0.0.1")], now=0) == (0, None)
+    assert limiter.acquire([(CLIENT, "10.0.0.1")], now=0)[1] == "client"
+
+
+def test_longest_wait_is_reported():
+    slow = Policy("slow", rate=0.1, burst=1)
+    limiter = RateLimiter()
+    limiter.acquire([(KEY, "a"), (slow, "a")], now=0)
+    for _ in range(2):
+        limiter.acquire([(KEY, "a")], now=0)
+    wait, limited = limiter.acquire([(KEY, "a"), (slow, "a")], now=0)
+    assert limited == "slow"
+    assert wait == pytest.approx(10)
+
+
+def test_disabled_policy():
+    limiter = RateLimiter()
+    off = Policy("off", rate=0, burst=0)
+    for _ in range(100):
+        assert limiter.acquire([(off, "a")], now=0) == (0, None)
+    assert len(limiter) == 0
+
+
+def test_least_recently_used_buckets_are_dropped():
+    limiter = RateLimiter(maxsize=2)
+    for key in "abc":
+        limiter.acquire([(KEY, key)], now=0)
+    assert len(limiter) == 2
+    assert ("key", "a") not in limiter._buckets
@@ -0,0 +1,55 @@
+import asyncio
+
+from replicas import COOKIE, HEADER, ReadRouter, ReadYourWritesMiddleware
+
+PRIMARY = object()
+REPLICA = object()
+
+
+def test_without_replica_reads_from_primary():
+    router = ReadRouter(PRIMARY)
+    assert router.engine_for({}, {}) is PRIMARY
+    assert router.check() is None
+
+
+def test_routes_to_a_current_replica():
+    router = ReadRouter(PRIMARY, REPLICA, max_lag=5)
+    router.lag = 1
+    assert router.engine_for({}, {}) is REPLICA
+
+
+def test_own_writes_go_to_primary():
+    router = ReadRouter(PRIMARY, REPLICA)
+    assert router.engine_for({}, {COOKIE: "1"}) is PRIMARY
+    assert router.engine_for({HEADER: "1"}, {}) is PRIMARY
+
+
+def test_lagging_or_down_replica_goes_to_primary():
+    router = ReadRouter(PRIMARY, REPLICA, max_lag=5)
+    router.lag = 6
+    assert router.engine_for({}, {}) is PRIMARY
+    router.lag = None
+    assert router.engine_for({}, {}) is PRIMARY
+
+
+def run(method, status):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": []})
+
+    messages = []
+
+    async def send(message):
+        messages.append(message)
+
+    middleware = ReadYourWritesMiddleware(app, sticky_seconds=10)
+    asyncio.run(middleware({"type": "http", "method": method}, None, send))
+    return dict(messages[0]["headers"]).get(b"set-cookie")
+
+
+def test_successful_writes_set_the_cookie():
+    assert (
+        run("POST", 200)
+        == f"{COOKIE}=1; Max-Age=10; Path=/; HttpOnly; SameSite=Lax".encode()
+    )
+    assert run("POST", 400) is None
+    assert run("GET", 200) is None
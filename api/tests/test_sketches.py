@@ -0,0 +1,167 @@
+import uuid
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from sqlalchemy import func
+from sqlmodel import select
+
+import decoding
+import sketches
+from models import SensorData, SensorTable, SketchProgress
+from sketches import DistinctSketch, QuantileSketch, Summary
+
+QS = [0.0, 0.01, 0.25, 0.5, 0.9, 0.99, 1.0]
+
+
+def _exact(values, qs):
+    ordered = np.sort(values)
+    return [ordered[int(q * (len(ordered) - 1))] for q in qs]
+
+
+def _assert_close(estimates, exact):
+    for estimate, value in zip(estimates, exact):
+        assert estimate == pytest.approx(
+            value, rel=sketches.RELATIVE_ACCURACY, abs=1e-9
+        )
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        np.random.default_rng(0).lognormal(3, 1, 100_000),
+        np.random.default_rng(1).normal(0, 50, 100_000),
+        np.r_[np.zeros(500), np.random.default_rng(2).uniform(1, 400, 2000)],
+        np.array([42.0]),
+    ],
+)
+def test_quantiles_are_within_the_relative_accuracy(values):
+    sketch = QuantileSketch()
+    sketch.add(values)
+    assert sketch.count() == len(values)
+    _assert_close(sketch.quantiles(QS), _exact(values, QS))
+
+
+def test_quantiles_of_nothing():
+    sketch = QuantileSketch()
+    sketch.add(np.array([np.nan]))
+    assert sketch.quantiles([0.5]) == [None]
+
+
+def test_quantile_merge_and_bytes():
+    values = np.random.default_rng(3).lognormal(2, 1.5, 30_000)
+    merged = QuantileSketch()
+    for part in np.array_split(values, 7):
+        sketch = QuantileSketch()
+        sketch.add(part)
+        merged.merge(QuantileSketch.from_bytes(sketch.to_bytes()))
+    whole = QuantileSketch()
+    whole.add(values)
+    assert merged.quantiles(QS) == whole.quantiles(QS)
+
+
+def test_quantile_bins_are_capped():
+    # magnitudes from 1e-6 to 1e12 need far more than MAX_BINS bins
+    values = np.geomspace(1e-6, 1e12, 100_000)
+    sketch = QuantileSketch()
+    sketch.add(values)
+    assert (
+        len(sketch.positive.counts) <= sketch.positive.counts.size <= sketches.MAX_BINS
+    )
+    assert sketch.count() == len(values)
+    # only the smallest values lose their accuracy
+    _assert_close(sketch.quantiles([0.5, 0.99]), _exact(values, [0.5, 0.99]))
+
+
+@pytest.mark.parametrize("distinct", [1, 10, 1000, 100_000])
+def test_distinct_estimate(distinct):
+    values = np.random.default_rng(4).permutation(np.arange(distinct, dtype=float))
+    sketch = DistinctSketch()
+    # duplicates don't count
+    sketch.add(np.tile(values, 2))
+    assert sketch.estimate() == pytest.approx(distinct, rel=0.05)
+
+
+def test_distinct_merge_and_bytes():
+    a, b = DistinctSketch(), DistinctSketch()
+    a.add(np.arange(0, 6000, dtype=float))
+    b.add(np.arange(4000, 10_000, dtype=float))
+    a.merge(DistinctSketch.from_bytes(b.to_bytes()))
+    assert a.estimate() == pytest.approx(10_000, rel=0.05)
+
+
+def test_distinct_zero_and_negative_zero_are_the_same():
+    sketch = DistinctSketch()
+    sketch.add(np.array([0.0, -0.0, np.nan]))
+    assert sketch.estimate() == 1
+
+
+def test_summary_round_trip():
+    values = np.random.default_rng(5).normal(100, 10, 5000)
+    summary = Summary()
+    summary.add(np.r_[values, np.nan])
+    row = summary.to_row(1, "distance", 3600, datetime(2024, 5, 1))
+    restored = Summary.from_row(SimpleNamespace(**row))
+    result = restored.to_json([0.5])
+    assert result["count"] == 5000
+    assert result["min"] == values.min() and result["max"] == values.max()
+    assert result["mean"] == pytest.approx(values.mean())
+    assert result["quantiles"]["0.5"] == pytest.approx(np.median(values), rel=0.01)
+    assert result["distinct"] == pytest.approx(5000, rel=0.05)
+
+
+def test_empty_summary():
+    row = Summary().to_row(1, "distance", 3600, datetime(2024, 5, 1))
+    assert row["min"] is None and row["max"] is None
+    assert Summary.from_row(SimpleNamespace(**row)).to_json([0.5])["count"] == 0
+
+
+def test_bucket_range_is_whole_hours():
+    assert sketches.bucket_range(
+        datetime(2024, 5, 1, 12, 30), datetime(2024, 5, 1, 14, 0, 1)
+    ) == (datetime(2024, 5, 1, 12), datetime(2024, 5, 1, 15))
+
+
+def test_rollup_stops_at_a_reading_that_is_too_new(session):
+    sensor = SensorTable(key=uuid.uuid4())
+    session.add(sensor)
+    session.flush()
+    # start after whatever the database already holds
+    last_id = session.exec(select(func.max(SensorData.sensor_data_id))).one() or 0
+    session.merge(SketchProgress(name=sketches.ROLLUP, sensor_data_id=last_id))
+
+    now = datetime.now()
+    recorded_at = now.replace(minute=0, second=0, microsecond=0)
+    readings = [
+        SensorData(
+            data=decoding.encode_binary(1, distance),
+            sensor_id_sensor_table=sensor.sensor_id,
+            time_recorded=recorded_at,
+            time_added=time_added,
+        )
+        # the lower id was added later, as when a worker is slow to insert
+        for distance, time_added in ((1.0, now), (2.0, now - timedelta(minutes=5)))
+    ]
+    session.add_all(readings)
+    session.flush()
+    connection = session.connection()
+
+    assert sketches.rollup(connection, batch_size=100, delay=60) == 0
+    session.expire_all()
+    assert session.get(SketchProgress, sketches.ROLLUP).sensor_data_id == last_id
+
+    readings[0].time_added = now - timedelta(minutes=2)
+    session.flush()
+    assert sketches.rollup(connection, batch_size=100, delay=60) == 2
+    session.expire_all()
+    progress = session.get(SketchProgress, sketches.ROLLUP)
+    assert progress.sensor_data_id == readings[1].sensor_data_id
+    sketch = session.exec(
+        select(sketches.SensorSketch).where(
+            sketches.SensorSketch.sensor_id_sensor_table == sensor.sensor_id,
+            sketches.SensorSketch.field == "distance",
+            sketches.SensorSketch.width == 3600,
+        )
+    ).one()
+    assert (sketch.count, sketch.sum) == (2, 3.0)
@@ -0,0 +1,63 @@
+import uuid
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+import stats
+from models import DailyStats, SensorStats, SensorTable
+
+
+def test_counters_add():
+    counters = stats.Counters()
+    counters.add(1, 2, datetime(2024, 5, 1, 12))
+    counters.add(1, 1, datetime(2024, 5, 1, 11))
+    counters.add(2, 3, datetime(2024, 5, 2, 9))
+    counters.add(3, 0, datetime(2024, 5, 2, 9))
+    assert counters._sensors == {
+        1: [3, datetime(2024, 5, 1, 12)],
+        2: [3, datetime(2024, 5, 2, 9)],
+    }
+    assert counters._days == {date(2024, 5, 1): 3, date(2024, 5, 2): 3}
+
+
+def test_flush_nothing():
+    assert stats.Counters().flush(engine=None) == 0
+
+
+def _sensor(session) -> int:
+    sensor = SensorTable(key=uuid.uuid4())
+    session.add(sensor)
+    session.flush()
+    return sensor.sensor_id
+
+
+def test_flush(session):
+    sensor_id = _sensor(session)
+    today = datetime.now().date()
+    before = session.get(DailyStats, today)
+    before = 0 if before is None else before.readings
+
+    counters = stats.Counters()
+    counters.add(sensor_id, 2, datetime.now())
+    # the session is bound to the test's connection, so its commit stays
+    # inside the transaction the test rolls back
+    assert counters.flush(session.connection()) == 2
+    counters.add(sensor_id, 3, datetime.now())
+    assert counters.flush(session.connection()) == 3
+
+    session.expire_all()
+    assert session.get(SensorStats, sensor_id).readings == 5
+    assert session.get(DailyStats, today).readings == before + 5
+    assert counters._sensors == {}
+
+
+def test_failed_flush_keeps_the_counts(session):
+    counters = stats.Counters()
+    added_at = datetime(2024, 5, 1, 12)
+    # no such sensor, the foreign key fails the upsert
+    counters.add(2**31 - 1, 4, added_at)
+    with pytest.raises(IntegrityError):
+        counters.flush(session.connection())
+    assert counters._sensors == {2**31 - 1: [4, added_at]}
+    assert counters._days == {date(2024, 5, 1): 4}
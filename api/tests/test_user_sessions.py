@@ -0,0 +1,77 @@
+import uuid
+from datetime import datetime, timedelta
+
+import user_sessions
+from models import User, UserSession
+
+POLICY = user_sessions.SessionPolicy(
+    idle_timeout=timedelta(days=7),
+    max_age=timedelta(days=30),
+    touch_interval=timedelta(minutes=1),
+)
+
+
+def _login(session, is_activated=True, last_used=None) -> str:
+    user = User(email=f"{uuid.uuid4()}@example.com", password_hash="x")
+    user.is_activated = is_activated
+    user.is_admin = False
+    session.add(user)
+    session.flush()
+    now = datetime.now()
+    token = uuid.uuid4()
+    session.add(
+        UserSession(
+            user_id_user=user.user_id,
+            session_token=token,
+            created_at=now,
+            last_used=last_used or now,
+        )
+    )
+    session.flush()
+    return str(token)
+
+
+def test_parse_token():
+    token = uuid.uuid4()
+    assert user_sessions.parse_token(str(token)) == token
+    assert user_sessions.parse_token("not a token") is None
+    assert user_sessions.parse_token(None) is None
+
+
+def test_is_expired():
+    now = datetime.now()
+    fresh = UserSession(user_id_user=1, created_at=now, last_used=now)
+    idle = UserSession(
+        user_id_user=1, created_at=now, last_used=now - timedelta(days=8)
+    )
+    old = UserSession(
+        user_id_user=1, created_at=now - timedelta(days=31), last_used=now
+    )
+    assert not POLICY.is_expired(fresh, now)
+    assert POLICY.is_expired(idle, now)
+    assert POLICY.is_expired(old, now)
+
+
+def test_lookup(session):
+    token = _login(session)
+    logged_in = user_sessions.lookup(session, POLICY, token)
+    assert logged_in is not None and not logged_in.is_admin
+    assert user_sessions.lookup(session, POLICY, str(uuid.uuid4())) is None
+
+
+def test_lookup_ignores_expired_sessions(session):
+    token = _login(session, last_used=datetime.now() - timedelta(days=8))
+    assert user_sessions.lookup(session, POLICY, token) is None
+
+
+def test_lookup_ignores_deactivated_users(session):
+    for is_activated in (False, None):
+        token = _login(session, is_activated=is_activated)
+        assert user_sessions.lookup(session, POLICY, token) is None
+
+
+def test_delete_for_user(session):
+    token = _login(session)
+    user_id = user_sessions.lookup(session, POLICY, token).user_id
+    assert user_sessions.delete_for_user(session, user_id) == [uuid.UUID(token)]
+    assert user_sessions.lookup(session, POLICY, token) is None
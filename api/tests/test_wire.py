@@ -0,0 +1,55 @@
+import struct
+import uuid
+from datetime import datetime
+
+import pytest
+
+import wire
+
+KEY = uuid.UUID("7d3f7c5e-2a4b-4f7e-9a51-0c6f1b2d3e4f")
+
+
+def test_round_trip():
+    readings = [
+        (KEY, datetime(2024, 5, 1, 12, 0, 0, 250), b"{'count': 1}", uuid.uuid4()),
+        (uuid.uuid4(), datetime(1969, 12, 31, 23, 59), b"", uuid.uuid4()),
+    ]
+    decoded = wire.decode_frames(wire.encode_frames(readings))
+    assert [(k, t, bytes(p), r) for k, t, p, r in decoded] == readings
+
+
+def test_v1_frames_have_no_reading_id():
+    body = wire.MAGIC_V1 + struct.pack("<16sqI", KEY.bytes, 1_000_000, 3) + b"abc"
+    [(sensor_key, recorded_at, payload, reading_id)] = wire.decode_frames(body)
+    assert sensor_key == KEY
+    assert recorded_at == datetime(1970, 1, 1, 0, 0, 1)
+    assert bytes(payload) == b"abc"
+    assert reading_id is None
+
+
+def test_empty_body():
+    assert wire.decode_frames(wire.MAGIC) == []
+
+
+@pytest.mark.parametrize(
+    "body, message",
+    [
+        (b"JSON{}", "magic"),
+        (wire.MAGIC + b"\0" * 10, "Truncated record header"),
+        (
+            wire.MAGIC + struct.pack("<16s16sqI", KEY.bytes, KEY.bytes, 0, 10) + b"abc",
+            "Truncated record payload",
+        ),
+        (
+            wire.MAGIC + struct.pack("<16s16sqI", KEY.bytes, KEY.bytes, 2**62, 0),
+            "Timestamp out of range",
+        ),
+        (
+            wire.MAGIC + struct.pack("<16s16sqI", KEY.bytes, KEY.bytes, -(2**62), 0),
+            "Timestamp out of range",
+        ),
+    ],
+)
+def test_invalid_frames(body, message):
+    with pytest.raises(wire.FrameError, match=message):
+        wire.decode_frames(body)
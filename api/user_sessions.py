@@ -0,0 +1,218 @@
+"""
+Login session lookup, expiry policy and the background reaper
+
+a session expires when it hasn't been used for `idle_timeout` or is older
+than `max_age`, expired sessions are ignored by lookups straight away and
+deleted in batches by the reaper
+"""
+
+import asyncio
+import logging
+import uuid
+from dataclasses import dataclass, replace
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, or_, update
+from sqlmodel import Session, select
+
+import metrics
+from models import User, UserSession
+
+logger = logging.getLogger("sensata.sessions")
+
+
+class SessionPolicy:
+    def __init__(
+        self,
+        idle_timeout: timedelta,
+        max_age: timedelta,
+        touch_interval: timedelta,
+    ):
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        # last_used is only written when it is older than this, so every
+        # authenticated request doesn't turn into a write
+        self.touch_interval = touch_interval
+
+    def expired_clause(self, now: datetime):
+        return or_(
+            UserSession.last_used < now - self.idle_timeout,
+            UserSession.created_at < now - self.max_age,
+        )
+
+    def is_expired(self, user_session, now: datetime) -> bool:
+        return (
+            user_session.last_used is not None
+            and user_session.last_used < now - self.idle_timeout
+        ) or (
+            user_session.created_at is not None
+            and user_session.created_at < now - self.max_age
+        )
+
+
+def parse_token(session_token: str | None) -> uuid.UUID | None:
+    if session_token is None:
+        return None
+    try:
+        return uuid.UUID(session_token)
+    except ValueError:
+        return None
+
+
+@dataclass
+class LoggedIn:
+    """
+    What a request needs to know about its session, safe to cache
+    """
+
+    user_id: int
+    is_admin: bool
+    session_id: int
+    created_at: datetime | None
+    last_used: datetime | None
+
+
+def lookup(session, policy: SessionPolicy, session_token: str | None, cache=None):
+    """
+    Return the LoggedIn of a valid token, or None
+
+    the token is looked up in `cache` (a LocalCache keyed by token) and then
+    through the unique index on session_token, last_used is refreshed at most
+    once per touch interval
+    """
+
+    token = parse_token(session_token)
+    if token is None:
+        return None
+
+    logged_in = None if cache is None else cache.get(token)
+    if logged_in is None:
+        generation = None if cache is None else cache.generation
+        row = session.exec(
+            select(User, UserSession)
+            .join(UserSession, UserSession.user_id_user == User.user_id)
+            .where(UserSession.session_token == token, User.is_activated.is_(True))
+        ).first()
+        if row is None:
+            return None
+
+        user, user_session = row
+        logged_in = LoggedIn(
+            user_id=user.user_id,
+            is_admin=user.is_admin,
+            session_id=user_session.session_id,
+            created_at=user_session.created_at,
+            last_used=user_session.last_used,
+        )
+        if cache is not None:
+            cache.set(token, logged_in, generation)
+
+    now = datetime.now()
+    if policy.is_expired(logged_in, now):
+        if cache is not None:
+            cache.evict([token])
+        return None
+
+    if logged_in.last_used is None or logged_in.last_used < now - policy.touch_interval:
+        session.exec(
+            update(UserSession)
+            .where(UserSession.session_id == logged_in.session_id)
+            .values(last_used=now)
+        )
+        session.commit()
+        # cached entries are shared between requests, never mutate them
+        logged_in = replace(logged_in, last_used=now)
+        if cache is not None:
+            cache.set(token, logged_in)
+
+    return logged_in
+
+
+def recent(session, policy: SessionPolicy, limit: int) -> dict:
+    """
+    Return {token: LoggedIn} of the most recently used valid sessions,
+    used to warm the session cache on startup
+    """
+
+    rows = session.exec(
+        select(User, UserSession)
+        .join(UserSession, UserSession.user_id_user == User.user_id)
+        .where(~policy.expired_clause(datetime.now()), User.is_activated.is_(True))
+        .order_by(UserSession.last_used.desc())
+        .limit(limit)
+    ).all()
+    return {
+        user_session.session_token: LoggedIn(
+            user_id=user.user_id,
+            is_admin=user.is_admin,
+            session_id=user_session.session_id,
+            created_at=user_session.created_at,
+            last_used=user_session.last_used,
+        )
+        for user, user_session in rows
+    }
+
+
+def delete_for_user(session, user_id: int) -> list[uuid.UUID]:
+    """
+    Delete every session of a user, return their tokens
+
+    the caller publishes the tokens to the "sessions" cache and commits
+    """
+
+    return list(
+        session.exec(
+            delete(UserSession)
+            .where(UserSession.user_id_user == user_id)
+            .returning(UserSession.session_token)
+        ).scalars()
+    )
+
+
+def delete_expired(engine, policy: SessionPolicy, batch_size: int) -> int:
+    """
+    Delete expired sessions in batches, return how many were deleted
+
+    every batch is its own short transaction so the reaper never holds
+    locks on a large part of the table
+    """
+
+    total = 0
+    while True:
+        with Session(engine) as session:
+            batch = (
+                select(UserSession.session_id)
+                .where(policy.expired_clause(datetime.now()))
+                .limit(batch_size)
+                .with_for_update(skip_locked=True)
+                .scalar_subquery()
+            )
+            deleted = session.exec(
+                delete(UserSession).where(UserSession.session_id.in_(batch))
+            ).rowcount
+            session.commit()
+
+        total += deleted
+        if deleted < batch_size:
+            break
+
+    if total:
+        metrics.SESSIONS_REAPED.inc(total)
+    return total
+
+
+async def reap_forever(engine, policy: SessionPolicy, interval: float, batch_size: int):
+    """
+    Run delete_expired every `interval` seconds until cancelled
+    """
+
+    while True:
+        try:
+            deleted = await asyncio.to_thread(
+                delete_expired, engine, policy, batch_size
+            )
+            if deleted:
+                logger.info("deleted %d expired sessions", deleted)
+        except Exception:
+            logger.exception("session reaper failed")
+        await asyncio.sleep(interval)
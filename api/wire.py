@@ -0,0 +1,107 @@
+"""
+Compact binary ingest format
+
+a body is the 4 byte magic followed by any number of records:
+
+    sensor key   16 bytes  (uuid, big endian as uuid.bytes)
+    reading id   16 bytes  (uuid chosen by the client, the same on a retry)
+    recorded_at   8 bytes  (signed little endian, microseconds since 1970-01-01,
+                            naive like the timestamps stored in sensor_data)
+    length        4 bytes  (unsigned little endian, payload length)
+    payload       length bytes (raw sensor data, no base64)
+
+bodies starting with MAGIC_V1 are the older layout without the reading id,
+their readings decode with a reading id of None
+"""
+
+import struct
+import uuid
+from datetime import datetime, timedelta
+
+MEDIA_TYPE = "application/x-sensata-frames"
+MAGIC = b"SNS2"
+MAGIC_V1 = b"SNS1"
+
+_HEADER = struct.Struct("<16s16sqI")
+_HEADER_V1 = struct.Struct("<16sqI")
+_EPOCH = datetime(1970, 1, 1)
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frames(readings) -> bytes:
+    """
+    Encode an iterable of (sensor_key, recorded_at, payload, reading_id)
+    into one body
+    """
+
+    parts = [MAGIC]
+    for sensor_key, recorded_at, payload, reading_id in readings:
+        micros = (recorded_at.replace(tzinfo=None) - _EPOCH) // timedelta(
+            microseconds=1
+        )
+        parts.append(
+            _HEADER.pack(sensor_key.bytes, reading_id.bytes, micros, len(payload))
+        )
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def decode_frames(
+    body: bytes,
+) -> list[tuple[uuid.UUID, datetime, memoryview, uuid.UUID | None]]:
+    """
+    Decode a body into (sensor_key, recorded_at, payload, reading_id) tuples
+
+    payloads are memoryview slices of body, nothing is copied until the
+    rows are handed to the database driver
+    """
+
+    view = memoryview(body)
+    if view[:4] == MAGIC:
+        header = _HEADER
+    elif view[:4] == MAGIC_V1:
+        header = _HEADER_V1
+    else:
+        raise FrameError("Body does not start with the frame magic")
+
+    readings = []
+    offset = len(MAGIC)
+    end = len(view)
+    header_size = header.size
+    unpack_from = header.unpack_from
+    # a batch usually carries few distinct sensors, so build each UUID once
+    keys = {}
+
+    while offset < end:
+        if end - offset < header_size:
+            raise FrameError("Truncated record header")
+        if header is _HEADER:
+            key, reading_id, micros, length = unpack_from(view, offset)
+            reading_id = uuid.UUID(bytes=reading_id)
+        else:
+            key, micros, length = unpack_from(view, offset)
+            reading_id = None
+        offset += header_size
+        if end - offset < length:
+            raise FrameError("Truncated record payload")
+        sensor_key = keys.get(key)
+        if sensor_key is None:
+            sensor_key = keys[key] = uuid.UUID(bytes=key)
+        try:
+            recorded_at = _EPOCH + timedelta(microseconds=micros)
+        except (OverflowError, ValueError):
+            raise FrameError("Timestamp out of range")
+        readings.append(
+            (
+                sensor_key,
+                recorded_at,
+                view[offset : offset + length],
+                reading_id,
+            )
+        )
+        offset += length
+
+    return readings
@@ -0,0 +1,344 @@
+"""
+Simulate a fleet of ultrasonic sensors against a (local) API instance
+
+the payload and upload code of sensorcode+api.py is reused as is, with the
+RPi.GPIO module replaced by a stub so it runs without Raspberry Pi hardware.
+every simulated sensor emits detections as a poisson process that switches
+between a normal and a burst rate, has its own clock skew, and suffers
+injected network failures which are retried like a real client would.
+
+run: python fleet_simulator.py --base-url http://localhost:8000 --sensors 2000 --rate 0.2
+"""
+
+import argparse
+import heapq
+import importlib.util
+import json
+import queue
+import random
+import sys
+import threading
+import time
+import types
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import requests
+
+
+def stub_gpio():
+    """Install a do-nothing RPi.GPIO module so the client can be imported."""
+    gpio = types.ModuleType("RPi.GPIO")
+    gpio.BCM = "BCM"
+    gpio.OUT = "OUT"
+    gpio.IN = "IN"
+    gpio.setmode = lambda mode: None
+    gpio.setup = lambda pin, direction: None
+    gpio.output = lambda pin, value: None
+    gpio.input = lambda pin: 0
+    gpio.cleanup = lambda: None
+
+    rpi = types.ModuleType("RPi")
+    rpi.GPIO = gpio
+    sys.modules["RPi"] = rpi
+    sys.modules["RPi.GPIO"] = gpio
+
+
+def load_client():
+    """Import sensorcode+api.py (its name isn't a valid module name)."""
+    stub_gpio()
+    path = Path(__file__).with_name("sensorcode+api.py")
+    spec = importlib.util.spec_from_file_location("sensorcode_api", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class SimulatedSensor:
+    def __init__(self, key, rate, burst_rate, burstiness, skew, rng):
+        self.key = key
+        self.rate = rate
+        self.burst_rate = burst_rate
+        self.burstiness = burstiness
+        self.skew = timedelta(seconds=skew)
+        self.rng = rng
+        self.in_burst = False
+        self.count = 0
+
+    def next_delay(self):
+        """Seconds until the next detection, switching burst state on the way."""
+        # at every detection there's a chance of entering or leaving a burst
+        if self.rng.random() < self.burstiness:
+            self.in_burst = not self.in_burst
+        rate = self.burst_rate if self.in_burst else self.rate
+        return self.rng.expovariate(rate)
+
+    def detect(self):
+        self.count += 1
+        # below the client's DISTANCE_THRESHOLD, like a real detection
+        return self.count, round(self.rng.uniform(20, 119), 2)
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.sent = 0
+        self.accepted = 0
+        self.lost = 0
+        self.retries = 0
+        self.injected_failures = 0
+        self.statuses = {}
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def summary(self, elapsed):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if not latencies:
+                return None
+            index = min(len(latencies) - 1, round(p / 100 * (len(latencies) - 1)))
+            return latencies[index] * 1000
+
+        return {
+            "elapsed_s": elapsed,
+            "readings_sent": self.sent,
+            "readings_accepted": self.accepted,
+            "readings_lost": self.lost,
+            "loss_rate": self.lost / self.sent if self.sent else 0.0,
+            "retries": self.retries,
+            "injected_failures": self.injected_failures,
+            "accepted_per_s": self.accepted / elapsed if elapsed else 0.0,
+            "latency_p50_ms": percentile(50),
+            "latency_p95_ms": percentile(95),
+            "latency_p99_ms": percentile(99),
+            "statuses": self.statuses,
+        }
+
+
+def provision_sensors(client, base_url, n, timeout, chunk=1000):
+    """Create n sensors through the bulk API and return their keys."""
+    keys = []
+    for start in range(0, n, chunk):
+        response = requests.post(
+            base_url + "/api/v1/sensors/bulk",
+            json={
+                "sensors": [
+                    {
+                        "model_name": "simulated HC-SR04",
+                        "manufacturer": "fleet simulator",
+                        "serial_number": f"SIM-{i}",
+                    }
+                    for i in range(start, min(n, start + chunk))
+                ]
+            },
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        keys.extend(uuid.UUID(sensor["key"]) for sensor in response.json())
+    return keys
+
+
+def upload_worker(client, jobs, stats, args, rng_seed):
+    """Take readings off the queue and upload them, retrying on failure."""
+    rng = random.Random(rng_seed)
+    http = requests.Session()
+    api_url = args.base_url + "/api/v1/data"
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            return
+        created, readings = job
+
+        delivered = False
+        status = None
+        for attempt in range(args.retries + 1):
+            if attempt > 0:
+                stats.add(retries=1)
+                time.sleep(args.retry_backoff * 2 ** (attempt - 1))
+            try:
+                if rng.random() < args.failure_rate:
+                    stats.add(injected_failures=1)
+                    raise requests.ConnectionError("injected network failure")
+                if args.batch_size > 0:
+                    response = client.upload_batch(
+                        readings, http=http, api_url=api_url, timeout=args.timeout
+                    )
+                else:
+                    key, recorded_at, payload, reading_id = readings[0]
+                    response = client.upload_reading(
+                        client.build_request_data(
+                            key, recorded_at, payload, reading_id
+                        ),
+                        http=http,
+                        api_url=api_url,
+                        timeout=args.timeout,
+                    )
+                status = str(response.status_code)
+                if response.status_code < 500 and response.status_code != 429:
+                    delivered = response.ok
+                    break
+            except requests.RequestException as e:
+                status = type(e).__name__
+
+        latency = time.monotonic() - created
+        with stats.lock:
+            stats.statuses[status] = stats.statuses.get(status, 0) + 1
+            if delivered:
+                stats.accepted += len(readings)
+                stats.latencies.append(latency)
+            else:
+                stats.lost += len(readings)
+
+
+def run(args):
+    client = load_client()
+    rng = random.Random(args.seed)
+
+    if args.keys_file:
+        keys = [
+            uuid.UUID(line.strip())
+            for line in Path(args.keys_file).read_text().splitlines()
+            if line.strip()
+        ][: args.sensors]
+    else:
+        print(f"provisioning {args.sensors} sensors")
+        keys = provision_sensors(client, args.base_url, args.sensors, args.timeout)
+
+    sensors = [
+        SimulatedSensor(
+            key,
+            args.rate,
+            args.rate * args.burst_factor,
+            args.burstiness,
+            rng.uniform(-args.clock_skew, args.clock_skew),
+            random.Random(rng.random()),
+        )
+        for key in keys
+    ]
+
+    stats = Stats()
+    jobs = queue.Queue(maxsize=args.workers * 4)
+    workers = [
+        threading.Thread(
+            target=upload_worker,
+            args=(client, jobs, stats, args, rng.random()),
+            daemon=True,
+        )
+        for _ in range(args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    start = time.monotonic()
+    deadline = start + args.duration
+    # (due time, sensor index), one entry per sensor
+    schedule = [(start + sensor.next_delay(), i) for i, sensor in enumerate(sensors)]
+    heapq.heapify(schedule)
+    pending = {}
+    next_report = start + 5
+
+    print(f"simulating {len(sensors)} sensors for {args.duration:.0f}s")
+    while schedule and schedule[0][0] < deadline:
+        due, i = heapq.heappop(schedule)
+        now = time.monotonic()
+        if due > now:
+            time.sleep(due - now)
+
+        sensor = sensors[i]
+        count, distance = sensor.detect()
+        recorded_at = datetime.now() + sensor.skew
+        # the reading id stays the same on every retry, so retries that did
+        # reach the api aren't stored twice
+        reading = (
+            sensor.key,
+            recorded_at,
+            client.build_payload(count, distance),
+            client.uuid7(),
+        )
+        stats.add(sent=1)
+
+        if args.batch_size > 0:
+            batch = pending.setdefault(i, [])
+            batch.append(reading)
+            if len(batch) >= args.batch_size:
+                # latency is measured from the first (oldest) reading in the batch
+                jobs.put((due, pending.pop(i)))
+        else:
+            # blocks when the workers can't keep up, which shows up as latency
+            jobs.put((due, [reading]))
+
+        heapq.heappush(schedule, (due + sensor.next_delay(), i))
+
+        if now >= next_report:
+            next_report = now + 5
+            print(
+                f"{now - start:6.0f}s sent={stats.sent} accepted={stats.accepted} "
+                f"lost={stats.lost} queued={jobs.qsize()}"
+            )
+
+    # flush partial batches
+    for batch in pending.values():
+        jobs.put((time.monotonic(), batch))
+    for _ in workers:
+        jobs.put(None)
+    for worker in workers:
+        worker.join()
+
+    return stats.summary(time.monotonic() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--sensors", type=int, default=1000)
+    parser.add_argument(
+        "--keys-file", help="file with one sensor key per line instead of provisioning"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=0.1, help="detections per second per sensor"
+    )
+    parser.add_argument(
+        "--burst-factor", type=float, default=10.0, help="rate multiplier in a burst"
+    )
+    parser.add_argument(
+        "--burstiness",
+        type=float,
+        default=0.05,
+        help="chance per detection of switching in or out of a burst",
+    )
+    parser.add_argument(
+        "--clock-skew", type=float, default=2.0, help="max sensor clock skew (s)"
+    )
+    parser.add_argument(
+        "--failure-rate",
+        type=float,
+        default=0.01,
+        help="chance of an injected network failure per attempt",
+    )
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--retry-backoff", type=float, default=0.2)
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument(
+        "--batch-size", type=int, default=0, help="readings per binary batch upload"
+    )
+    parser.add_argument("--workers", type=int, default=32, help="upload threads")
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the summary as json to this file")
+    args = parser.parse_args()
+
+    summary = run(args)
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        Path(args.output).write_text(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
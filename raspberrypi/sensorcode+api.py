@@ -1,6 +1,10 @@
+import csv
+import os
 import sys
-from datetime import datetime
-from time import sleep, time
+import struct
+import uuid
+from datetime import datetime, timedelta
+from time import sleep, time, time_ns
 import RPi.GPIO as GPIO
 import requests
 import base64
@@ -12,13 +16,30 @@ TRIG = 23
 ECHO = 24
 DISTANCE_THRESHOLD = 120  # in cm
 
+API_URL = "https://idp_api.arfff.dog/api/v1/data"
 
-# Initialize GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(TRIG, GPIO.OUT)
-GPIO.setup(ECHO, GPIO.IN)
+# binary batch format, must match api/wire.py
+FRAME_MEDIA_TYPE = "application/x-sensata-frames"
+FRAME_MAGIC = b"SNS2"
+FRAME_HEADER = struct.Struct("<16s16sqI")
+EPOCH = datetime(1970, 1, 1)
 
-count = 0
+# binary payload layout, must match api/decoding.py
+PAYLOAD_BINARY_TAG = 1
+PAYLOAD_BINARY = struct.Struct("<BId")
+PAYLOAD_SUMMARY_TAG = 2
+PAYLOAD_SUMMARY = struct.Struct("<BIdIddI")
+
+# raw detections kept on the pi in edge mode, in the csv layout of
+# api/import_readings.py
+RAW_LOG_FIELDS = ["sensor_key", "recorded_at", "payload", "reading_id"]
+
+
+def setup_gpio():
+    """Initialize the GPIO pins of the ultrasonic sensor."""
+    GPIO.setmode(GPIO.BCM)
+    GPIO.setup(TRIG, GPIO.OUT)
+    GPIO.setup(ECHO, GPIO.IN)
 
 
 def measure_distance():
@@ -45,42 +66,245 @@ def measure_distance():
     return round(distance, 2)
 
 
-# load the environment variables
-env = dotenv_values(".env")
-api_key = env["API_KEY"]
-
-try:
-    print("Starting ultrasonic monitoring. Press Ctrl+C to exit.")
-    while True:
-        distance = measure_distance()
-        print(f"Measured Distance: {distance} cm")
-
-        if distance < DISTANCE_THRESHOLD:
-            count += 1
-            timestamp = datetime.now()
-            print(f"Object detected! Total Count: {count}")
-
-            data = {"count": count, distance: distance}
-            # convert the data to string
-            data = str(data)
-            # encode the data to base64
-            data = base64.b64encode(data.encode()).decode()
-
-            req_data = {
-                "recorded_at": datetime.now(),
-                "data": data,
-                "sensor_key": api_key,
-            }
-
-            # Save data to the database using the API
-            response = requests.post(
-                "https://idp_api.arfff.dog/api/v1/data", json=req_data
+def uuid7():
+    """A time ordered reading id: unix milliseconds then random bits, like api/ids.py."""
+    millis = time_ns() // 1_000_000
+    random = int.from_bytes(os.urandom(10), "big") & ((1 << 76) - 1) & ~(0x3 << 62)
+    return uuid.UUID(int=(millis << 80) | (0x7 << 76) | (0x2 << 62) | random)
+
+
+def build_payload(count, distance, binary=False):
+    """Build the raw payload bytes of one detection."""
+    if binary:
+        return PAYLOAD_BINARY.pack(PAYLOAD_BINARY_TAG, count, distance)
+    data = {"count": count, "distance": distance}
+    # convert the data to string
+    return str(data).encode()
+
+
+class Window:
+    """Detections of one fixed aggregation window."""
+
+    def __init__(self, start, seconds):
+        self.start = start
+        self.end = start + timedelta(seconds=seconds)
+        self.seconds = seconds
+        self.detections = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, distance):
+        self.detections += 1
+        self.total += distance
+        self.min = distance if self.min is None else min(self.min, distance)
+        self.max = distance if self.max is None else max(self.max, distance)
+
+
+def window_start(timestamp, seconds):
+    """The start of the window a timestamp falls in, windows are aligned to the epoch."""
+    elapsed = (timestamp - EPOCH) // timedelta(seconds=seconds)
+    return EPOCH + elapsed * timedelta(seconds=seconds)
+
+
+def build_summary_payload(count, window, binary=False):
+    """Build the payload of one window, count is the running count at its end."""
+    mean = round(window.total / window.detections, 2)
+    if binary:
+        return PAYLOAD_SUMMARY.pack(
+            PAYLOAD_SUMMARY_TAG,
+            count,
+            mean,
+            window.detections,
+            window.min,
+            window.max,
+            window.seconds,
+        )
+    # the api reads the count first and the distance last, like a single reading
+    data = {
+        "count": count,
+        "detections": window.detections,
+        "min": window.min,
+        "max": window.max,
+        "window": window.seconds,
+        "distance": mean,
+    }
+    return str(data).encode()
+
+
+def log_raw_event(path, sensor_key, timestamp, payload, reading_id, max_bytes):
+    """Append a raw detection to the local log, the full log is moved to path.1."""
+    if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+        os.replace(path, path + ".1")
+    new = not os.path.exists(path)
+    with open(path, "a", newline="") as file:
+        writer = csv.writer(file)
+        if new:
+            writer.writerow(RAW_LOG_FIELDS)
+        writer.writerow(
+            [sensor_key, timestamp.isoformat(), payload.decode(), reading_id]
+        )
+
+
+def build_request_data(sensor_key, timestamp, payload, reading_id):
+    """Build the json body of a single reading upload."""
+    return {
+        "recorded_at": timestamp.isoformat(),
+        # encode the data to base64
+        "data": base64.b64encode(payload).decode(),
+        "sensor_key": str(sensor_key),
+        # the api stores a reading id once, so retries can't duplicate it
+        "reading_id": str(reading_id),
+    }
+
+
+def upload_reading(req_data, http=requests, api_url=API_URL, timeout=10):
+    """Save one reading to the database using the API."""
+    return http.post(api_url, json=req_data, timeout=timeout)
+
+
+def encode_frames(readings):
+    """Encode (sensor_key, recorded_at, payload bytes, reading_id) readings into one batch body."""
+    parts = [FRAME_MAGIC]
+    for sensor_key, recorded_at, payload, reading_id in readings:
+        micros = (recorded_at - EPOCH) // timedelta(microseconds=1)
+        parts.append(
+            FRAME_HEADER.pack(sensor_key.bytes, reading_id.bytes, micros, len(payload))
+        )
+        parts.append(payload)
+    return b"".join(parts)
+
+
+def upload_batch(readings, http=requests, api_url=API_URL, timeout=10):
+    """Upload buffered readings in one request using the binary batch format."""
+    return http.post(
+        api_url + "/batch",
+        data=encode_frames(readings),
+        headers={"Content-Type": FRAME_MEDIA_TYPE},
+        timeout=timeout,
+    )
+
+
+def with_retries(upload, retries, backoff=1.0):
+    """Call upload until the API answers, the same body (and reading ids) is sent every time."""
+    retry_after = 0
+    for attempt in range(retries + 1):
+        if attempt > 0:
+            sleep(max(backoff * 2 ** (attempt - 1), retry_after))
+        try:
+            response = upload()
+            if response.status_code < 500 and response.status_code != 429:
+                return response
+            print(f"Upload failed with status {response.status_code}")
+            # the api rate limits uploads and says when to come back
+            retry_after = float(response.headers.get("Retry-After") or 0)
+        except requests.RequestException as e:
+            print(f"Upload failed: {e}")
+    return None
+
+
+def main():
+    # load the environment variables
+    env = dotenv_values(".env")
+    api_key = uuid.UUID(env["API_KEY"])
+    api_url = env.get("API_URL") or API_URL
+    # readings per binary batch upload, 0 sends every reading as json straight away
+    batch_size = int(env.get("BATCH_SIZE") or 0)
+    # "binary" stores 13 byte payloads instead of the text of a dict
+    binary_payload = (env.get("PAYLOAD_FORMAT") or "text") == "binary"
+    upload_retries = int(env.get("UPLOAD_RETRIES") or 3)
+    # readings kept while the API can't be reached, the oldest are dropped
+    max_pending = int(env.get("MAX_PENDING_READINGS") or 10000)
+    # edge mode: seconds per window, one summary is uploaded per window with
+    # detections instead of every detection, 0 uploads every detection
+    window_seconds = int(env.get("AGGREGATE_WINDOW") or 0)
+    raw_log = env.get("RAW_LOG") or "raw_events.csv"
+    raw_log_max_bytes = int(env.get("RAW_LOG_MAX_BYTES") or 50 * 1024 * 1024)
+    batch = []
+    window = None
+
+    def flush():
+        """Upload the batch, it's kept for the next upload if that fails."""
+        sent = with_retries(
+            lambda: upload_batch(batch, api_url=api_url),
+            upload_retries,
+        )
+        # a failed batch is sent again with the next one, the
+        # readings that did get stored are skipped by the api
+        if sent is not None:
+            batch.clear()
+        elif len(batch) > max_pending:
+            print(f"Dropping the {len(batch) - max_pending} oldest readings")
+            del batch[: len(batch) - max_pending]
+
+    def send(timestamp, payload):
+        """Upload one reading, or add it to the batch."""
+        reading_id = uuid7()
+        if batch_size > 0:
+            # raw bytes go into the batch, no base64 needed
+            batch.append((api_key, timestamp, payload, reading_id))
+            if len(batch) >= batch_size:
+                flush()
+        else:
+            req_data = build_request_data(api_key, timestamp, payload, reading_id)
+            with_retries(
+                lambda: upload_reading(req_data, api_url=api_url),
+                upload_retries,
             )
 
-            sleep(1)  # Avoid rapid overcounting
+    setup_gpio()
+    count = 0
+
+    try:
+        print("Starting ultrasonic monitoring. Press Ctrl+C to exit.")
+        while True:
+            distance = measure_distance()
+            print(f"Measured Distance: {distance} cm")
+
+            # a window is sent once it's over, windows without detections aren't
+            if window is not None and datetime.now() >= window.end:
+                send(window.start, build_summary_payload(count, window, binary_payload))
+                window = None
+
+            if distance < DISTANCE_THRESHOLD:
+                count += 1
+                timestamp = datetime.now()
+                print(f"Object detected! Total Count: {count}")
+
+                if window_seconds > 0:
+                    if window is None:
+                        window = Window(
+                            window_start(timestamp, window_seconds), window_seconds
+                        )
+                    window.add(distance)
+                    # the raw detection stays on the pi, import_readings.py
+                    # uploads the log if it's ever needed
+                    log_raw_event(
+                        raw_log,
+                        api_key,
+                        timestamp,
+                        build_payload(count, distance),
+                        uuid7(),
+                        raw_log_max_bytes,
+                    )
+                else:
+                    send(timestamp, build_payload(count, distance, binary_payload))
+
+                sleep(1)  # Avoid rapid overcounting
+
+    except KeyboardInterrupt:
+        print("\nCtrl-C pressed. Cleaning up GPIO and closing database connection.")
+        try:
+            # the window in progress and the readings still in the batch
+            if window is not None:
+                send(window.start, build_summary_payload(count, window, binary_payload))
+            if batch:
+                flush()
+        finally:
+            GPIO.cleanup()
+        print("Database connection closed. Exiting.")
+        sys.exit(0)
+
 
-except KeyboardInterrupt:
-    print("\nCtrl-C pressed. Cleaning up GPIO and closing database connection.")
-    GPIO.cleanup()
-    print("Database connection closed. Exiting.")
-    sys.exit(0)
+if __name__ == "__main__":
+    main()
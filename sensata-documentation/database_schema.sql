@@ -46,9 +46,10 @@ ALTER SEQUENCE public.auto_incrementing_user_session_id_sequence OWNER TO postgr
 -- object: public.auto_incrementing_sensor_data_id_sequence | type: SEQUENCE --
 -- DROP SEQUENCE IF EXISTS public.auto_incrementing_sensor_data_id_sequence CASCADE;
 CREATE SEQUENCE public.auto_incrementing_sensor_data_id_sequence
+	AS bigint
 	INCREMENT BY 1
 	MINVALUE 0
-	MAXVALUE 2147483647
+	MAXVALUE 9223372036854775807
 	START WITH 1
 	CACHE 1
 	NO CYCLE
@@ -123,7 +124,7 @@ ALTER TABLE public.sensor_table OWNER TO postgres;
 -- object: public.sensor_data | type: TABLE --
 -- DROP TABLE IF EXISTS public.sensor_data CASCADE;
 CREATE TABLE public.sensor_data (
-	sensor_data_id integer NOT NULL DEFAULT nextval('public.auto_incrementing_sensor_data_id_sequence'::regclass),
+	sensor_data_id bigint NOT NULL DEFAULT nextval('public.auto_incrementing_sensor_data_id_sequence'::regclass),
 	data bytea NOT NULL,
 	sensor_id_sensor_table smallint,
 	CONSTRAINT sensor_data_id_pk PRIMARY KEY (sensor_data_id)